@@ -2,71 +2,35 @@
 import sys
 import pymysql
 from pymysql.err import OperationalError
-import hashlib
+from shard_config import router, connect_to_shard
+from shard_router import locate_venue
+from procedures import upsert_venue, ADDED
 
-# Replace the placeholders with the actual database connection details
-EventManager1_Connection_Params = {
-    'host': 'localhost',
-    'user': 'dsci551',
-    'password': 'Dsci-551',
-    'database': 'Event_Manager1'
-}
 
-EventManager2_Connection_Params = {
-    'host': 'localhost',
-    'user': 'dsci551',
-    'password': 'Dsci-551',
-    'database': 'Event_Manager2'
-}
+# Insert a venue on the given connection unless one with the same name exists; returns True if it was added.
+# The check and the insert are one call of the sp_upsert_venue procedure.
+def insert_venue(connection, venue_name, city, capacity, price_per_hour):
+    status, _ = upsert_venue(connection, venue_name, city, capacity, price_per_hour)
+    return status == ADDED
 
-# List of connection parameters for easy iteration
-connections_params = [EventManager1_Connection_Params, EventManager2_Connection_Params]
-
-
-# Generic hash function to choose the database based on any string input
-def choose_database(input_string):
-    # Create a hash of the input string
-    hash_object = hashlib.sha256(input_string.encode())
-    hash_digest = hash_object.hexdigest()
-    # Determine the target database using the hash value
-    if int(hash_digest, 16) % 2 == 0:
-        return EventManager1_Connection_Params
-    else:
-        return EventManager2_Connection_Params
-
-
-# Existing functions and connection parameters...
 
 def add_venue(venue_name, city, capacity, price_per_hour):
-    # Choose the target database based on the venue name
-    connection_params = choose_database(venue_name)
-
     try:
-        # Connect to the database
-        connection = pymysql.connect(host=connection_params['host'],
-                                     user=connection_params['user'],
-                                     password=connection_params['password'],
-                                     database=connection_params['database'],
-                                     cursorclass=pymysql.cursors.DictCursor)
-        with connection.cursor() as cursor:
-            # Check if the venue already exists
-            cursor.execute("SELECT ID FROM Venues WHERE Name = %s", (venue_name,))
-            if cursor.fetchone() is None:
-                # Insert the new venue if it doesn't exist
-                cursor.execute("INSERT INTO Venues (Name, City, Capacity, Price_per_hour) VALUES (%s, %s, %s, %s)",
-                               (venue_name, city, capacity, price_per_hour))
-                connection.commit()
-                print(f"Venue '{venue_name}' added successfully.")
-            else:
-                print(f"Venue '{venue_name}' already exists.")
+        # Choose the target database based on the venue name: its owner on the shard ring,
+        # or the shard it still lives on while a resharding is in progress
+        db_name = locate_venue(router, connect_to_shard, venue_name)
+        # Borrow a pooled connection to the database
+        with connect_to_shard(db_name) as connection:
+            added = insert_venue(connection, venue_name, city, capacity, price_per_hour)
+        if added:
+            print(f"Venue '{venue_name}' added successfully.")
+        else:
+            print(f"Venue '{venue_name}' already exists.")
+        return added
     except pymysql.err.OperationalError as e:
         print(f"An error occurred: {e}")
-    finally:
-        if connection:
-            connection.close()
-
+        return False
 
-# Don't forget to define or import your choose_database function if it's not already included above
 
 if __name__ == "__main__":
     if len(sys.argv) == 5:
@@ -0,0 +1,263 @@
+# IMPORT LIBRARIES
+import time
+import contextvars
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import pandas as pd
+from db_metrics import InstrumentedSSCursor
+from retention import archive_tables
+
+OPEN_HOURS = range(13, 23)  # the booking tab offers 1 PM to 11 PM, utilization is measured against these hours
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+# Only four integers per booking cross the wire: venue, day offset from the start date, start and end minute
+BOOKINGS_QUERY = """
+    SELECT vu.VenueID, DATEDIFF(b.Date, %s), TIME_TO_SEC(b.Start_time) DIV 60, TIME_TO_SEC(b.End_time) DIV 60
+    FROM Bookings b
+    JOIN VenueUsed vu ON vu.BookingID = b.ID
+    WHERE b.Date BETWEEN %s AND %s
+    """
+
+# The same four integers from one month's archive table (see retention.py)
+ARCHIVE_QUERY = """
+    SELECT VenueID, DATEDIFF(Date, %s), TIME_TO_SEC(Start_time) DIV 60, TIME_TO_SEC(End_time) DIV 60
+    FROM {table}
+    WHERE Date BETWEEN %s AND %s
+    """
+
+
+class BookingFrame:
+    """
+    Columnar bookings of every shard for a date range.
+
+    bookings has one row per booking with int32 columns venue (a row of venues), day (days
+    after start_date), start and end (minutes after midnight). venues has Name, City,
+    Price_per_hour and Shard, indexed by the same venue codes.
+    """
+    def __init__(self, bookings, venues, start_date, end_date, errors, seconds):
+        self.bookings = bookings
+        self.venues = venues
+        self.start_date = start_date
+        self.end_date = end_date
+        self.errors = errors  # shard name -> error message for shards that are missing
+        self.seconds = seconds
+
+    @property
+    def days(self):
+        return (self.end_date - self.start_date).days + 1
+
+    @property
+    def partial(self):
+        return bool(self.errors)
+
+
+def _date_chunks(start_date, end_date, parts):
+    days = (end_date - start_date).days + 1
+    step = max(1, -(-days // parts))
+    for first in range(0, days, step):
+        yield start_date + timedelta(days=first), start_date + timedelta(days=min(days, first + step) - 1)
+
+
+def _load_venues(connect, db_name):
+    with connect(db_name) as connection:
+        with connection.cursor(InstrumentedSSCursor) as cursor:
+            cursor.execute("SELECT ID, Name, City, Price_per_hour FROM Venues")
+            return list(cursor)
+
+
+# One date chunk of one shard, streamed and converted to arrays fetch_size rows at a time: the 64-bit venue
+# IDs and an int32 array of day, start and end; with include_archive the chunk's months in the archive tables
+# are read as well
+def _load_bookings(connect, db_name, start_date, first, last, fetch_size, include_archive):
+    venue_ids = []
+    arrays = []
+    with connect(db_name) as connection:
+        queries = [BOOKINGS_QUERY]
+        if include_archive:
+            with connection.cursor() as cursor:
+                queries += [ARCHIVE_QUERY.format(table=table) for table in archive_tables(cursor, first, last)]
+        for query in queries:
+            with connection.cursor(InstrumentedSSCursor) as cursor:
+                cursor.execute(query, (start_date, first, last))
+                while True:
+                    rows = cursor.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    batch = np.array(rows, dtype=np.int64).reshape(-1, 4)
+                    venue_ids.append(batch[:, 0])
+                    arrays.append(batch[:, 1:].astype(np.int32))
+    if not arrays:
+        return np.empty(0, dtype=np.int64), np.empty((0, 3), dtype=np.int32)
+    return np.concatenate(venue_ids), np.concatenate(arrays)
+
+
+def load_booking_frame(connect, db_names, start_date, end_date, parts=4, fetch_size=50000, timeout=300.0,
+                       include_archive=True):
+    """
+    Loads every booking between start_date and end_date (inclusive) with its venue, including
+    archived bookings unless include_archive is False.
+    Each shard's date range is split into `parts` chunks read in parallel on separate pooled
+    connections; shards that fail or time out are reported in errors and left out.
+    """
+    started = time.monotonic()
+    db_names = list(db_names)
+    executor = ThreadPoolExecutor(max_workers=len(db_names) * (parts + 1), thread_name_prefix='analytics')
+
+    def submit(function, *args):
+        return executor.submit(contextvars.copy_context().run, function, *args)
+
+    try:
+        venue_futures = {submit(_load_venues, connect, db_name): db_name for db_name in db_names}
+        booking_futures = {submit(_load_bookings, connect, db_name, start_date, first, last, fetch_size,
+                                  include_archive): db_name
+                           for db_name in db_names for first, last in _date_chunks(start_date, end_date, parts)}
+        done, pending = wait(list(venue_futures) + list(booking_futures), timeout=timeout)
+    finally:
+        # Workers still running finish in the background and give their connections back
+        executor.shutdown(wait=False)
+
+    errors = {}
+    for future in pending:
+        errors[venue_futures.get(future) or booking_futures[future]] = f"Timed out after {timeout:.0f}s"
+    for future in done:
+        if future.exception() is not None:
+            errors[venue_futures.get(future) or booking_futures[future]] = str(future.exception())
+
+    # Venue IDs are only unique per shard, so venues get one code across all shards
+    venue_frames = []
+    booking_arrays = []
+    code_offset = 0
+    for db_name in db_names:
+        if db_name in errors:
+            continue
+        shard_venues = next(future.result() for future, name in venue_futures.items() if name == db_name)
+        ids = np.array([venue[0] for venue in shard_venues], dtype=np.int64)
+        venue_frames.append(pd.DataFrame({'Name': [venue[1] for venue in shard_venues],
+                                          'City': [venue[2] for venue in shard_venues],
+                                          'Price_per_hour': np.array([venue[3] for venue in shard_venues], dtype=np.float64),
+                                          'Shard': db_name}))
+        # Global IDs are sparse 64-bit numbers, so a booking's venue code is its ID's position in a hash index
+        positions = pd.Index(ids)
+        for future, name in booking_futures.items():
+            if name == db_name:
+                booking_venues, columns = future.result()
+                codes = positions.get_indexer(booking_venues)
+                # Bookings of venues added after the venues were read have no code and are dropped
+                known = codes >= 0
+                booking_arrays.append(np.column_stack([(codes[known] + code_offset).astype(np.int32), columns[known]]))
+        code_offset += len(ids)
+
+    venues = pd.concat(venue_frames, ignore_index=True) if venue_frames else \
+        pd.DataFrame({'Name': [], 'City': [], 'Price_per_hour': [], 'Shard': []})
+    array = np.concatenate(booking_arrays) if booking_arrays else np.empty((0, 4), dtype=np.int32)
+    bookings = pd.DataFrame({'venue': array[:, 0], 'day': array[:, 1], 'start': array[:, 2], 'end': array[:, 3]})
+    return BookingFrame(bookings, venues, start_date, end_date, errors, time.monotonic() - started)
+
+
+def booking_costs(frame):
+    """Cost of every booking: hours booked times the venue's hourly rate"""
+    hours = (frame.bookings['end'].to_numpy() - frame.bookings['start'].to_numpy()) / 60.0
+    return hours * frame.venues['Price_per_hour'].to_numpy()[frame.bookings['venue'].to_numpy()]
+
+
+def revenue(frame):
+    """Returns revenue and bookings per venue, per city and per day as DataFrames"""
+    venue_codes = frame.bookings['venue'].to_numpy()
+    costs = booking_costs(frame)
+    hours = (frame.bookings['end'].to_numpy() - frame.bookings['start'].to_numpy()) / 60.0
+    count = len(frame.venues)
+
+    by_venue = frame.venues[['Name', 'City']].copy()
+    by_venue['Bookings'] = np.bincount(venue_codes, minlength=count)
+    by_venue['Hours'] = np.bincount(venue_codes, weights=hours, minlength=count)
+    by_venue['Revenue'] = np.bincount(venue_codes, weights=costs, minlength=count)
+    # Share of the open hours in the range that the venue was booked
+    by_venue['Occupancy'] = by_venue['Hours'] / (frame.days * len(OPEN_HOURS))
+    by_venue = by_venue.sort_values('Revenue', ascending=False)
+
+    by_city = by_venue.groupby('City', sort=False).agg(Venues=('Name', 'size'), Bookings=('Bookings', 'sum'),
+                                                       Hours=('Hours', 'sum'), Revenue=('Revenue', 'sum'))
+    by_city['Occupancy'] = by_city['Hours'] / (by_city['Venues'] * frame.days * len(OPEN_HOURS))
+    by_city = by_city.sort_values('Revenue', ascending=False)
+
+    days = frame.bookings['day'].to_numpy()
+    by_day = pd.DataFrame({'Date': pd.date_range(frame.start_date, periods=frame.days),
+                           'Bookings': np.bincount(days, minlength=frame.days),
+                           'Revenue': np.bincount(days, weights=costs, minlength=frame.days)})
+    return by_venue, by_city, by_day
+
+
+def _weekdays(frame):
+    return (frame.bookings['day'].to_numpy() + frame.start_date.weekday()) % 7
+
+
+def booked_minutes(frame):
+    """
+    Minutes booked per (weekday, hour of day) as a 7 x 24 array. Each hour is one vectorized
+    pass over all bookings, counting how much of every booking falls inside that hour.
+    """
+    starts = frame.bookings['start'].to_numpy()
+    ends = frame.bookings['end'].to_numpy()
+    weekdays = _weekdays(frame)
+    minutes = np.zeros((7, 24))
+    for hour in range(24):
+        overlap = np.clip(np.minimum(ends, (hour + 1) * 60) - np.maximum(starts, hour * 60), 0, 60)
+        minutes[:, hour] = np.bincount(weekdays, weights=overlap, minlength=7)
+    return minutes
+
+
+def utilization_heatmap(frame):
+    """Share of venue-hours booked per weekday and open hour, as a DataFrame (weekdays x hours)"""
+    # How many times each weekday occurs in the range
+    occurrences = np.bincount((np.arange(frame.days) + frame.start_date.weekday()) % 7, minlength=7)
+    capacity = np.maximum(occurrences, 1)[:, None] * 60.0 * max(len(frame.venues), 1)
+    utilization = booked_minutes(frame)[:, list(OPEN_HOURS)] / capacity
+    return pd.DataFrame(utilization, index=WEEKDAYS, columns=[f"{hour % 12 or 12} {'AM' if hour < 12 else 'PM'}"
+                                                             for hour in OPEN_HOURS])
+
+
+def peak_slots(frame, top=10):
+    """
+    The busiest (weekday, start hour) slots by number of bookings starting in them, with the
+    average bookings per occurrence of that weekday and the revenue they brought in.
+    """
+    weekdays = _weekdays(frame)
+    start_hours = frame.bookings['start'].to_numpy() // 60
+    slots = weekdays * 24 + start_hours
+    counts = np.bincount(slots, minlength=7 * 24)
+    revenues = np.bincount(slots, weights=booking_costs(frame), minlength=7 * 24)
+    occurrences = np.bincount((np.arange(frame.days) + frame.start_date.weekday()) % 7, minlength=7)
+    busiest = np.argsort(counts)[::-1][:top]
+    busiest = busiest[counts[busiest] > 0]
+    return pd.DataFrame({'Weekday': [WEEKDAYS[slot // 24] for slot in busiest],
+                         'Start hour': [f"{slot % 24:02d}:00" for slot in busiest],
+                         'Bookings': counts[busiest],
+                         'Bookings per day': counts[busiest] / np.maximum(occurrences[busiest // 24], 1),
+                         'Revenue': revenues[busiest]})
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+    from datetime import date
+    from shard_config import router, read_from_shard
+
+    parser = argparse.ArgumentParser(description="Revenue and utilization report over every shard.")
+    parser.add_argument('start_date', type=date.fromisoformat)
+    parser.add_argument('end_date', type=date.fromisoformat)
+    parser.add_argument('--parts', type=int, default=4, help="date chunks read in parallel per shard")
+    args = parser.parse_args(sys.argv[1:])
+
+    frame = load_booking_frame(read_from_shard, router.shards, args.start_date, args.end_date, args.parts)
+    for db_name, error in frame.errors.items():
+        print(f"{db_name} is missing from the report: {error}")
+    started = time.monotonic()
+    by_venue, by_city, by_day = revenue(frame)
+    heatmap = utilization_heatmap(frame)
+    peaks = peak_slots(frame)
+    print(f"loaded {len(frame.bookings)} bookings of {len(frame.venues)} venues in {frame.seconds:.2f}s, "
+          f"aggregated in {time.monotonic() - started:.2f}s")
+    print(by_city.head(10).to_string())
+    print(heatmap.round(3).to_string())
+    print(peaks.to_string(index=False))
@@ -0,0 +1,271 @@
+# IMPORT LIBRARIES
+import asyncio
+import inspect
+import threading
+import functools
+import contextvars
+import concurrent.futures
+from scatter_gather import scatter_gather
+from shard_router import locate_venue, locate_venues
+from pagination import KeysetPager
+from availability import load_availability
+from booking import book_venue, OVERLAP_QUERY as OVERLAP_BY_ID
+from import_venues import upsert_venues
+from rollups import busiest_venues, totals_by
+from procedures import upsert_venue, update_venue, delete_venue, ADDED, DELETED, UPDATED
+from resilience import deadline
+
+# pymysql blocks, so every query runs on this pool of worker threads and the coroutines await it. Each
+# worker borrows its own pooled connection, so queries awaited together run at the same time on the shards.
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix='async-data')
+
+VENUE_COLUMNS = "ID, Name, City, Capacity, Price_per_hour"
+
+OVERLAP_QUERY = """
+SELECT COUNT(*) AS Overlapping FROM Venues
+JOIN Bookings ON Bookings.VenueID = Venues.ID
+WHERE Venues.Name = %s AND Bookings.Date = %s AND
+NOT (%s >= Bookings.End_time OR %s <= Bookings.Start_time)
+"""
+
+
+class AsyncData:
+    """
+    Coroutine versions of the app's reads and writes over the shard pools.
+
+    Reads that span shards are one scatter-gather each; awaiting several of them with
+    asyncio.gather sends all of their shard queries at once. Methods return plain results and
+    raise on database errors, leaving messages and cache upkeep to the caller.
+    Reads borrow connections with read_connect (replicas, see replicas.py) and writes with
+    connect; on_write is called after every successful write. Methods taking a venue_id go
+    straight to the shard in the ID and look the venue up by primary key.
+    Every read has timeout seconds as its deadline; cross-shard reads return what the other
+    shards answered when one is too slow. hedge (see scatter_gather) hedges the scans.
+    Writes to a venue's primary have write_timeout seconds.
+    """
+    def __init__(self, connect, db_names, router, timeout=5.0, read_connect=None, on_write=None, hedge=None,
+                 write_timeout=30.0):
+        self.connect = connect
+        self.read_connect = read_connect or connect
+        self.hedge = hedge
+        self.db_names = list(db_names)
+        self.router = router
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.on_write = on_write
+
+    def _wrote(self):
+        if self.on_write:
+            self.on_write()
+
+    # Run a blocking function on a worker thread, carrying the caller's context (the metrics scope) along
+    async def _run(self, function, *args, **kwargs):
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            _executor, lambda: context.run(function, *args, **kwargs))
+
+    async def scatter(self, query, params=None, sort_key=None, distinct=False, shard_column=None, db_names=None):
+        return await self._run(scatter_gather, self.read_connect, db_names or self.db_names, query, params,
+                               timeout=self.timeout, sort_key=sort_key, distinct=distinct, shard_column=shard_column,
+                               hedge=self.hedge)
+
+    async def locate(self, venue_name, venue_id=None):
+        return await self._run(locate_venue, self.router, self.connect, venue_name, venue_id)
+
+    async def locate_many(self, venue_names):
+        """{venue_name: shard currently holding it}, probing in batches during a resharding"""
+        return await self._run(locate_venues, self.router, self.connect, venue_names)
+
+    # Run function(cursor, *args) on the venue's shard; the connection is committed if it returns normally
+    async def on_venue_shard(self, venue_name, function, *args, read=False, venue_id=None):
+        db_name = await self.locate(venue_name, venue_id)
+
+        def work():
+            with (self.read_connect if read else self.connect)(db_name) as connection:
+                with connection.cursor() as cursor:
+                    result = function(cursor, *args)
+                connection.commit()
+                return result
+
+        def read_work():
+            with deadline(self.timeout):
+                return work()
+        return db_name, await self._run(read_work if read else work)
+
+    # Run function(connection, *args) with a connection to the venue's primary; each write is one procedure call.
+    # The write's deadline is timeout seconds, write_timeout by default.
+    async def on_venue_primary(self, venue_name, function, *args, venue_id=None, timeout=None):
+        db_name = await self.locate(venue_name, venue_id)
+
+        def work():
+            with deadline(self.write_timeout if timeout is None else timeout):
+                with self.connect(db_name) as connection:
+                    return function(connection, *args)
+        result = await self._run(work)
+        self._wrote()
+        return db_name, result
+
+    # Reads
+    async def get_cities(self):
+        return await self.scatter("SELECT DISTINCT City FROM Venues ORDER BY City",
+                                  sort_key=lambda row: (row['City'] or '').casefold(), distinct=True)
+
+    async def get_all_venues(self):
+        return await self.scatter(f"SELECT {VENUE_COLUMNS} FROM Venues ORDER BY Name",
+                                  sort_key=lambda row: (row['Name'] or '').casefold(), shard_column='Shard')
+
+    async def find_venue(self, where, params, page_number=0, page_size=50):
+        """One page of the venues matching where, in name order; used while the search index is cold"""
+        pager = KeysetPager(self.read_connect, self.db_names, f"SELECT {VENUE_COLUMNS} FROM Venues", 'Name', where,
+                            params, page_size=page_size, timeout=self.timeout, hedge=self.hedge)
+        return await self._run(pager.page, page_number)
+
+    async def venue_names(self, prefix, limit=50):
+        """A page of (ID, Name) pairs of the venues whose names start with prefix"""
+        # The prefix is matched as typed: LIKE's wildcards and its escape character in it are escaped
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        page = await self.find_venue("Name LIKE %s", [escaped + '%'], page_size=limit)
+        page.rows = [(row['ID'], row['Name']) for row in page.rows]
+        return page
+
+    async def get_venue(self, venue_name, venue_id=None):
+        def select(cursor):
+            if venue_id is None:
+                cursor.execute(f"SELECT {VENUE_COLUMNS} FROM Venues WHERE Name = %s", (venue_name,))
+            else:
+                cursor.execute(f"SELECT {VENUE_COLUMNS} FROM Venues WHERE ID = %s", (venue_id,))
+            return cursor.fetchone()
+        db_name, venue = await self.on_venue_shard(venue_name, select, read=True, venue_id=venue_id)
+        return dict(venue, Shard=db_name) if venue else None
+
+    # Advisory: book_venue checks again on the primary under the venue lock
+    async def check_availability(self, venue_name, date, start_time, end_time, venue_id=None):
+        def free(cursor):
+            if venue_id is None:
+                cursor.execute(OVERLAP_QUERY, (venue_name, date, start_time, end_time))
+                return cursor.fetchone()['Overlapping'] == 0
+            cursor.execute(OVERLAP_BY_ID, (venue_id, date, start_time, end_time))
+            return cursor.fetchone() is None
+        _, available = await self.on_venue_shard(venue_name, free, read=True, venue_id=venue_id)
+        return available
+
+    async def availability(self, start_date, end_date, venue_names=None):
+        db_names = sorted(set(await asyncio.gather(*(self.locate(name) for name in venue_names)))) \
+            if venue_names else self.db_names
+        return await self._run(load_availability, self.read_connect, db_names, start_date, end_date, venue_names,
+                               timeout=self.timeout)
+
+    async def dashboard(self, start_date, end_date, limit=50):
+        """The analytics tab's three rollup reads, issued together: totals per city and per day, busiest venues"""
+        return await asyncio.gather(
+            self._run(totals_by, self.read_connect, self.db_names, start_date, end_date, 'City', timeout=self.timeout),
+            self._run(totals_by, self.read_connect, self.db_names, start_date, end_date, 'Date', timeout=self.timeout),
+            self._run(busiest_venues, self.read_connect, self.db_names, start_date, end_date, limit=limit,
+                      timeout=self.timeout))
+
+    # Writes
+    async def create_booking(self, client_name, date, start_time, end_time, venue_name, venue_id=None):
+        """Returns (status, booking_id) from book_venue"""
+        _, result = await self.on_venue_primary(venue_name, functools.partial(book_venue, venue_id=venue_id),
+                                                venue_name, client_name, date, start_time, end_time, venue_id=venue_id)
+        return result
+
+    async def add_venue(self, venue_name, city, capacity, price_per_hour):
+        """Returns the new venue, or None if a venue with that name exists"""
+        db_name, (status, venue) = await self.on_venue_primary(venue_name, upsert_venue, venue_name, city, capacity,
+                                                               price_per_hour)
+        return dict(venue, Shard=db_name) if status == ADDED and venue else None
+
+    async def update_venue(self, venue_name, new_city=None, new_capacity=None, new_price_per_hour=None, venue_id=None):
+        """Returns the updated venue, or None if it does not exist. Raises ValueError without updates."""
+        if not (new_city or new_capacity or new_price_per_hour):
+            raise ValueError("No updates provided.")
+        db_name, (status, venue) = await self.on_venue_primary(venue_name, functools.partial(update_venue, venue_id=venue_id),
+                                                               venue_name, new_city or None, new_capacity or None,
+                                                               new_price_per_hour or None, venue_id=venue_id)
+        return dict(venue, Shard=db_name) if status == UPDATED else None
+
+    async def delete_venue(self, venue_name, batch_size=1000, venue_id=None, timeout=None):
+        """
+        Deletes the venue with its bookings in batches; returns the bookings deleted, None if it does not exist.
+        A venue with very many bookings may need a longer timeout; batches already deleted stay deleted.
+        """
+        _, (status, deleted) = await self.on_venue_primary(venue_name, functools.partial(delete_venue, venue_id=venue_id),
+                                                           venue_name, batch_size, venue_id=venue_id, timeout=timeout)
+        return deleted if status == DELETED else None
+
+    async def mass_add_venues(self, rows_by_shard, chunk_size=1000, timeout=None):
+        """
+        Upserts parsed venue rows into their shards, all shards at once, each within the write timeout
+        (or timeout). Returns {db_name: (inserted, updated)} or {db_name: exception} for shards that failed.
+        """
+        def upsert(db_name, rows):
+            inserted = updated = 0
+            with deadline(self.write_timeout if timeout is None else timeout):
+                with self.connect(db_name) as connection:
+                    for start in range(0, len(rows), chunk_size):
+                        chunk_inserted, chunk_updated = upsert_venues(connection, rows[start:start + chunk_size])
+                        inserted += chunk_inserted
+                        updated += chunk_updated
+            return inserted, updated
+        db_names = [db_name for db_name, rows in rows_by_shard.items() if rows]
+        results = await asyncio.gather(*(self._run(upsert, db_name, rows_by_shard[db_name]) for db_name in db_names),
+                                       return_exceptions=True)
+        if any(not isinstance(result, BaseException) for result in results):
+            self._wrote()
+        return dict(zip(db_names, results))
+
+
+# One event loop per process on a daemon thread, shared by every Streamlit session and rerun
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='async-data-loop', daemon=True).start()
+    return _loop
+
+
+class SyncData:
+    """
+    Blocking facade for call sites that are not coroutines, such as the Streamlit script.
+    data.check_availability(...) runs the coroutine on the background loop and returns its result;
+    data.gather(cities=..., names=...) runs several at once and returns their results by name.
+    """
+    def __init__(self, async_data):
+        self.async_data = async_data
+        self.loop = background_loop()
+
+    def run(self, coroutine):
+        # The task is created inside the caller's context, so queries count against the caller's metrics scope
+        context = contextvars.copy_context()
+        future = concurrent.futures.Future()
+
+        def start():
+            task = self.loop.create_task(coroutine)
+
+            def done(task):
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+            task.add_done_callback(done)
+        self.loop.call_soon_threadsafe(start, context=context)
+        return future.result()
+
+    def gather(self, **coroutines):
+        async def all_of():
+            return await asyncio.gather(*coroutines.values(), return_exceptions=True)
+        return dict(zip(coroutines, self.run(all_of())))
+
+    def __getattr__(self, name):
+        attribute = getattr(self.async_data, name)
+        if not inspect.iscoroutinefunction(attribute):
+            return attribute
+        return lambda *args, **kwargs: self.run(attribute(*args, **kwargs))
@@ -0,0 +1,94 @@
+# IMPORT LIBRARIES
+import bisect
+from datetime import date as date_type, datetime, time, timedelta
+from scatter_gather import scatter_gather
+
+
+# Minutes since midnight for a TIME value (pymysql returns TIME columns as timedelta)
+def to_minutes(value):
+    if isinstance(value, timedelta):
+        return int(value.total_seconds() // 60)
+    if isinstance(value, time):
+        return value.hour * 60 + value.minute
+    hours, minutes = str(value).split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date_type):
+        return value
+    return datetime.strptime(str(value), '%Y-%m-%d').date()
+
+
+class AvailabilityIndex:
+    """
+    In-memory interval index of booked time per venue and day.
+
+    For every (venue, day) the booked intervals are kept sorted by start time together with a
+    running maximum of their end times, so "is this slot free" is one binary search even when
+    old data contains overlapping bookings.
+    """
+    def __init__(self):
+        self._days = {}  # venue -> date -> [starts, ends, max_ends]
+
+    def add(self, venue, day, start, end):
+        day_index = self._days.setdefault(venue, {}).setdefault(to_date(day), [[], [], []])
+        starts, ends, _ = day_index
+        position = bisect.bisect(starts, to_minutes(start))
+        starts.insert(position, to_minutes(start))
+        ends.insert(position, to_minutes(end))
+        max_ends = []
+        for booked_end in ends:
+            max_ends.append(max(booked_end, max_ends[-1]) if max_ends else booked_end)
+        day_index[2] = max_ends
+
+    def is_free(self, venue, day, start, end):
+        day_index = self._days.get(venue, {}).get(to_date(day))
+        if day_index is None:
+            return True
+        starts, _, max_ends = day_index
+        # Bookings starting before the requested end overlap it if any of them ends after the requested start
+        count = bisect.bisect_left(starts, to_minutes(end))
+        return count == 0 or max_ends[count - 1] <= to_minutes(start)
+
+    def bookings(self, venue, day):
+        day_index = self._days.get(venue, {}).get(to_date(day))
+        return list(zip(day_index[0], day_index[1])) if day_index else []
+
+    def free_slots(self, venue, start_date, end_date, slots):
+        """Every (day, start, end) from slots that is free for the venue between start_date and end_date"""
+        free = []
+        day = to_date(start_date)
+        while day <= to_date(end_date):
+            free.extend((day, start, end) for start, end in slots if self.is_free(venue, day, start, end))
+            day += timedelta(days=1)
+        return free
+
+    def free_venues(self, venues, day, start, end):
+        return [venue for venue in venues if self.is_free(venue, day, start, end)]
+
+
+def load_availability(connect, db_names, start_date, end_date, venue_names=None, timeout=5.0):
+    """
+    Loads the bookings between start_date and end_date (optionally only for venue_names) from
+    the given shards with one query per shard, run in parallel. Returns the AvailabilityIndex
+    and the scatter-gather result, whose errors list shards that could not be read.
+    """
+    query = """
+    SELECT v.Name, b.Date, b.Start_time, b.End_time FROM Bookings b
+    JOIN VenueUsed vu ON b.ID = vu.BookingID
+    JOIN Venues v ON vu.VenueID = v.ID
+    WHERE b.Date BETWEEN %s AND %s
+    """
+    params = [start_date, end_date]
+    if venue_names:
+        query += " AND v.Name IN (" + ', '.join(['%s'] * len(venue_names)) + ")"
+        params.extend(venue_names)
+    result = scatter_gather(connect, db_names, query, params, timeout=timeout)
+
+    index = AvailabilityIndex()
+    for row in result.rows:
+        index.add(row['Name'], row['Date'], row['Start_time'], row['End_time'])
+    return index, result
@@ -0,0 +1,337 @@
+# IMPORT LIBRARIES
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import date, timedelta
+import pymysql
+from shard_config import SHARDS, router
+from shard_pool import get_pool
+from migrations import migrate
+from scatter_gather import scatter_gather
+from booking import book_venue, OVERLAP_QUERY
+from import_venues import upsert_venues
+from import_bookings import insert_bookings
+from venue_search import VenueSearchIndex
+from partitions import ensure_partitions
+import db_metrics
+
+CITIES = ['Los Angeles', 'San Francisco', 'San Diego', 'Seattle', 'Portland', 'Phoenix', 'Denver', 'Austin',
+          'Chicago', 'Boston', 'New York', 'Miami']
+FIRST_DAY = date(2024, 1, 1)
+HOURS = range(13, 23)  # the booking tab offers 1 PM to 11 PM
+
+
+# The benchmark runs on its own copy of every shard (database name + suffix) so real data is never touched
+def bench_params(suffix):
+    return {shard: dict(params, database=params['database'] + suffix) for shard, params in SHARDS.items()}
+
+
+def bench_connect(params):
+    return lambda shard: get_pool('bench:' + shard, params[shard], max_size=64, checkout_timeout=60).connection()
+
+
+def create_bench_databases(params):
+    for shard, shard_params in params.items():
+        connection = pymysql.connect(host=shard_params['host'], port=int(shard_params.get('port', 3306)),
+                                     user=shard_params['user'], password=shard_params['password'])
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"CREATE DATABASE IF NOT EXISTS {shard_params['database']}")
+        finally:
+            connection.close()
+
+
+def venue_name(number):
+    return f"Bench Venue {number:07d}"
+
+
+def seed(connect, venues, bookings, chunk_size=5000, log=print):
+    """
+    Creates the schema on every benchmark shard and fills it with `venues` synthetic venues and
+    about `bookings` non-overlapping bookings spread over the venues, hourly from 1 PM to 11 PM.
+    """
+    for shard in router.shards:
+        with connect(shard) as connection:
+            migrate(connection, log=lambda message: None, shard_number=router.numbers[shard])
+
+    started = time.monotonic()
+    rows = {shard: [] for shard in router.shards}
+    for number in range(venues):
+        name = venue_name(number)
+        rows[router.shard_for(name)].append((name, random.choice(CITIES), random.randint(10, 1000),
+                                             round(random.uniform(20, 500), 2)))
+    for shard, shard_rows in rows.items():
+        with connect(shard) as connection:
+            for start in range(0, len(shard_rows), chunk_size):
+                upsert_venues(connection, shard_rows[start:start + chunk_size])
+    log(f"seeded {venues} venues in {time.monotonic() - started:.1f}s")
+    if not bookings:
+        return 0
+
+    started = time.monotonic()
+    per_venue = max(1, bookings // venues)
+    seed_bookings(connect, 0, per_venue, chunk_size)
+    log(f"seeded about {per_venue * venues} bookings in {time.monotonic() - started:.1f}s")
+    return per_venue
+
+
+def seed_bookings(connect, first_slot, last_slot, chunk_size=5000):
+    """
+    Gives every benchmark venue its bookings first_slot to last_slot: consecutive one-hour bookings,
+    day after day from FIRST_DAY, so none overlap. Each month gets its partition first.
+    """
+    last_day = FIRST_DAY + timedelta(days=last_slot // len(HOURS))
+    for shard in router.shards:
+        with connect(shard) as connection:
+            with connection.cursor() as cursor:
+                ensure_partitions(cursor, through=last_day, since=FIRST_DAY)
+                cursor.execute("SELECT ID FROM Venues WHERE Name LIKE %s", ('Bench Venue %',))
+                venue_ids = [row['ID'] for row in cursor.fetchall()]
+                chunk = []
+                for venue_id in venue_ids:
+                    for slot in range(first_slot, last_slot):
+                        day = FIRST_DAY + timedelta(days=slot // len(HOURS))
+                        hour = HOURS[slot % len(HOURS)]
+                        chunk.append((venue_id, f"Client {random.randint(1, 100000)}", day,
+                                      f"{hour}:00:00", f"{hour + 1}:00:00"))
+                        if len(chunk) >= chunk_size:
+                            insert_bookings(cursor, chunk)
+                            connection.commit()
+                            chunk = []
+                if chunk:
+                    insert_bookings(cursor, chunk)
+                    connection.commit()
+
+
+def history_benchmark(connect, venues, sizes, threads, duration, log=print):
+    """
+    Grows the bookings history of a fixed set of venues through each of sizes (total bookings),
+    timing check_availability alone after each step. With Bookings partitioned by month the
+    overlap check reads one partition through the (VenueID, Date) index, so its latency should
+    stay flat. Returns {size: check_availability stats}.
+    """
+    results = {}
+    done = 0
+    for size in sorted(sizes):
+        per_venue = max(1, size // venues)
+        started = time.monotonic()
+        seed_bookings(connect, done, per_venue)
+        log(f"history of {per_venue * venues} bookings ready in {time.monotonic() - started:.1f}s")
+        done = per_venue
+        workload = Workload(connect, venues, max(1, -(-per_venue // len(HOURS))))
+        results[per_venue * venues] = run_workload(workload, {'check_availability': 1}, threads, duration)['check_availability']
+    return results
+
+
+class Workload:
+    # The same code paths the app and scripts use, driven with random arguments
+    def __init__(self, connect, venues, days):
+        self.connect = connect
+        self.venues = venues
+        self.days = days
+        self.search_index = None
+
+    # The app's search index over the whole benchmark catalog, built before the timed run
+    def build_search_index(self):
+        started = time.monotonic()
+        result = scatter_gather(self.connect, router.shards, "SELECT Name, City, Capacity, Price_per_hour FROM Venues",
+                                shard_column='Shard', timeout=600)
+        self.search_index = VenueSearchIndex()
+        self.search_index.load(result.rows)
+        return time.monotonic() - started
+
+    def random_slot(self):
+        hour = random.choice(HOURS)
+        return FIRST_DAY + timedelta(days=random.randrange(self.days)), f"{hour}:00:00", f"{hour + 1}:00:00"
+
+    def find_venue(self):
+        keyword = f"{random.randrange(self.venues):07d}"[:5]
+        scatter_gather(self.connect, router.shards,
+                       "SELECT Name, City, Capacity, Price_per_hour FROM Venues WHERE Name LIKE %s ORDER BY Name",
+                       ['%' + keyword + '%'], sort_key=lambda row: row['Name'].casefold())
+
+    def search_venue(self):
+        keyword = f"{random.randrange(self.venues):07d}"[:5]
+        self.search_index.search(keyword, city=random.choice([None, random.choice(CITIES)]), limit=100)
+
+    def check_availability(self):
+        name = venue_name(random.randrange(self.venues))
+        day, start, end = self.random_slot()
+        with self.connect(router.shard_for(name)) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT ID FROM Venues WHERE Name = %s", (name,))
+                venue = cursor.fetchone()
+                cursor.execute(OVERLAP_QUERY, (venue['ID'], day, start, end))
+                cursor.fetchall()
+
+    def create_booking(self):
+        name = venue_name(random.randrange(self.venues))
+        # Book days after the seeded history so some bookings succeed and some conflict
+        hour = random.choice(HOURS)
+        day = FIRST_DAY + timedelta(days=self.days + random.randrange(30))
+        with self.connect(router.shard_for(name)) as connection:
+            book_venue(connection, name, "Bench Client", day, f"{hour}:00:00", f"{hour + 1}:00:00")
+
+    def mass_add_venues(self):
+        rows = {}
+        for _ in range(100):
+            name = venue_name(random.randrange(self.venues))
+            rows.setdefault(router.shard_for(name), []).append((name, random.choice(CITIES), random.randint(10, 1000),
+                                                                round(random.uniform(20, 500), 2)))
+        for shard, shard_rows in rows.items():
+            with self.connect(shard) as connection:
+                upsert_venues(connection, shard_rows)
+
+    # What one Streamlit rerun of the booking tab costs without the catalog cache
+    def rerun(self):
+        scatter_gather(self.connect, router.shards, "SELECT Name, City, Capacity, Price_per_hour FROM Venues ORDER BY Name",
+                       sort_key=lambda row: row['Name'].casefold())
+        self.check_availability()
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def run_workload(workload, mix, threads, duration):
+    """
+    Runs the weighted mix of operations on `threads` threads for `duration` seconds.
+    Returns {operation: {'count', 'errors', 'ops_per_sec', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'}}.
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        while time.monotonic() < deadline:
+            name = random.choices(names, weights)[0]
+            started = time.monotonic()
+            try:
+                getattr(workload, name)()
+                failed = False
+            except Exception:
+                failed = True
+            elapsed = time.monotonic() - started
+            with lock:
+                latencies[name].append(elapsed)
+                errors[name] += failed
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.monotonic()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    wall = time.monotonic() - started
+
+    report = {}
+    for name in names:
+        ordered = sorted(latencies[name])
+        report[name] = {'count': len(ordered), 'errors': errors[name], 'ops_per_sec': len(ordered) / wall,
+                        'p50_ms': percentile(ordered, 0.50) * 1000, 'p95_ms': percentile(ordered, 0.95) * 1000,
+                        'p99_ms': percentile(ordered, 0.99) * 1000, 'max_ms': (ordered[-1] if ordered else 0) * 1000}
+    return report
+
+
+def compare(report, baseline, threshold):
+    """Prints the change in p95 and throughput against a saved run; returns the regressed operations"""
+    regressions = []
+    for name, stats in report['operations'].items():
+        before = baseline.get('operations', {}).get(name)
+        if not before or not before['p95_ms']:
+            continue
+        change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms']
+        print(f"{name}: p95 {before['p95_ms']:.1f}ms -> {stats['p95_ms']:.1f}ms ({change:+.0%}), "
+              f"{before['ops_per_sec']:.0f} -> {stats['ops_per_sec']:.0f} ops/s")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, weight = part.split('=')
+        if not hasattr(Workload, name.strip()):
+            raise argparse.ArgumentTypeError(f"unknown operation {name.strip()}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed benchmark shards and measure the booking and search paths.")
+    parser.add_argument('--suffix', default='_bench', help="appended to every shard's database name")
+    parser.add_argument('--bookings', type=int, default=100000, help="bookings to seed (1k to 10M)")
+    parser.add_argument('--venues', type=int, default=None, help="venues to seed (default bookings / 100)")
+    parser.add_argument('--skip-seed', action='store_true', help="reuse the data from an earlier run")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds to run the workload")
+    parser.add_argument('--mix', type=parse_mix,
+                        default='find_venue=15,search_venue=15,check_availability=40,create_booking=15,mass_add_venues=5,rerun=10')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', default=None, help="earlier result file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="p95 increase counted as a regression")
+    parser.add_argument('--metrics', default=None, help="write per-statement Prometheus metrics of the run to this file")
+    parser.add_argument('--history', default=None,
+                        help="comma-separated booking totals, e.g. 1000000,10000000,50000000: grow the history of "
+                             "--venues venues (default 1000) through each and time only check_availability; "
+                             "use a --suffix without earlier benchmark data")
+    args = parser.parse_args(sys.argv[1:])
+    mix = args.mix
+
+    params = bench_params(args.suffix)
+    connect = bench_connect(params)
+    if args.history:
+        sizes = [int(size) for size in args.history.split(',')]
+        venues = args.venues or 1000
+        create_bench_databases(params)
+        seed(connect, venues, 0)
+        history = history_benchmark(connect, venues, sizes, args.threads, args.duration)
+        for size, stats in history.items():
+            print(f"{size:12d} bookings  p50 {stats['p50_ms']:7.1f}ms  p95 {stats['p95_ms']:7.1f}ms  "
+                  f"p99 {stats['p99_ms']:7.1f}ms  {stats['ops_per_sec']:8.1f}/s")
+        smallest, largest = history[min(history)], history[max(history)]
+        if smallest['p95_ms']:
+            print(f"p95 changed {(largest['p95_ms'] - smallest['p95_ms']) / smallest['p95_ms']:+.0%} "
+                  f"from {min(history)} to {max(history)} bookings")
+        with open(args.output, 'w') as output:
+            json.dump({'when': time.strftime('%Y-%m-%dT%H:%M:%S'), 'venues': venues, 'threads': args.threads,
+                       'duration': args.duration, 'history': history}, output, indent=2)
+        print(f"results saved to {args.output}")
+        sys.exit(0)
+    venues = args.venues or max(10, args.bookings // 100)
+    per_venue = max(1, args.bookings // venues)
+    if not args.skip_seed:
+        create_bench_databases(params)
+        per_venue = seed(connect, venues, args.bookings)
+    days = max(1, -(-per_venue // len(HOURS)))
+
+    db_metrics.metrics.reset()
+    workload = Workload(connect, venues, days)
+    if 'search_venue' in mix:
+        print(f"built the search index in {workload.build_search_index():.1f}s")
+    operations = run_workload(workload, mix, args.threads, args.duration)
+    for name, stats in operations.items():
+        print(f"{name:20} {stats['count']:8d} ops {stats['ops_per_sec']:8.1f}/s  p50 {stats['p50_ms']:7.1f}ms  "
+              f"p95 {stats['p95_ms']:7.1f}ms  p99 {stats['p99_ms']:7.1f}ms  errors {stats['errors']}")
+
+    report = {'when': time.strftime('%Y-%m-%dT%H:%M:%S'), 'venues': venues, 'bookings': venues * per_venue,
+              'threads': args.threads, 'duration': args.duration, 'mix': mix, 'operations': operations}
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(f"results saved to {args.output}")
+    if args.metrics:
+        db_metrics.dump(args.metrics)
+
+    if args.compare:
+        with open(args.compare) as saved:
+            regressions = compare(report, json.load(saved), args.threshold)
+        if regressions:
+            print(f"p95 regressed by more than {args.threshold:.0%} for: {', '.join(regressions)}")
+            sys.exit(1)
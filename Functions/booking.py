@@ -0,0 +1,72 @@
+# IMPORT LIBRARIES
+import time
+import random
+import pymysql
+from rollups import add_bookings
+from procedures import BOOKED, CONFLICT, NO_VENUE, call_procedure  # book_venue's outcomes are the procedure's
+from global_ids import next_ids, keep_up
+
+# Deadlock found / lock wait timeout: the transaction was rolled back and can simply be retried
+RETRYABLE_ERRORS = (1213, 1205)
+
+# One Date, so only that month's partition is read, through the (VenueID, Date) index
+OVERLAP_QUERY = """
+SELECT b.ID FROM Bookings b
+WHERE b.VenueID = %s AND b.Date = %s
+AND NOT (%s >= b.End_time OR %s <= b.Start_time)
+LIMIT 1
+"""
+
+
+def book_venue(connection, venue_name, client_name, date, start_time, end_time, max_retries=5, backoff=0.05,
+               venue_id=None):
+    """
+    Books a venue in one transaction: the venue row is locked with SELECT ... FOR UPDATE, so
+    concurrent bookings of the same venue queue behind each other, then the overlap check and
+    the Bookings / VenueUsed inserts and the venue's daily rollup run under that lock and commit together.
+    The transaction is one CALL of sp_book_venue where the shard has it (see procedures.py).
+    With venue_id the venue is looked up by its primary key instead of its name.
+    Deadlocks and lock wait timeouts are retried with exponential backoff and jitter.
+    Returns (BOOKED, booking_id), (CONFLICT, None) or (NO_VENUE, None).
+    """
+    # The procedure draws the booking ID in its transaction, so the counter is kept up beforehand
+    keep_up(connection)
+    for attempt in range(max_retries + 1):
+        try:
+            row = call_procedure(connection, 'sp_book_venue', venue_id, venue_name, client_name, date, start_time,
+                                 end_time)
+            if row is not None:
+                return row['Status'], row['BookingID']
+
+            with connection.cursor() as cursor:
+                if venue_id is None:
+                    cursor.execute("SELECT ID, Price_per_hour FROM Venues WHERE Name = %s FOR UPDATE", (venue_name,))
+                else:
+                    cursor.execute("SELECT ID, Price_per_hour FROM Venues WHERE ID = %s FOR UPDATE", (venue_id,))
+                venue = cursor.fetchone()
+                if venue is None:
+                    connection.rollback()
+                    return NO_VENUE, None
+
+                cursor.execute(OVERLAP_QUERY, (venue['ID'], date, start_time, end_time))
+                if cursor.fetchone():
+                    connection.rollback()
+                    return CONFLICT, None
+
+                booking_id = next_ids(cursor)[0]
+                cursor.execute(
+                    "INSERT INTO Bookings (ID, VenueID, Client_name, Date, Start_time, End_time) VALUES (%s, %s, %s, %s, %s, %s)",
+                    (booking_id, venue['ID'], client_name, date, start_time, end_time))
+                cursor.execute("INSERT INTO VenueUsed (VenueID, BookingID) VALUES (%s, %s)", (venue['ID'], booking_id))
+                add_bookings(cursor, [(venue['ID'], date, start_time, end_time)], {venue['ID']: venue['Price_per_hour']})
+                connection.commit()
+                return BOOKED, booking_id
+        except pymysql.err.OperationalError as e:
+            try:
+                connection.rollback()
+            except pymysql.err.MySQLError:
+                # The connection is gone (a timeout, a dead server): report what broke it, not the rollback
+                raise e from None
+            if e.args[0] not in RETRYABLE_ERRORS or attempt == max_retries:
+                raise
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
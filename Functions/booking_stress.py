@@ -0,0 +1,69 @@
+# IMPORT LIBRARIES
+import sys
+import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from shard_config import SHARDS, router, connect_to_shard
+from shard_pool import get_pool
+from shard_router import locate_venue
+from booking import book_venue, BOOKED
+
+# Pairs of bookings of the same venue and day whose times overlap
+OVERLAPS_QUERY = """
+SELECT COUNT(*) AS Overlaps FROM VenueUsed vu1
+JOIN Bookings b1 ON b1.ID = vu1.BookingID
+JOIN VenueUsed vu2 ON vu2.VenueID = vu1.VenueID AND vu2.BookingID > vu1.BookingID
+JOIN Bookings b2 ON b2.ID = vu2.BookingID
+WHERE vu1.VenueID = %s AND b1.Date = %s AND b2.Date = b1.Date
+AND NOT (b1.Start_time >= b2.End_time OR b1.End_time <= b2.Start_time)
+"""
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def stress(venue_name, date, bookings, threads, max_p99):
+    db_name = locate_venue(router, connect_to_shard, venue_name)
+    get_pool(db_name, SHARDS[db_name], max_size=threads, checkout_timeout=60)
+
+    def attempt(number):
+        start_hour = random.randint(13, 22)
+        end_hour = min(start_hour + random.randint(1, 2), 23)
+        started = time.monotonic()
+        with connect_to_shard(db_name) as connection:
+            status, _ = book_venue(connection, venue_name, f"stress-{number}", date,
+                                   f"{start_hour}:00:00", f"{end_hour}:00:00")
+        return status, time.monotonic() - started
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        outcomes = list(executor.map(attempt, range(bookings)))
+    elapsed = time.monotonic() - started
+
+    latencies = [latency for _, latency in outcomes]
+    booked = sum(1 for status, _ in outcomes if status == BOOKED)
+    with connect_to_shard(db_name) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT ID FROM Venues WHERE Name = %s", (venue_name,))
+            cursor.execute(OVERLAPS_QUERY, (cursor.fetchone()['ID'], date))
+            overlaps = cursor.fetchone()['Overlaps']
+
+    p99 = percentile(latencies, 0.99)
+    print(f"{bookings} attempts on {threads} threads in {elapsed:.2f}s: {booked} booked, {bookings - booked} rejected")
+    print(f"latency p50 {percentile(latencies, 0.5) * 1000:.1f}ms, p99 {p99 * 1000:.1f}ms, max {max(latencies) * 1000:.1f}ms")
+    print(f"overlapping bookings: {overlaps}")
+    return overlaps == 0 and p99 <= max_p99
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fire concurrent bookings at one venue and check that none overlap.")
+    parser.add_argument('venue_name')
+    parser.add_argument('date', help="YYYY-MM-DD, preferably a day with no real bookings")
+    parser.add_argument('--bookings', type=int, default=300)
+    parser.add_argument('--threads', type=int, default=50)
+    parser.add_argument('--max-p99', type=float, default=2.0, help="seconds; fail if the p99 latency is higher")
+    args = parser.parse_args(sys.argv[1:])
+    sys.exit(0 if stress(args.venue_name, args.date, args.bookings, args.threads, args.max_p99) else 1)
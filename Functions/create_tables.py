@@ -1,85 +1,45 @@
 # IMPORT LIBRARIES
 import sys
-import pymysql
+import argparse
 from pymysql.err import OperationalError
+from shard_config import SHARDS, router, connect_to_shard
+from migrations import migrate, explain_check
 
-# OPTION 2: PyMySQL
-# Replace the placeholders with the actual database connection details
-EventManager1_Connection_Params = {
-    'host': 'localhost',
-    'user': 'dsci551',
-    'password': 'Dsci-551',
-    'database': 'Event_Manager1'
-}
 
-EventManager2_Connection_Params = {
-    'host': 'localhost',
-    'user': 'dsci551',
-    'password': 'Dsci-551',
-    'database': 'Event_Manager2'
-}
-
-# List of connection parameters for easy iteration
-connections_params = [EventManager1_Connection_Params, EventManager2_Connection_Params]
-
-# SQL queries to create tables with existence check
-create_tables_queries = [
-    """
-    CREATE TABLE IF NOT EXISTS Venues (
-        ID INT AUTO_INCREMENT PRIMARY KEY,
-        Name VARCHAR(255),
-        City VARCHAR(100),
-        Capacity INT,
-        Price_per_hour DECIMAL(10,2)
-    );
-    """,
-    """
-    CREATE TABLE IF NOT EXISTS Bookings (
-        ID INT AUTO_INCREMENT PRIMARY KEY,
-        Client_name VARCHAR(255),
-        Date DATE,
-        Start_time TIME,
-        End_time TIME
-    );
-    """,
-    """
-    CREATE TABLE IF NOT EXISTS VenueUsed (
-        VenueID INT,
-        BookingID INT,
-        FOREIGN KEY (VenueID) REFERENCES Venues(ID),
-        FOREIGN KEY (BookingID) REFERENCES Bookings(ID),
-        PRIMARY KEY (VenueID, BookingID)
-    );
-    """
-]
-
-
-# Function to execute creation queries on a database
-def create_tables_in_database(connection_params):
+# Function to bring one database up to the latest schema version
+def create_tables_in_database(shard, target_version=None):
+    database = SHARDS[shard]['database']
     try:
-        # Establishing a connection to the database
-        connection = pymysql.connect(host=connection_params['host'],
-                                     user=connection_params['user'],
-                                     password=connection_params['password'],
-                                     database=connection_params['database'],
-                                     cursorclass=pymysql.cursors.DictCursor)
-        print(f"Connection established to {connection_params['database']}!")
-
-        with connection.cursor() as cursor:
-            # Executing each query to create tables
-            for query in create_tables_queries:
-                cursor.execute(query)
-                print(f"Query executed successfully in {connection_params['database']}")
-            connection.commit()
-
-    except OperationalError as e:
-        print(f"An error occurred while connecting to {connection_params['database']}: {e}")
-    finally:
-        if connection:
-            connection.close()
-            print(f"Connection to {connection_params['database']} closed.")
-
-
-# Iterating through each database to create tables
-for params in connections_params:
-    create_tables_in_database(params)
+        with connect_to_shard(shard) as connection:
+            print(f"Connection established to {database}!")
+            applied = migrate(connection, target_version, shard_number=router.numbers[shard])
+            if not applied:
+                print(f"{database} is already up to date.")
+    except (OperationalError, RuntimeError) as e:
+        print(f"An error occurred while migrating {database}: {e}")
+
+
+# Function to check with EXPLAIN that the hot queries use their indexes
+def check_indexes_in_database(shard):
+    database = SHARDS[shard]['database']
+    with connect_to_shard(shard) as connection:
+        failures = explain_check(connection)
+    for query, table, allowed, used in failures:
+        print(f"{database}: {table} is read with {used or 'a full scan'} instead of {' / '.join(allowed)} in: {query}")
+    if not failures:
+        print(f"{database}: every hot query uses its index.")
+    return not failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply schema migrations to every shard.")
+    parser.add_argument('--target', type=int, default=None, help="migrate up to this version only")
+    parser.add_argument('--explain', action='store_true', help="check the hot queries' plans instead of migrating")
+    args = parser.parse_args(sys.argv[1:])
+
+    # Iterating through each database
+    if args.explain:
+        results = [check_indexes_in_database(shard) for shard in SHARDS]
+        sys.exit(0 if all(results) else 1)
+    for shard in SHARDS:
+        create_tables_in_database(shard, args.target)
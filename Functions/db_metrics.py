@@ -0,0 +1,238 @@
+# IMPORT LIBRARIES
+import os
+import re
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pymysql
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_log = logging.getLogger('eventmanager.slow_queries')
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last bucket is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(BUCKETS) and value > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+# Literals replaced by ?, IN lists collapsed and whitespace squeezed, so one statement shape is one series
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(?+)', sql)
+    return _SPACE.sub(' ', sql).strip()[:200]
+
+
+class Scope:
+    # Round trips and DB time of one unit of work, such as a Streamlit rerun. A nested scope (one section
+    # of the page) also counts toward its parent.
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.started = time.monotonic()
+        self.round_trips = 0
+        self.db_seconds = 0.0
+        self.acquire_seconds = 0.0
+        self.shards = {}
+        self.lock = threading.Lock()
+
+    def summary(self):
+        return {'scope': self.name, 'wall_ms': round((time.monotonic() - self.started) * 1000, 1),
+                'round_trips': self.round_trips, 'db_ms': round(self.db_seconds * 1000, 1),
+                'acquire_ms': round(self.acquire_seconds * 1000, 1), 'round_trips_per_shard': dict(self.shards)}
+
+
+_current_scope = contextvars.ContextVar('db_metrics_scope', default=None)
+
+
+def _active_scopes():
+    scope = _current_scope.get()
+    while scope is not None:
+        yield scope
+        scope = scope.parent
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = {}  # (shard, fingerprint) -> Histogram
+        self.rows = {}  # (shard, fingerprint) -> rows returned
+        self.acquire = {}  # shard -> Histogram
+        self.slow_queries = deque(maxlen=100)
+        self.scopes = deque(maxlen=50)
+        # Statements at least this slow are logged; EVENTMANAGER_SLOW_QUERY_MS overrides the default
+        self.slow_query_seconds = float(os.environ.get('EVENTMANAGER_SLOW_QUERY_MS', '200')) / 1000
+
+    def record_query(self, shard, sql, seconds, rows):
+        statement = fingerprint(sql)
+        with self.lock:
+            self.queries.setdefault((shard, statement), Histogram()).observe(seconds)
+            self.rows[(shard, statement)] = self.rows.get((shard, statement), 0) + max(rows, 0)
+        for scope in _active_scopes():
+            with scope.lock:
+                scope.round_trips += 1
+                scope.db_seconds += seconds
+                scope.shards[shard] = scope.shards.get(shard, 0) + 1
+        if seconds >= self.slow_query_seconds:
+            entry = {'when': time.strftime('%Y-%m-%d %H:%M:%S'), 'shard': shard, 'ms': round(seconds * 1000, 1),
+                     'rows': rows, 'statement': statement}
+            with self.lock:
+                self.slow_queries.append(entry)
+            slow_query_log.warning("slow query on %s (%.1f ms, %d rows): %s", shard, seconds * 1000, rows, statement)
+
+    def record_acquire(self, shard, seconds):
+        with self.lock:
+            self.acquire.setdefault(shard, Histogram()).observe(seconds)
+        for scope in _active_scopes():
+            with scope.lock:
+                scope.acquire_seconds += seconds
+
+    def statement_table(self):
+        with self.lock:
+            return [{'shard': shard, 'statement': statement, 'calls': histogram.count,
+                     'total_ms': round(histogram.total * 1000, 1),
+                     'avg_ms': round(histogram.total / histogram.count * 1000, 2) if histogram.count else 0.0,
+                     'rows': self.rows.get((shard, statement), 0)}
+                    for (shard, statement), histogram in self.queries.items()]
+
+    def render_prometheus(self):
+        lines = []
+
+        def histogram_lines(name, labels, histogram):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {histogram.total}')
+            lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+        with self.lock:
+            lines.append('# HELP eventmanager_query_duration_seconds Time spent executing statements.')
+            lines.append('# TYPE eventmanager_query_duration_seconds histogram')
+            for (shard, statement), histogram in self.queries.items():
+                histogram_lines('eventmanager_query_duration_seconds',
+                                f'shard="{shard}",statement="{_label(statement)}"', histogram)
+            lines.append('# HELP eventmanager_query_rows_total Rows returned or affected by statements.')
+            lines.append('# TYPE eventmanager_query_rows_total counter')
+            for (shard, statement), rows in self.rows.items():
+                lines.append(f'eventmanager_query_rows_total{{shard="{shard}",statement="{_label(statement)}"}} {rows}')
+            lines.append('# HELP eventmanager_connection_acquire_seconds Time spent borrowing a pooled connection.')
+            lines.append('# TYPE eventmanager_connection_acquire_seconds histogram')
+            for shard, histogram in self.acquire.items():
+                histogram_lines('eventmanager_connection_acquire_seconds', f'shard="{shard}"', histogram)
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.queries.clear()
+            self.rows.clear()
+            self.acquire.clear()
+            self.slow_queries.clear()
+            self.scopes.clear()
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+metrics = Metrics()
+
+
+def begin_scope(name, nested=True):
+    # A top-level scope (nested=False) ignores whatever scope an interrupted run left behind
+    scope = Scope(name, _current_scope.get() if nested else None)
+    _current_scope.set(scope)
+    return scope
+
+
+def end_scope(scope):
+    _current_scope.set(scope.parent)
+    summary = scope.summary()
+    with metrics.lock:
+        metrics.scopes.append(summary)
+    return summary
+
+
+# Cursors that time every execute / executemany and record it against the connection's shard
+class InstrumentedMixin:
+    def _timed(self, method, query, args):
+        started = time.monotonic()
+        try:
+            return method(query, args)
+        finally:
+            shard = getattr(self.connection, 'shard_name', None) if self.connection else None
+            # Unbuffered cursors report an unknown row count as 2**64 - 1
+            rows = self.rowcount if self.rowcount and 0 < self.rowcount < 2 ** 63 else 0
+            metrics.record_query(shard or 'unknown', query, time.monotonic() - started, rows)
+
+    def execute(self, query, args=None):
+        return self._timed(super().execute, query, args)
+
+    def executemany(self, query, args):
+        return self._timed(super().executemany, query, args)
+
+
+class InstrumentedDictCursor(InstrumentedMixin, pymysql.cursors.DictCursor):
+    pass
+
+
+class InstrumentedSSDictCursor(InstrumentedMixin, pymysql.cursors.SSDictCursor):
+    pass
+
+
+class InstrumentedSSCursor(InstrumentedMixin, pymysql.cursors.SSCursor):
+    pass
+
+
+# Optional Prometheus scrape endpoint: GET /metrics on a background thread
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    global _server
+    if _server is None:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name='metrics-endpoint', daemon=True).start()
+    return _server
+
+
+def dump(path):
+    with open(path, 'w') as output:
+        output.write(metrics.render_prometheus())
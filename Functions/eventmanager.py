@@ -0,0 +1,249 @@
+# IMPORT LIBRARIES
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+from shard_config import router, connect_to_shard, read_from_shard, hedged_read
+from shard_pool import pool_stats
+from resilience import breaker_stats
+from db_metrics import metrics, start_metrics_server
+from shard_router import locate_venue
+from scatter_gather import scatter_gather
+from booking import book_venue, OVERLAP_QUERY
+from add_venue import insert_venue
+from shard_query import run_query
+
+DEFAULT_SOCKET = '/tmp/eventmanager.sock'
+
+
+# Command handlers: each takes the command's JSON arguments and returns a JSON-serialisable result
+def cmd_add_venue(args):
+    db_name = locate_venue(router, connect_to_shard, args['venue_name'])
+    with connect_to_shard(db_name) as connection:
+        added = insert_venue(connection, args['venue_name'], args['city'], int(args['capacity']),
+                             float(args['price_per_hour']))
+    return {'status': 'added' if added else 'exists', 'shard': db_name}
+
+
+# Both take an optional venue_id, which goes straight to its shard and finds the venue by primary key
+def cmd_create_booking(args):
+    db_name = locate_venue(router, connect_to_shard, args.get('venue_name'), args.get('venue_id'))
+    with connect_to_shard(db_name) as connection:
+        status, booking_id = book_venue(connection, args.get('venue_name'), args['client_name'], args['date'],
+                                        args['start_time'], args['end_time'], venue_id=args.get('venue_id'))
+    return {'status': status, 'booking_id': booking_id, 'shard': db_name}
+
+
+def cmd_check_availability(args):
+    db_name = locate_venue(router, connect_to_shard, args.get('venue_name'), args.get('venue_id'))
+    # Advisory only: book_venue repeats the check on the primary under the venue lock
+    with read_from_shard(db_name) as connection:
+        with connection.cursor() as cursor:
+            if args.get('venue_id') is None:
+                cursor.execute("SELECT ID FROM Venues WHERE Name = %s", (args['venue_name'],))
+            else:
+                cursor.execute("SELECT ID FROM Venues WHERE ID = %s", (args['venue_id'],))
+            venue = cursor.fetchone()
+            if venue is None:
+                return {'status': 'no_venue'}
+            cursor.execute(OVERLAP_QUERY, (venue['ID'], args['date'], args['start_time'], args['end_time']))
+            return {'status': 'available' if cursor.fetchone() is None else 'booked'}
+
+
+def cmd_find_venue(args):
+    query = "SELECT Name, City, Capacity, Price_per_hour FROM Venues WHERE Name LIKE %s"
+    params = ['%' + args.get('keyword', '') + '%']
+    if args.get('city'):
+        query += " AND City = %s"
+        params.append(args['city'])
+    result = scatter_gather(read_from_shard, router.shards, query + " ORDER BY Name", params, hedge=hedged_read,
+                            sort_key=lambda row: row['Name'].casefold())
+    return {'status': 'partial' if result.partial else 'ok', 'venues': result.rows, 'errors': result.errors}
+
+
+# Read-only: writes across shards go through shard_query.py --write
+def cmd_query(args):
+    result = run_query(read_from_shard, router.shards, args['sql'], timeout=float(args.get('timeout', 30)),
+                       max_rows=int(args.get('max_rows', 1000)), shard_column='Shard')
+    return {'status': 'partial' if result.partial else 'ok', 'rows': result.rows, 'truncated': result.truncated,
+            'errors': result.errors}
+
+
+def cmd_pool_stats(args):
+    return {'status': 'ok', 'pools': pool_stats(), 'breakers': breaker_stats()}
+
+
+def cmd_metrics(args):
+    return {'status': 'ok', 'statements': metrics.statement_table(), 'slow_queries': list(metrics.slow_queries),
+            'prometheus': metrics.render_prometheus()}
+
+
+COMMANDS = {
+    'add_venue': cmd_add_venue,
+    'create_booking': cmd_create_booking,
+    'check_availability': cmd_check_availability,
+    'find_venue': cmd_find_venue,
+    'query': cmd_query,
+    'pool_stats': cmd_pool_stats,
+    'metrics': cmd_metrics,
+    'ping': lambda args: {'status': 'ok'},
+}
+
+
+def run_command(line):
+    """
+    Runs one JSON command such as {"command": "add_venue", "venue_name": "...", ...}
+    and returns its result with the command name and latency in milliseconds.
+    """
+    started = time.monotonic()
+    name = None
+    try:
+        request = json.loads(line)
+        name = request.pop('command', None)
+        if name in COMMANDS:
+            result = COMMANDS[name](request)
+        else:
+            result = {'status': 'error', 'error': f"unknown command {name!r}"}
+    except KeyError as e:
+        result = {'status': 'error', 'error': f"missing argument {e}"}
+    except Exception as e:
+        result = {'status': 'error', 'error': str(e)}
+    result['command'] = name
+    result['ms'] = round((time.monotonic() - started) * 1000, 2)
+    return result
+
+
+def encode(result):
+    return json.dumps(result, default=str) + '\n'
+
+
+def print_summary(count, errors, elapsed):
+    rate = count / elapsed if elapsed else 0.0
+    print(f"{count} commands, {errors} errors in {elapsed:.2f}s ({rate:.0f} commands/s)", file=sys.stderr)
+
+
+# Read JSON-lines commands from stdin and run them in-process over the pooled connections
+def run_batch(workers):
+    lines = (line for line in sys.stdin if line.strip())
+    started = time.monotonic()
+    count = errors = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(run_command, lines):
+            count += 1
+            errors += result['status'] == 'error'
+            sys.stdout.write(encode(result))
+    print_summary(count, errors, time.monotonic() - started)
+
+
+def open_client_socket(address):
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return socket.create_connection((host, int(port)))
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(address)
+    return client
+
+
+# Send JSON-lines commands from stdin to a running daemon, one at a time, and print its answers
+def run_client(address):
+    started = time.monotonic()
+    count = errors = 0
+    with open_client_socket(address) as client:
+        reader = client.makefile('r', encoding='utf-8')
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            sent = time.monotonic()
+            client.sendall(line.strip().encode('utf-8') + b'\n')
+            result = json.loads(reader.readline())
+            result['round_trip_ms'] = round((time.monotonic() - sent) * 1000, 2)
+            count += 1
+            errors += result['status'] == 'error'
+            sys.stdout.write(encode(result))
+    print_summary(count, errors, time.monotonic() - started)
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            line = line.decode('utf-8').strip()
+            if line:
+                self.wfile.write(encode(run_command(line)).encode('utf-8'))
+
+
+class UnixDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPDaemon(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# Keep the interpreter, imports and pooled connections warm and serve JSON-lines commands over a socket
+def serve(address):
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        server = TCPDaemon((host, int(port)), CommandHandler)
+    else:
+        if os.path.exists(address):
+            os.unlink(address)
+        server = UnixDaemon(address, CommandHandler)
+    print(f"eventmanager daemon listening on {address}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if ':' not in address and os.path.exists(address):
+            os.unlink(address)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='eventmanager', description="EventManager command line.")
+    subcommands = parser.add_subparsers(dest='subcommand', required=True)
+
+    add = subcommands.add_parser('add-venue', help="add one venue")
+    add.add_argument('venue_name')
+    add.add_argument('city')
+    add.add_argument('capacity', type=int)
+    add.add_argument('price_per_hour', type=float)
+
+    book = subcommands.add_parser('book', help="book one venue")
+    book.add_argument('client_name')
+    book.add_argument('date')
+    book.add_argument('start_time')
+    book.add_argument('end_time')
+    book.add_argument('venue_name')
+
+    batch = subcommands.add_parser('batch', help="run JSON-lines commands from stdin")
+    batch.add_argument('--workers', type=int, default=1, help="commands run concurrently in-process")
+    batch.add_argument('--connect', default=None, help="send the commands to a running daemon instead "
+                                                        f"(socket path such as {DEFAULT_SOCKET}, or host:port)")
+
+    daemon = subcommands.add_parser('serve', help="run a daemon that keeps connections warm")
+    daemon.add_argument('--listen', default=DEFAULT_SOCKET, help="unix socket path or host:port")
+    daemon.add_argument('--metrics-port', type=int, default=None, help="also serve Prometheus metrics on this port")
+
+    args = parser.parse_args(argv)
+    if args.subcommand == 'add-venue':
+        command = dict(vars(args), command='add_venue')
+    elif args.subcommand == 'book':
+        command = dict(vars(args), command='create_booking')
+    elif args.subcommand == 'batch':
+        return run_client(args.connect) if args.connect else run_batch(args.workers)
+    else:
+        if args.metrics_port:
+            start_metrics_server(args.metrics_port)
+        return serve(args.listen)
+    del command['subcommand']
+    sys.stdout.write(encode(run_command(json.dumps(command))))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,144 @@
+# IMPORT LIBRARIES
+import sys
+import time
+import random
+import socket
+import argparse
+import threading
+
+
+class FaultProxy:
+    """
+    TCP proxy on localhost in front of a MySQL server that injects faults into the connections
+    going through it, for trying deadlines, circuit breakers and hedged reads against a shard.
+
+    latency is added, in seconds, before every chunk forwarded in either direction; drop_rate is
+    the chance that a new connection is closed straight away. stall() holds every byte (the server
+    looks hung, connections stay open) until resume(), and drop_all() cuts the open connections.
+    Point a shard or replica's 'port' (and host 127.0.0.1) at proxy.port.
+    """
+    def __init__(self, target_host, target_port, listen_port=0, latency=0.0, drop_rate=0.0):
+        self.target = (target_host, int(target_port))
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.port = None
+        self._listen_port = listen_port
+        self._flowing = threading.Event()
+        self._flowing.set()
+        self._sockets = set()
+        self._lock = threading.Lock()
+        self._server = None
+        self._closed = False
+        self.stats = {'connections': 0, 'dropped': 0, 'bytes': 0}
+
+    def start(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(('127.0.0.1', self._listen_port))
+        self._server.listen(128)
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept, name='fault-proxy', daemon=True).start()
+        return self
+
+    def stall(self):
+        self._flowing.clear()
+
+    def resume(self):
+        self._flowing.set()
+
+    def drop_all(self):
+        with self._lock:
+            sockets = list(self._sockets)
+        for sock in sockets:
+            self._close(sock)
+
+    def stop(self):
+        self._closed = True
+        self._flowing.set()
+        self._close(self._server)
+        self.drop_all()
+
+    def _close(self, sock):
+        with self._lock:
+            self._sockets.discard(sock)
+        # Shut down first: a plain close() leaves a socket another thread is reading from open, so no FIN is sent
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            self.stats['connections'] += 1
+            if random.random() < self.drop_rate:
+                self.stats['dropped'] += 1
+                client.close()
+                continue
+            threading.Thread(target=self._open, args=(client,), daemon=True).start()
+
+    def _open(self, client):
+        try:
+            upstream = socket.create_connection(self.target, timeout=10)
+            upstream.settimeout(None)
+        except OSError:
+            client.close()
+            return
+        with self._lock:
+            self._sockets.update((client, upstream))
+        threading.Thread(target=self._pump, args=(client, upstream), daemon=True).start()
+        threading.Thread(target=self._pump, args=(upstream, client), daemon=True).start()
+
+    # Copy one direction of a connection, holding each chunk while stalled and for the added latency
+    def _pump(self, source, destination):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                self._flowing.wait()
+                if self.latency:
+                    time.sleep(self.latency)
+                destination.sendall(data)
+                self.stats['bytes'] += len(data)
+        except OSError:
+            pass
+        finally:
+            self._close(source)
+            self._close(destination)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fault-injecting TCP proxy in front of a MySQL server.")
+    parser.add_argument('listen_port', type=int, help="port to listen on, on 127.0.0.1")
+    parser.add_argument('target', help="host:port of the MySQL server")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every forwarded chunk")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="share of new connections closed at once")
+    parser.add_argument('--stall-every', type=float, default=None,
+                        help="stall the server for --stall-for seconds every this many seconds")
+    parser.add_argument('--stall-for', type=float, default=5.0)
+    args = parser.parse_args(sys.argv[1:])
+
+    host, _, port = args.target.rpartition(':')
+    proxy = FaultProxy(host or 'localhost', port, args.listen_port, args.latency, args.drop_rate).start()
+    print(f"forwarding 127.0.0.1:{proxy.port} to {args.target} (latency {args.latency}s, drop rate {args.drop_rate})")
+    try:
+        while True:
+            if args.stall_every is None:
+                time.sleep(3600)
+                continue
+            time.sleep(args.stall_every)
+            print("stalled")
+            proxy.stall()
+            time.sleep(args.stall_for)
+            proxy.resume()
+            print("resumed")
+    except KeyboardInterrupt:
+        proxy.stop()
@@ -0,0 +1,156 @@
+# IMPORT LIBRARIES
+import time
+import threading
+import pymysql
+
+# Venue and booking IDs are 64-bit and unique across shards, snowflake style: 41 bits of milliseconds
+# since EPOCH_MS, 10 bits of the number of the shard that created the row and 12 bits of sequence.
+# The milliseconds and the sequence are both drawn from the shard's IdSequence AUTO_INCREMENT, whose
+# values are slots (ms - EPOCH_MS) << 12 | sequence: every process writing to a shard draws from the
+# same counter and no slot is ever drawn twice, so more than 4096 IDs in a millisecond carry on into the
+# next milliseconds and later draws continue after them. A draw inserts into the caller's transaction,
+# but AUTO_INCREMENT hands its values out at once, without waiting for other draws to commit. The
+# counter's upkeep stays out of that transaction: keep_up moves a counter that has fallen behind the
+# clock up to it on the pool's autocommit side connection, and prune_id_sequence, run by retention.py's
+# archive job, deletes the drawn rows. The shard number is the shard's ShardInfo row; the shard map's
+# 'numbers' table gives each shard name its number. An ID is routed to its shard with
+# ShardRouter.shard_for_id and read by primary key there.
+
+EPOCH_MS = 1704067200000  # 2024-01-01 00:00 UTC
+SHARD_BITS = 10
+SEQUENCE_BITS = 12
+MAX_SHARD_NUMBER = (1 << SHARD_BITS) - 1
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+LEGACY_ID_LIMIT = 1 << 32  # AUTO_INCREMENT IDs from before migration 6 are all below this
+
+# The sequence table and the server's clock in milliseconds, shared with the stored procedures
+SEQUENCE_TABLE = """
+CREATE TABLE IF NOT EXISTS IdSequence (
+    Value BIGINT AUTO_INCREMENT PRIMARY KEY
+)
+"""
+
+NOW_MS = "CAST(UNIX_TIMESTAMP(NOW(3)) * 1000 AS UNSIGNED)"
+CLOCK_SLOT = f"(({NOW_MS} - {EPOCH_MS}) << {SEQUENCE_BITS})"
+
+# Seconds between checks of a shard's counter against the clock, in each process
+KEEP_UP_EVERY = 1.0
+_checked = {}  # shard name -> when its counter was last checked
+_checked_lock = threading.Lock()
+
+
+def make_id(ms, shard_number, sequence):
+    return ((ms - EPOCH_MS) << (SHARD_BITS + SEQUENCE_BITS)) | (shard_number << SEQUENCE_BITS) | (sequence & SEQUENCE_MASK)
+
+
+def id_from_slot(slot, shard_number):
+    return ((slot >> SEQUENCE_BITS) << (SHARD_BITS + SEQUENCE_BITS)) | (shard_number << SEQUENCE_BITS) | (slot & SEQUENCE_MASK)
+
+
+def shard_number_of(global_id):
+    """The number of the shard that created the ID, None for an AUTO_INCREMENT ID from before global IDs"""
+    global_id = int(global_id)
+    if global_id < LEGACY_ID_LIMIT:
+        return None
+    return (global_id >> SEQUENCE_BITS) & MAX_SHARD_NUMBER
+
+
+def shard_numbers(shard_map):
+    """Shard name -> number: the map's 'numbers' table, or else each shard's position in 'shards', from 1"""
+    numbers = dict(shard_map.get('numbers') or {})
+    if not numbers:
+        names = list(shard_map['shards'])
+        for shard in (shard_map.get('previous') or {}).get('shards', []):
+            if shard not in names:
+                names.append(shard)
+        numbers = {shard: number for number, shard in enumerate(names, 1)}
+    for shard, number in numbers.items():
+        if not 1 <= int(number) <= MAX_SHARD_NUMBER:
+            raise ValueError(f"shard number of {shard} must be between 1 and {MAX_SHARD_NUMBER}")
+    if len(set(numbers.values())) != len(numbers):
+        raise ValueError("every shard needs a different shard number")
+    return {shard: int(number) for shard, number in numbers.items()}
+
+
+# A multi-row insert only hands back its first value; the rest follow it only with these settings
+def consecutive_draws(cursor):
+    """Whether one insert of many rows draws consecutive values, asked once per connection"""
+    connection = cursor.connection
+    consecutive = getattr(connection, 'consecutive_draws', None)
+    if consecutive is None:
+        cursor.execute("SELECT @@innodb_autoinc_lock_mode AS lock_mode, @@auto_increment_increment AS increment")
+        settings = cursor.fetchone()
+        consecutive = settings is not None and settings['lock_mode'] in (0, 1) and settings['increment'] == 1
+        connection.consecutive_draws = consecutive
+    return consecutive
+
+
+def _draw(cursor, count):
+    """count slots from the counter: one insert when they come out consecutive, else one insert per slot"""
+    if count == 1 or consecutive_draws(cursor):
+        cursor.execute("INSERT INTO IdSequence () VALUES " + ", ".join(["()"] * count))
+        return list(range(cursor.lastrowid, cursor.lastrowid + count))
+    slots = []
+    for _ in range(count):
+        cursor.execute("INSERT INTO IdSequence () VALUES ()")
+        slots.append(cursor.lastrowid)
+    return slots
+
+
+def keep_up(connection):
+    """
+    Moves the counter of the connection's shard up to the clock when it has fallen behind, at most
+    every KEEP_UP_EVERY seconds, so IDs carry the time they were made. It runs on the pool's side
+    connection and commits at once, whatever transaction connection has open; connections from
+    outside a pool are left alone, and a failure only leaves the counter behind (IDs stay unique).
+    """
+    side_connection = getattr(connection, 'side_connection', None)
+    if side_connection is None:
+        return
+    now = time.monotonic()
+    with _checked_lock:
+        if now - _checked.get(connection.shard_name, -KEEP_UP_EVERY) < KEEP_UP_EVERY:
+            return
+        _checked[connection.shard_name] = now
+    try:
+        with side_connection() as side, side.cursor() as cursor:
+            cursor.execute("INSERT INTO IdSequence () VALUES ()")
+            slot = cursor.lastrowid
+            cursor.execute(f"SELECT {CLOCK_SLOT} AS Clock_slot")
+            clock_slot = cursor.fetchone()['Clock_slot']
+            if slot < clock_slot:
+                # An explicit value moves AUTO_INCREMENT past it; IGNORE, as another process may have moved it already
+                cursor.execute("INSERT IGNORE INTO IdSequence (Value) VALUES (%s)", (clock_slot,))
+    except pymysql.err.MySQLError:
+        pass
+
+
+def next_ids(cursor, count=1):
+    """Allocates count new IDs on the cursor's shard, in two round trips when draws come out consecutive"""
+    keep_up(cursor.connection)
+    slots = _draw(cursor, count)
+    cursor.execute("SELECT Shard_number FROM ShardInfo")
+    row = cursor.fetchone()
+    if row is None:
+        raise RuntimeError("the shard has no shard number, run create_tables.py")
+    return [id_from_slot(slot, row['Shard_number']) for slot in slots]
+
+
+def prune_id_sequence(connection, batch_size=10000):
+    """
+    Deletes the drawn IdSequence rows, batch_size per transaction; only the newest matters to
+    AUTO_INCREMENT. Rows that open transactions have just drawn make it wait for them, so it
+    belongs in a periodic job, never in a write path. Returns the number of rows deleted.
+    """
+    deleted = 0
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO IdSequence () VALUES ()")
+        newest = cursor.lastrowid
+        connection.commit()
+        while True:
+            cursor.execute("DELETE FROM IdSequence WHERE Value < %s ORDER BY Value LIMIT %s", (newest, batch_size))
+            batch = cursor.rowcount
+            connection.commit()
+            deleted += batch
+            if batch < batch_size:
+                return deleted
@@ -0,0 +1,215 @@
+# IMPORT LIBRARIES
+import sys
+import csv
+import time
+import random
+import argparse
+from datetime import datetime
+import pymysql
+from availability import AvailabilityIndex
+from booking import RETRYABLE_ERRORS
+from import_venues import read_records
+from rollups import add_bookings
+from global_ids import next_ids
+
+# Reason given to the lines of a chunk that could not be written; they can be imported again from the report
+NOT_WRITTEN = "not written"
+
+
+class ImportIncomplete(Exception):
+    """Some chunks could not be written; booked and rejections cover everything else, as import_bookings returns them"""
+    def __init__(self, booked, rejections, errors):
+        super().__init__(f"{len(errors)} chunks could not be written: {errors[0]}")
+        self.booked = booked
+        self.rejections = rejections
+        self.errors = errors
+
+
+# Turn one input record into (venue_name, client_name, date, start_time, end_time), raising ValueError if invalid
+def parse_booking(record):
+    venue_name = (record.get('venue_name') or '').strip()
+    client_name = (record.get('client_name') or '').strip()
+    if not venue_name or not client_name:
+        raise ValueError("venue_name and client_name are required")
+    date = datetime.strptime(str(record['date']).strip(), '%Y-%m-%d').date()
+    start_time = datetime.strptime(str(record['start_time']).strip()[:5], '%H:%M').time()
+    end_time = datetime.strptime(str(record['end_time']).strip()[:5], '%H:%M').time()
+    if start_time >= end_time:
+        raise ValueError("end_time must be later than start_time")
+    return (venue_name, client_name, date, start_time, end_time)
+
+
+def insert_bookings(cursor, bookings, prices=None):
+    """
+    Inserts (venue_id, client_name, date, start_time, end_time) rows into Bookings and VenueUsed
+    and adds them to the daily rollups; prices (venue_id -> Price_per_hour) saves looking rates up.
+    """
+    booking_ids = next_ids(cursor, len(bookings))
+    cursor.execute("INSERT INTO Bookings (ID, VenueID, Client_name, Date, Start_time, End_time) VALUES "
+                   + ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(bookings)),
+                   [value for booking, booking_id in zip(bookings, booking_ids) for value in (booking_id,) + tuple(booking)])
+    cursor.executemany("INSERT INTO VenueUsed (VenueID, BookingID) VALUES (%s, %s)",
+                       [(booking[0], booking_id) for booking, booking_id in zip(bookings, booking_ids)])
+    add_bookings(cursor, [(booking[0],) + tuple(booking[2:]) for booking in bookings], prices)
+
+
+def write_chunk(connection, chunk):
+    """
+    Books one chunk of (line_number, booking) items on one shard in a single transaction.
+    The chunk's venues are locked like book_venue does, their existing bookings on the chunk's
+    dates are loaded with one query, and the chunk is swept per venue and day in start-time
+    order, rejecting anything overlapping an existing or an earlier accepted booking.
+    Returns (accepted_count, rejections).
+    """
+    names = sorted({booking[0] for _, booking in chunk})
+    dates = sorted({booking[2] for _, booking in chunk})
+    rejections = []
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT ID, Name, Price_per_hour FROM Venues WHERE Name IN ({', '.join(['%s'] * len(names))}) FOR UPDATE",
+                       names)
+        venues = cursor.fetchall()
+        venue_ids = {row['Name'].casefold(): row['ID'] for row in venues}
+        prices = {row['ID']: row['Price_per_hour'] for row in venues}
+
+        index = AvailabilityIndex()
+        if venue_ids:
+            cursor.execute(f"""
+                SELECT b.VenueID, b.Date, b.Start_time, b.End_time FROM Bookings b
+                WHERE b.VenueID IN ({', '.join(['%s'] * len(venue_ids))})
+                AND b.Date IN ({', '.join(['%s'] * len(dates))})
+                """, list(venue_ids.values()) + dates)
+            for row in cursor.fetchall():
+                index.add(row['VenueID'], row['Date'], row['Start_time'], row['End_time'])
+
+        accepted = []
+        # Sort and sweep: per venue and day in start-time order, input order breaking ties
+        for line_number, booking in sorted(chunk, key=lambda item: (item[1][0].casefold(), item[1][2], item[1][3], item[0])):
+            venue_name, client_name, date, start_time, end_time = booking
+            venue_id = venue_ids.get(venue_name.casefold())
+            if venue_id is None:
+                rejections.append((line_number, booking, "venue does not exist"))
+            elif not index.is_free(venue_id, date, start_time, end_time):
+                rejections.append((line_number, booking, "overlaps another booking"))
+            else:
+                index.add(venue_id, date, start_time, end_time)
+                accepted.append((venue_id, client_name, date, start_time, end_time))
+
+        if accepted:
+            insert_bookings(cursor, accepted, prices)
+    connection.commit()
+    return len(accepted), rejections
+
+
+def import_bookings(records, connect, locate, chunk_size=500, max_retries=5, log=print):
+    """
+    Books a stream of booking records (client_name, date, start_time, end_time, venue_name).
+    Bookings are grouped by the shard holding their venue (locate(venue_name)) and written in
+    chunks of chunk_size, one transaction per chunk; deadlocked chunks are retried.
+    Returns (booked_per_shard, rejections) where rejections are (line_number, record or booking, reason).
+    A chunk that fails otherwise (a shard down, a deadline missed) does not stop the import: its
+    lines are rejected as NOT_WRITTEN and, once every other chunk is written, ImportIncomplete is
+    raised with the same results, so the report tells written lines from the ones to import again.
+    """
+    buffers = {}
+    shard_of = {}
+    booked = {}
+    rejections = []
+    errors = []
+
+    def not_written(items, error):
+        errors.append(error)
+        rejections.extend((line_number, booking, f"{NOT_WRITTEN}: {error}") for line_number, booking in items)
+
+    def write(shard, chunk):
+        with connect(shard) as connection:
+            for attempt in range(max_retries + 1):
+                try:
+                    return write_chunk(connection, chunk)
+                except pymysql.err.OperationalError as e:
+                    connection.rollback()
+                    if e.args[0] not in RETRYABLE_ERRORS or attempt == max_retries:
+                        raise
+                    time.sleep(0.05 * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def flush(shard):
+        chunk, buffers[shard] = buffers[shard], []
+        if not chunk:
+            return
+        try:
+            count, rejected = write(shard, chunk)
+        except Exception as e:
+            # The chunk's transaction was rolled back, so none of its lines were booked
+            not_written(chunk, e)
+            log(f"{shard}: {len(chunk)} bookings not written: {e}")
+            return
+        booked[shard] = booked.get(shard, 0) + count
+        rejections.extend(rejected)
+        log(f"{shard}: booked {count}, rejected {len(rejected)} of {len(chunk)}")
+
+    for line_number, record in records:
+        try:
+            if record is None:
+                raise ValueError("not a valid record")
+            booking = parse_booking(record)
+        except (KeyError, TypeError, ValueError) as e:
+            rejections.append((line_number, record, str(e)))
+            continue
+        key = booking[0].casefold()
+        if key not in shard_of:
+            try:
+                shard_of[key] = locate(booking[0])
+            except Exception as e:
+                not_written([(line_number, booking)], e)
+                continue
+        shard = shard_of[key]
+        buffers.setdefault(shard, []).append((line_number, booking))
+        if len(buffers[shard]) >= chunk_size:
+            flush(shard)
+    for shard in list(buffers):
+        flush(shard)
+    if errors:
+        raise ImportIncomplete(booked, rejections, errors) from errors[0]
+    return booked, rejections
+
+
+def write_rejections(path, rejections):
+    with open(path, 'w', newline='') as report:
+        writer = csv.writer(report)
+        writer.writerow(['line', 'venue_name', 'client_name', 'date', 'start_time', 'end_time', 'reason'])
+        for line_number, booking, reason in sorted(rejections, key=lambda rejection: rejection[0]):
+            if isinstance(booking, tuple):
+                writer.writerow([line_number, *booking, reason])
+            else:
+                record = booking or {}
+                writer.writerow([line_number] + [record.get(column, '') for column in
+                                                 ('venue_name', 'client_name', 'date', 'start_time', 'end_time')] + [reason])
+
+
+if __name__ == "__main__":
+    from shard_config import router, connect_to_shard
+    from shard_router import locate_venue
+
+    parser = argparse.ArgumentParser(description="Bulk import bookings from a CSV or JSON-lines file.")
+    parser.add_argument('path', help="a .csv file with a header row or a .jsonl file with client_name, date, "
+                                     "start_time, end_time, venue_name")
+    parser.add_argument('--chunk-size', type=int, default=500, help="bookings per transaction")
+    parser.add_argument('--rejections', default='rejected_bookings.csv', help="where to write the rejection report")
+    args = parser.parse_args(sys.argv[1:])
+
+    started = time.monotonic()
+    incomplete = None
+    try:
+        booked, rejections = import_bookings(read_records(args.path), connect_to_shard,
+                                             lambda venue_name: locate_venue(router, connect_to_shard, venue_name),
+                                             args.chunk_size)
+    except ImportIncomplete as e:
+        incomplete = e
+        booked, rejections = e.booked, e.rejections
+    write_rejections(args.rejections, rejections)
+    elapsed = time.monotonic() - started
+    total = sum(booked.values())
+    print(f"Booked {total} and rejected {len(rejections)} in {elapsed:.1f}s "
+          f"({total / elapsed if elapsed else 0:.0f} bookings/s). Rejections written to {args.rejections}.")
+    if incomplete is not None:
+        print(f"{incomplete}. Their lines are in the report as '{NOT_WRITTEN}'; import them again from it.")
+        sys.exit(1)
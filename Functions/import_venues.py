@@ -0,0 +1,207 @@
+# IMPORT LIBRARIES
+import os
+import sys
+import csv
+import json
+import time
+import queue
+import argparse
+import threading
+from rollups import reprice_venues
+from global_ids import next_ids
+
+# A venue that already exists keeps its ID; the new ID given with it goes unused
+UPSERT_QUERY = """
+INSERT INTO Venues (ID, Name, City, Capacity, Price_per_hour) VALUES (%s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE City = VALUES(City), Capacity = VALUES(Capacity), Price_per_hour = VALUES(Price_per_hour)
+"""
+
+
+# Turn one input record into a Venues row, raising ValueError if it cannot be imported
+def parse_venue(record):
+    name = (record.get('venue_name') or '').strip()
+    city = (record.get('city') or '').strip()
+    if not name or not city:
+        raise ValueError("venue_name and city are required")
+    capacity = int(record['capacity'])
+    price_per_hour = float(record['price_per_hour'])
+    if capacity < 1 or price_per_hour < 0:
+        raise ValueError("capacity must be positive and price_per_hour not negative")
+    return (name, city, capacity, price_per_hour)
+
+
+def upsert_venues(connection, rows):
+    """
+    Inserts or updates a chunk of (name, city, capacity, price_per_hour) rows with one multi-row
+    INSERT ... ON DUPLICATE KEY UPDATE (relies on the unique index on Venues.Name) and commits.
+    Repeated names inside the chunk are collapsed, the last one wins.
+    Returns (inserted, updated).
+    """
+    latest = {}
+    for row in rows:
+        latest[row[0]] = row
+    rows = list(latest.values())
+    if not rows:
+        return 0, 0
+    with connection.cursor() as cursor:
+        # One lookup tells inserts and updates apart; affected-row counts cannot for multi-row upserts
+        cursor.execute(f"SELECT Name FROM Venues WHERE Name IN ({', '.join(['%s'] * len(rows))})",
+                       [row[0] for row in rows])
+        existing = [row['Name'] for row in cursor.fetchall()]
+        venue_ids = next_ids(cursor, len(rows))
+        cursor.executemany(UPSERT_QUERY, [(venue_id,) + tuple(row) for venue_id, row in zip(venue_ids, rows)])
+        # Updated venues may have a new rate, which their rollup revenue follows
+        reprice_venues(cursor, existing)
+    connection.commit()
+    return len(rows) - len(existing), len(existing)
+
+
+# Stream records from a .csv or .jsonl file as (line_number, record)
+def read_records(path):
+    with open(path, newline='', encoding='utf-8') as source:
+        if path.endswith('.csv'):
+            for line_number, record in enumerate(csv.DictReader(source), start=2):
+                yield line_number, record
+        else:
+            for line_number, line in enumerate(source, start=1):
+                if line.strip():
+                    try:
+                        yield line_number, json.loads(line)
+                    except ValueError:
+                        yield line_number, None
+
+
+class Checkpoint:
+    # Last committed input line per shard, so an interrupted import can resume where each shard stopped
+    def __init__(self, path, source):
+        self.path = path
+        self.lines = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as saved:
+                state = json.load(saved)
+            if state.get('source') == os.path.abspath(source):
+                self.lines = state['shards']
+        self.source = os.path.abspath(source)
+
+    def done(self, shard, line_number):
+        return line_number <= self.lines.get(shard, 0)
+
+    def commit(self, shard, line_number):
+        with self._lock:
+            self.lines[shard] = line_number
+            if self.path:
+                with open(self.path + '.tmp', 'w') as saved:
+                    json.dump({'source': self.source, 'shards': self.lines}, saved)
+                os.replace(self.path + '.tmp', self.path)
+
+
+def import_venues(path, connect, route, shards, chunk_size=1000, checkpoint_path=None, log=print):
+    """
+    Streams venues from a CSV or JSON-lines file (columns venue_name, city, capacity,
+    price_per_hour) into their shards. Records are routed chunk_size at a time with
+    route(names), which returns {name: shard} (such as shard_router.locate_venues, so a venue
+    not yet moved by a resharding is updated where it lives), to one worker thread per shard,
+    which upserts them in chunks of chunk_size over its own connection.
+    Returns a per-shard report (rows inserted / updated / skipped, throughput) and the rejected lines.
+    """
+    checkpoint = Checkpoint(checkpoint_path, path)
+    queues = {shard: queue.Queue(maxsize=chunk_size * 4) for shard in shards}
+    report = {shard: {'inserted': 0, 'updated': 0, 'skipped': 0, 'seconds': 0.0, 'error': None}
+              for shard in shards}
+
+    def write_shard(shard, connection):
+        stats = report[shard]
+        chunk = []
+        last_line = 0
+        while True:
+            item = queues[shard].get()
+            if item is not None:
+                last_line, row = item
+                chunk.append(row)
+            if chunk and (item is None or len(chunk) >= chunk_size):
+                if stats['error'] is None:
+                    started = time.monotonic()
+                    try:
+                        inserted, updated = upsert_venues(connection, chunk)
+                        stats['inserted'] += inserted
+                        stats['updated'] += updated
+                        checkpoint.commit(shard, last_line)
+                    except Exception as e:
+                        # Stop writing to this shard; the checkpoint keeps its last good chunk
+                        stats['error'] = str(e)
+                        connection.rollback()
+                    stats['seconds'] += time.monotonic() - started
+                chunk = []
+            if item is None:
+                return
+
+    def worker(shard):
+        try:
+            with connect(shard) as connection:
+                write_shard(shard, connection)
+        except Exception as e:
+            report[shard]['error'] = str(e)
+            # Keep draining so the reader never blocks on a shard that could not be reached
+            while queues[shard].get() is not None:
+                pass
+
+    workers = [threading.Thread(target=worker, args=(shard,), name=f"import-{shard}") for shard in shards]
+    for thread in workers:
+        thread.start()
+
+    def dispatch(parsed):
+        shard_of = route([row[0] for _, row in parsed])
+        for line_number, row in parsed:
+            shard = shard_of[row[0]]
+            if checkpoint.done(shard, line_number):
+                report[shard]['skipped'] += 1
+                continue
+            queues[shard].put((line_number, row))
+
+    started = time.monotonic()
+    rejected = []
+    parsed = []
+    for line_number, record in read_records(path):
+        try:
+            if record is None:
+                raise ValueError("not valid JSON")
+            parsed.append((line_number, parse_venue(record)))
+        except (KeyError, TypeError, ValueError) as e:
+            rejected.append((line_number, str(e)))
+            continue
+        if len(parsed) >= chunk_size:
+            dispatch(parsed)
+            parsed = []
+    if parsed:
+        dispatch(parsed)
+    for shard in shards:
+        queues[shard].put(None)
+    for thread in workers:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    for shard, stats in report.items():
+        written = stats['inserted'] + stats['updated']
+        stats['rows_per_second'] = written / stats['seconds'] if stats['seconds'] else 0.0
+        log(f"{shard}: {stats['inserted']} inserted, {stats['updated']} updated, {stats['skipped']} already imported, "
+            f"{written / elapsed * 60 if elapsed else 0:.0f} venues/minute"
+            + (f", stopped: {stats['error']}" if stats['error'] else ""))
+    for line_number, reason in rejected[:20]:
+        log(f"line {line_number} rejected: {reason}")
+    log(f"{len(rejected)} rejected, total time {elapsed:.1f}s")
+    return {'shards': report, 'rejected': rejected, 'seconds': elapsed}
+
+
+if __name__ == "__main__":
+    from shard_config import router, connect_to_shard
+    from shard_router import locate_venues
+
+    parser = argparse.ArgumentParser(description="Bulk import venues from a CSV or JSON-lines file.")
+    parser.add_argument('path', help="a .csv file with a header row or a .jsonl file")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="rows per multi-row upsert")
+    parser.add_argument('--checkpoint', default=None, help="file recording progress, to resume an interrupted import")
+    args = parser.parse_args(sys.argv[1:])
+    result = import_venues(args.path, connect_to_shard, lambda names: locate_venues(router, connect_to_shard, names),
+                           router.shards, args.chunk_size, args.checkpoint)
+    sys.exit(1 if any(stats['error'] for stats in result['shards'].values()) else 0)
@@ -0,0 +1,338 @@
+# Versioned schema migrations, applied in order on every shard.
+# A step is either a SQL statement or a function taking a cursor, for steps that must check the schema first.
+# The versions applied to a shard are recorded in its SchemaVersion table.
+from rollups import backfill_rollups
+from procedures import install_procedures
+from booking import OVERLAP_QUERY
+from retention import archive_tables
+from partitions import require_booking_dates, partition_bookings
+from global_ids import SEQUENCE_TABLE, NOW_MS, EPOCH_MS, SHARD_BITS, SEQUENCE_BITS, SEQUENCE_MASK, LEGACY_ID_LIMIT, CLOCK_SLOT
+
+
+def add_index(table, index_name, columns, unique=False):
+    # MySQL has no CREATE INDEX IF NOT EXISTS, so look the index up first to keep the step re-runnable
+    def step(cursor):
+        cursor.execute("""
+            SELECT 1 FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s LIMIT 1
+            """, (table, index_name))
+        if cursor.fetchone() is None:
+            cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {index_name} ON {table} ({columns})")
+    step.__doc__ = f"Add {'unique ' if unique else ''}index {index_name} on {table} ({columns})"
+    return step
+
+
+def add_column(table, column, definition):
+    # Also looked up first, so the step can run again
+    def step(cursor):
+        cursor.execute("""
+            SELECT 1 FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s LIMIT 1
+            """, (table, column))
+        if cursor.fetchone() is None:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    step.__doc__ = f"Add column {column} {definition} to {table}"
+    return step
+
+
+def require_unique_venue_names(cursor):
+    """Refuse to add the unique Name index while duplicate venue names exist"""
+    cursor.execute("SELECT Name, COUNT(*) AS Copies FROM Venues GROUP BY Name HAVING COUNT(*) > 1 LIMIT 20")
+    duplicates = cursor.fetchall()
+    if duplicates:
+        names = ', '.join(f"'{row['Name']}' ({row['Copies']})" for row in duplicates)
+        raise RuntimeError(f"Duplicate venue names must be merged before the unique index can be added: {names}")
+
+
+def record_shard_number(cursor, shard_number):
+    """Stores the shard's number in its ShardInfo row, refusing to change a number already in use"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ShardInfo (
+            ID TINYINT PRIMARY KEY DEFAULT 1,
+            Shard_number SMALLINT NOT NULL,
+            Id_base_ms BIGINT NULL
+        );
+        """)
+    cursor.execute("SELECT Shard_number FROM ShardInfo")
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute("INSERT INTO ShardInfo (ID, Shard_number) VALUES (1, %s)", (shard_number,))
+    elif row['Shard_number'] != shard_number:
+        raise RuntimeError(f"The shard was numbered {row['Shard_number']}, not {shard_number}; "
+                           "its IDs would route to the wrong shard")
+
+
+def _foreign_keys(cursor, table):
+    cursor.execute("""
+        SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS
+        WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """, (table,))
+    return [row['CONSTRAINT_NAME'] for row in cursor.fetchall()]
+
+
+def _remap(cursor, table, column, base_offset, shard_bits, batch_size=10000):
+    # Old ID n becomes the ID made at base + (n >> 12) ms with sequence n & 4095: unique, ordered like
+    # the old IDs, older than any new ID, and computed from n alone, so every table is remapped alike
+    while True:
+        cursor.execute(f"""
+            UPDATE {table} SET {column} = ((%s + ({column} >> {SEQUENCE_BITS})) << {SHARD_BITS + SEQUENCE_BITS})
+                                          | %s | ({column} & {SEQUENCE_MASK})
+            WHERE {column} < %s LIMIT %s
+            """, (base_offset, shard_bits, LEGACY_ID_LIMIT, batch_size))
+        if cursor.rowcount == 0:
+            return
+        cursor.connection.commit()
+
+
+def assign_global_ids(cursor):
+    """Give the existing venues and bookings global IDs, updating every table that refers to them"""
+    cursor.execute("SELECT Shard_number, Id_base_ms FROM ShardInfo")
+    info = cursor.fetchone()
+    if info is None:
+        raise RuntimeError("Global IDs need the shard's number: run create_tables.py, which takes it from the shard map")
+    if info['Id_base_ms'] is None:
+        # Fixed once, so a migration stopped halfway remaps the remaining rows the same way
+        cursor.execute(f"""
+            SELECT {NOW_MS} - 1000 - (GREATEST(COALESCE((SELECT MAX(ID) FROM Venues), 0),
+                                               COALESCE((SELECT MAX(ID) FROM Bookings), 0)) >> {SEQUENCE_BITS}) AS Base
+            """)
+        info['Id_base_ms'] = cursor.fetchone()['Base']
+        cursor.execute("UPDATE ShardInfo SET Id_base_ms = %s", (info['Id_base_ms'],))
+        cursor.connection.commit()
+    base_offset = info['Id_base_ms'] - EPOCH_MS
+    shard_bits = info['Shard_number'] << SEQUENCE_BITS
+
+    for constraint in _foreign_keys(cursor, 'VenueUsed'):
+        cursor.execute(f"ALTER TABLE VenueUsed DROP FOREIGN KEY {constraint}")
+    cursor.execute("ALTER TABLE Venues MODIFY ID BIGINT NOT NULL")
+    cursor.execute("ALTER TABLE Bookings MODIFY ID BIGINT NOT NULL")
+    cursor.execute("ALTER TABLE VenueUsed MODIFY VenueID BIGINT NOT NULL, MODIFY BookingID BIGINT NOT NULL")
+    cursor.execute("ALTER TABLE VenueDailyStats MODIFY VenueID BIGINT NOT NULL")
+    archives = archive_tables(cursor)
+    for table in archives:
+        cursor.execute(f"ALTER TABLE {table} MODIFY BookingID BIGINT NOT NULL, MODIFY VenueID BIGINT NOT NULL")
+
+    for table, column in [('Venues', 'ID'), ('Bookings', 'ID'), ('VenueUsed', 'VenueID'), ('VenueUsed', 'BookingID'),
+                          ('VenueDailyStats', 'VenueID')] + \
+            [(table, column) for table in archives for column in ('BookingID', 'VenueID')]:
+        _remap(cursor, table, column, base_offset, shard_bits)
+
+    cursor.execute("""
+        ALTER TABLE VenueUsed
+        ADD CONSTRAINT fk_venueused_venue FOREIGN KEY (VenueID) REFERENCES Venues(ID),
+        ADD CONSTRAINT fk_venueused_booking FOREIGN KEY (BookingID) REFERENCES Bookings(ID)
+        """)
+
+
+def advance_id_sequence(cursor):
+    """Moves IdSequence, now drawn as slots, past the clock and the milliseconds of every ID made so far"""
+    cursor.execute(f"""
+        SELECT GREATEST({CLOCK_SLOT},
+                        ((GREATEST(COALESCE((SELECT MAX(ID) FROM Venues), 0),
+                                   COALESCE((SELECT MAX(ID) FROM Bookings), 0)) >> {SHARD_BITS + SEQUENCE_BITS}) + 1)
+                        << {SEQUENCE_BITS}) AS Slot
+        """)
+    cursor.execute("INSERT IGNORE INTO IdSequence (Value) VALUES (%s)", (cursor.fetchone()['Slot'],))
+
+
+def backfill_booking_venues(cursor, batch_size=10000):
+    """Copy each booking's venue from VenueUsed into Bookings.VenueID, a batch of bookings per transaction"""
+    last_id = -1
+    while True:
+        cursor.execute("SELECT ID FROM Bookings WHERE ID > %s ORDER BY ID LIMIT %s", (last_id, batch_size))
+        booking_ids = [row['ID'] for row in cursor.fetchall()]
+        if not booking_ids:
+            return
+        cursor.execute("""
+            UPDATE Bookings b JOIN VenueUsed vu ON vu.BookingID = b.ID SET b.VenueID = vu.VenueID
+            WHERE b.ID BETWEEN %s AND %s AND b.VenueID IS NULL
+            """, (booking_ids[0], booking_ids[-1]))
+        cursor.connection.commit()
+        last_id = booking_ids[-1]
+
+
+MIGRATIONS = [
+    (1, "Create Venues, Bookings and VenueUsed", [
+        """
+        CREATE TABLE IF NOT EXISTS Venues (
+            ID INT AUTO_INCREMENT PRIMARY KEY,
+            Name VARCHAR(255),
+            City VARCHAR(100),
+            Capacity INT,
+            Price_per_hour DECIMAL(10,2)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Bookings (
+            ID INT AUTO_INCREMENT PRIMARY KEY,
+            Client_name VARCHAR(255),
+            Date DATE,
+            Start_time TIME,
+            End_time TIME
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS VenueUsed (
+            VenueID INT,
+            BookingID INT,
+            FOREIGN KEY (VenueID) REFERENCES Venues(ID),
+            FOREIGN KEY (BookingID) REFERENCES Bookings(ID),
+            PRIMARY KEY (VenueID, BookingID)
+        );
+        """,
+    ]),
+    # Overlap checks walk VenueUsed by its (VenueID, BookingID) primary key, which is already the
+    # VenueID-first access path, then probe Bookings by ID; the (Date, Start_time, End_time) index
+    # covers date-range scans of Bookings.
+    (2, "Indexes for venue lookups and booking overlap checks", [
+        require_unique_venue_names,
+        add_index('Venues', 'idx_venues_name', 'Name', unique=True),
+        add_index('Venues', 'idx_venues_city', 'City'),
+        add_index('Bookings', 'idx_bookings_date_start', 'Date, Start_time, End_time'),
+    ]),
+    # Per venue and day totals kept current by the write paths (see rollups.py), so dashboards
+    # read the rollups instead of scanning Bookings
+    (3, "Daily venue rollups of booked minutes, bookings and revenue", [
+        """
+        CREATE TABLE IF NOT EXISTS VenueDailyStats (
+            VenueID INT NOT NULL,
+            Date DATE NOT NULL,
+            Booked_minutes INT NOT NULL DEFAULT 0,
+            Bookings INT NOT NULL DEFAULT 0,
+            Revenue DECIMAL(16,4) NOT NULL DEFAULT 0,
+            PRIMARY KEY (VenueID, Date),
+            KEY idx_daily_stats_date (Date, VenueID)
+        );
+        """,
+        backfill_rollups,
+    ]),
+    # Runs of retention.py's archiver; archive tables themselves are created per month as bookings age
+    (4, "Booking archive runs", [
+        """
+        CREATE TABLE IF NOT EXISTS ArchiveRuns (
+            ID INT AUTO_INCREMENT PRIMARY KEY,
+            Archived_before DATE NOT NULL,
+            Bookings INT NOT NULL DEFAULT 0,
+            Started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            Finished_at DATETIME NULL
+        );
+        """,
+    ]),
+    # Booking and venue writes as one CALL each; a later change to a procedure reinstalls them in a new version
+    (5, "Stored procedures for bookings and venue writes", [
+        install_procedures,
+    ]),
+    # Venue and booking IDs with the shard number embedded (see global_ids.py); the procedures now draw them
+    (6, "Global 64-bit venue and booking IDs", [
+        SEQUENCE_TABLE,
+        assign_global_ids,
+        install_procedures,
+    ]),
+    # Overlap checks read Bookings by (VenueID, Date) in the one partition of their date (see partitions.py),
+    # so their cost no longer grows with the venue's history; VenueUsed stays the link the other queries join
+    (7, "Monthly Bookings partitions and venue-first overlap index", [
+        add_column('Bookings', 'VenueID', 'BIGINT NULL AFTER ID'),
+        backfill_booking_venues,
+        require_booking_dates,
+        partition_bookings,
+        add_index('Bookings', 'idx_bookings_venue_date', 'VenueID, Date, Start_time, End_time'),
+        install_procedures,
+    ]),
+    # The IdSequence counter carries the milliseconds of each ID as well as its sequence (see global_ids.py),
+    # so over 4096 IDs in a millisecond can no longer repeat an ID
+    (8, "Global IDs drawn as millisecond and sequence slots", [
+        advance_id_sequence,
+        install_procedures,
+    ]),
+    # Venue updates and deletes find the venue by its ID when the caller has it, as bookings do
+    (9, "Venue update and delete procedures by ID", [
+        install_procedures,
+    ]),
+    # sp_next_id only draws; moving the counter up to the clock and pruning it run outside the writes' transactions
+    (10, "ID draws without counter upkeep", [
+        install_procedures,
+    ]),
+    # Deleting a venue also deletes its archived bookings, from every BookingsArchive_YYYYMM table
+    (11, "Venue deletes that clear the archive tables", [
+        install_procedures,
+    ]),
+]
+
+
+def applied_versions(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS SchemaVersion (
+            Version INT PRIMARY KEY,
+            Description VARCHAR(255),
+            Applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+    cursor.execute("SELECT Version FROM SchemaVersion")
+    return {row['Version'] for row in cursor.fetchall()}
+
+
+def migrate(connection, target_version=None, log=print, shard_number=None):
+    """
+    Applies every migration newer than the shard's recorded versions, up to target_version.
+    Returns the list of versions applied. DDL commits implicitly in MySQL, so each step is
+    written to be safe to run again if a migration fails halfway. shard_number, from the
+    shard map, is recorded on the shard for its global IDs.
+    """
+    applied = []
+    with connection.cursor() as cursor:
+        done = applied_versions(cursor)
+        if shard_number is not None:
+            record_shard_number(cursor, shard_number)
+            connection.commit()
+        for version, description, steps in MIGRATIONS:
+            if version in done or (target_version is not None and version > target_version):
+                continue
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute("INSERT INTO SchemaVersion (Version, Description) VALUES (%s, %s)", (version, description))
+            connection.commit()
+            log(f"Applied migration {version}: {description}")
+            applied.append(version)
+    return applied
+
+
+# Hot queries, a query fetching real parameters for them, and the indexes each table access may use
+EXPLAIN_CHECKS = [
+    ("SELECT ID FROM Venues WHERE Name = %s",
+     "SELECT Name FROM Venues LIMIT 1",
+     {'Venues': {'idx_venues_name'}}),
+    ("SELECT Name, City, Capacity, Price_per_hour FROM Venues WHERE City = %s",
+     "SELECT City FROM Venues LIMIT 1",
+     {'Venues': {'idx_venues_city'}}),
+    (OVERLAP_QUERY,
+     "SELECT VenueID, Date, Start_time, End_time FROM Bookings WHERE VenueID IS NOT NULL LIMIT 1",
+     {'Bookings': {'idx_bookings_venue_date'}}),
+]
+
+
+def explain_check(connection):
+    """
+    Runs EXPLAIN on the hot lookup and overlap queries using parameters taken from the shard's
+    own data. Returns (query, table, allowed_indexes, used_index) for every table access that
+    scans the table, uses an unexpected index or reads more than one partition; queries with
+    no sample data are skipped.
+    """
+    failures = []
+    with connection.cursor() as cursor:
+        for query, sample_query, allowed in EXPLAIN_CHECKS:
+            cursor.execute(sample_query)
+            sample = cursor.fetchone()
+            if sample is None:
+                continue
+            cursor.execute("EXPLAIN " + query, tuple(sample.values()))
+            for row in cursor.fetchall():
+                table = row['table']
+                if row['type'] == 'ALL' or row['key'] not in allowed.get(table, {row['key']}):
+                    failures.append((' '.join(query.split()), table, sorted(allowed.get(table, [])), row['key']))
+                elif ',' in (row.get('partitions') or ''):
+                    failures.append((' '.join(query.split()), table, sorted(allowed.get(table, [])),
+                                     f"{row['key']} over partitions {row['partitions']}"))
+    return failures
@@ -0,0 +1,77 @@
+# IMPORT LIBRARIES
+from scatter_gather import scatter_gather
+
+
+class Page:
+    def __init__(self, number, rows, has_next, errors):
+        self.number = number  # 0-based
+        self.rows = rows
+        self.has_next = has_next
+        self.errors = errors  # shard name -> error message for shards missing from this page
+
+    @property
+    def partial(self):
+        return bool(self.errors)
+
+
+class KeysetPager:
+    """
+    Pages through one query on every shard in a single stable order.
+
+    A page is one query per shard for the rows whose key_column comes after the last key of
+    the previous page (keyset pagination, so the database seeks the index instead of skipping
+    OFFSET rows), limited to page_size + 1 rows and read with a streaming cursor. The shards'
+    pages are merged, rows with equal keys on two shards are collapsed, and the merge is cut to
+    page_size. The key each visited page starts after is remembered, so going back or reloading
+    a page is one round of queries, and memory stays at one page per shard however large the
+    catalog is.
+
+    select is the query without WHERE / ORDER BY / LIMIT, where an optional condition using
+    params, and key_column a column that is unique and appears in the selected rows. hedge is
+    passed on to scatter_gather.
+    """
+    def __init__(self, connect, db_names, select, key_column, where=None, params=(), page_size=50, timeout=5.0,
+                 shard_column=None, hedge=None):
+        self.connect = connect
+        self.db_names = list(db_names)
+        self.select = select
+        self.key_column = key_column
+        self.where = where
+        self.params = list(params)
+        self.page_size = page_size
+        self.timeout = timeout
+        self.shard_column = shard_column
+        self.hedge = hedge
+        self.bookmarks = [None]  # bookmarks[n] = key page n starts after
+
+    def _fetch(self, after):
+        conditions = [f"({self.where})"] if self.where else []
+        params = list(self.params)
+        if after is not None:
+            conditions.append(f"{self.key_column} > %s")
+            params.append(after)
+        query = self.select
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY {self.key_column} LIMIT %s"
+        params.append(self.page_size + 1)
+        # Case-insensitive, like the shards' default collation
+        result = scatter_gather(self.connect, self.db_names, query, params, timeout=self.timeout,
+                                sort_key=lambda row: (row[self.key_column] or '').casefold(), distinct=True,
+                                shard_column=self.shard_column, unbuffered=True, hedge=self.hedge)
+        return result.rows[:self.page_size], len(result.rows) > self.page_size, result.errors
+
+    def page(self, number):
+        """
+        Returns page `number` (0-based). Pages past the last visited one are reached by walking
+        forward; asking beyond the end returns the last page.
+        """
+        number = max(0, number)
+        current = min(number, len(self.bookmarks) - 1)
+        while True:
+            rows, has_next, errors = self._fetch(self.bookmarks[current])
+            if has_next and current + 1 == len(self.bookmarks):
+                self.bookmarks.append(rows[-1][self.key_column])
+            if current >= number or not has_next:
+                return Page(current, rows, has_next, errors)
+            current += 1
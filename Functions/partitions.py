@@ -0,0 +1,163 @@
+# IMPORT LIBRARIES
+import sys
+import time
+import argparse
+from datetime import date, timedelta
+from availability import to_date
+
+# Bookings is RANGE partitioned on Date, one partition per month: pYYYYMM holds that month (the first one
+# also anything older) and pfuture everything after the last month, so an insert never fails for want of
+# a partition. A query naming one Date reads a single partition however long the history grows, and a
+# month that retention.py has archived is dropped whole instead of deleted row by row. MySQL allows no
+# foreign keys to or from a partitioned table and needs Date in every unique key, so the primary key is
+# (ID, Date) and VenueUsed no longer has a foreign key to Bookings; the write paths keep the two in step.
+
+FUTURE = 'pfuture'
+MONTHS_AHEAD = 3  # months past the current one that always have their own partition
+
+
+def month_start(day):
+    return to_date(day).replace(day=1)
+
+
+def next_month(month):
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(month):
+    return f"p{month:%Y%m}"
+
+
+def months_between(first, last):
+    month = month_start(first)
+    while month <= month_start(last):
+        yield month
+        month = next_month(month)
+
+
+def months_ahead(months=MONTHS_AHEAD):
+    month = month_start(date.today())
+    for _ in range(months):
+        month = next_month(month)
+    return month
+
+
+def _partition(month):
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{next_month(month):%Y-%m-%d}')"
+
+
+FUTURE_PARTITION = f"PARTITION {FUTURE} VALUES LESS THAN (MAXVALUE)"
+
+
+def partitions(cursor, table='Bookings'):
+    """(name, bound, approximate rows) of the table's partitions in order, bound None for pfuture; [] if not partitioned"""
+    cursor.execute("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+        """, (table,))
+    return [(row['PARTITION_NAME'],
+             None if row['PARTITION_DESCRIPTION'] == 'MAXVALUE' else to_date(row['PARTITION_DESCRIPTION'].strip("'")),
+             row['TABLE_ROWS']) for row in cursor.fetchall()]
+
+
+def require_booking_dates(cursor):
+    """Refuse to partition Bookings while bookings without a date exist"""
+    cursor.execute("SELECT COUNT(*) AS Undated FROM Bookings WHERE Date IS NULL")
+    undated = cursor.fetchone()['Undated']
+    if undated:
+        raise RuntimeError(f"{undated} bookings have no date; give them one or delete them before Bookings is partitioned")
+
+
+def partition_bookings(cursor):
+    """Partition Bookings by month, from its first booking to MONTHS_AHEAD months from now"""
+    if partitions(cursor):
+        return
+    cursor.execute("""
+        SELECT TABLE_NAME, CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS
+        WHERE CONSTRAINT_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME = 'Bookings'
+        """)
+    for row in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE {row['TABLE_NAME']} DROP FOREIGN KEY {row['CONSTRAINT_NAME']}")
+    cursor.execute("SELECT MIN(Date) AS First FROM Bookings")
+    first = cursor.fetchone()['First'] or date.today()
+    clauses = [_partition(month) for month in months_between(first, months_ahead())] + [FUTURE_PARTITION]
+    # One table rebuild for the key change and the partitioning
+    cursor.execute(f"""
+        ALTER TABLE Bookings MODIFY Date DATE NOT NULL, DROP PRIMARY KEY, ADD PRIMARY KEY (ID, Date)
+        PARTITION BY RANGE COLUMNS(Date) ({', '.join(clauses)})
+        """)
+
+
+def ensure_partitions(cursor, through=None, since=None):
+    """
+    Gives every month up to through (default MONTHS_AHEAD months from now), and from since if
+    given, its own Bookings partition, splitting them off pfuture and the first partition.
+    Only the split partitions' rows are copied, so this is quick while they are empty.
+    Returns the names of the partitions added; does nothing if Bookings is not partitioned.
+    """
+    existing = [(name, bound) for name, bound, _ in partitions(cursor)]
+    if not existing:
+        return []
+    added = []
+    bounded = [(name, bound) for name, bound in existing if bound is not None]
+    last = month_start(through or months_ahead())
+    # The month after the last bounded partition (its bound is that month's first day)
+    start = max(bound for _, bound in bounded) if bounded else month_start(since or date.today())
+    if start <= last:
+        months = list(months_between(start, last))
+        cursor.execute(f"ALTER TABLE Bookings REORGANIZE PARTITION {FUTURE} INTO "
+                       f"({', '.join(_partition(month) for month in months)}, {FUTURE_PARTITION})")
+        added.extend(partition_name(month) for month in months)
+
+    # Months before the first partition's own month are split off it, the first keeping its bound
+    if since is not None and bounded:
+        first_name, first_bound = bounded[0]
+        first_month = (first_bound - timedelta(days=1)).replace(day=1)
+        if month_start(since) < first_month:
+            months = list(months_between(since, first_month - timedelta(days=1)))
+            cursor.execute(f"ALTER TABLE Bookings REORGANIZE PARTITION {first_name} INTO "
+                           f"({', '.join(_partition(month) for month in months)}, "
+                           f"PARTITION {first_name} VALUES LESS THAN ('{first_bound:%Y-%m-%d}'))")
+            added.extend(partition_name(month) for month in months)
+    return added
+
+
+def drop_partition(cursor, name):
+    """
+    Drops one month of Bookings once none of its bookings are linked to a venue any more
+    (retention.py archives them first). Returns False, dropping nothing, while some still are.
+    """
+    cursor.execute(f"""
+        SELECT 1 FROM Bookings PARTITION ({name}) b JOIN VenueUsed vu ON vu.BookingID = b.ID LIMIT 1
+        """)
+    if cursor.fetchone():
+        return False
+    cursor.execute(f"ALTER TABLE Bookings DROP PARTITION {name}")
+    return True
+
+
+if __name__ == "__main__":
+    from shard_config import router, connect_to_shard
+
+    parser = argparse.ArgumentParser(description="Show or maintain the monthly partitions of Bookings on every shard.")
+    subcommands = parser.add_subparsers(dest='action', required=True)
+    subcommands.add_parser('show', help="list each shard's partitions with their approximate row counts")
+    maintain = subcommands.add_parser('maintain', help="add the partitions of the coming months")
+    maintain.add_argument('--ahead', type=int, default=MONTHS_AHEAD, help="months past the current one to prepare")
+    maintain.add_argument('--every', type=float, default=None, help="keep running, checking again every this many hours")
+    args = parser.parse_args(sys.argv[1:])
+
+    while True:
+        for shard in router.shards:
+            with connect_to_shard(shard) as connection:
+                with connection.cursor() as cursor:
+                    if args.action == 'show':
+                        for name, bound, rows in partitions(cursor):
+                            print(f"{shard}: {name:10} {'MAXVALUE' if bound is None else f'< {bound}':14} ~{rows} rows")
+                    else:
+                        added = ensure_partitions(cursor, months_ahead(args.ahead))
+                        print(f"{shard}: added {', '.join(added)}" if added else f"{shard}: partitions are ready")
+        if args.action == 'show' or args.every is None:
+            break
+        time.sleep(args.every * 3600)
@@ -0,0 +1,337 @@
+# IMPORT LIBRARIES
+import time
+import pymysql
+from rollups import reprice_venues
+from retention import delete_venue as delete_venue_in_batches, ARCHIVE_PATTERN
+from global_ids import next_ids, keep_up, SHARD_BITS, SEQUENCE_BITS, SEQUENCE_MASK
+
+# Stored procedures for the write paths, installed on every shard by migration 5 (see migrations.py).
+# Each runs its whole transaction on the server and ends with one status row, so a booking or a venue
+# write is a single CALL round trip instead of a SELECT, the writes and a COMMIT. Shards that do not
+# have the procedures yet are served by the equivalent Python statements.
+
+# Status codes returned by the procedures (book_venue's are re-exported by booking.py)
+BOOKED = 'booked'
+CONFLICT = 'conflict'
+NO_VENUE = 'no_venue'
+ADDED = 'added'
+UPDATED = 'updated'
+EXISTS = 'exists'
+DELETED = 'deleted'
+
+ER_SP_DOES_NOT_EXIST = 1305
+RECHECK_SECONDS = 60.0  # how long a shard without the procedures is served by the Python statements
+
+# The next global ID of this shard, drawn as next_ids draws it (see global_ids.py)
+NEXT_ID = f"""
+CREATE PROCEDURE sp_next_id(OUT p_id BIGINT)
+BEGIN
+    DECLARE v_slot BIGINT;
+    INSERT INTO IdSequence () VALUES ();
+    SET v_slot = LAST_INSERT_ID();
+    SELECT ((v_slot >> {SEQUENCE_BITS}) << {SHARD_BITS + SEQUENCE_BITS}) | (Shard_number << {SEQUENCE_BITS})
+           | (v_slot & {SEQUENCE_MASK})
+    INTO p_id FROM ShardInfo;
+END
+"""
+
+# The venue is given by its ID, or by name when p_venue_id is NULL
+BOOK_VENUE = f"""
+CREATE PROCEDURE sp_book_venue(IN p_venue_id BIGINT, IN p_venue VARCHAR(255), IN p_client VARCHAR(255),
+                               IN p_date DATE, IN p_start TIME, IN p_end TIME)
+BEGIN
+    DECLARE v_id BIGINT DEFAULT NULL;
+    DECLARE v_price DECIMAL(10,2) DEFAULT 0;
+    DECLARE v_booking BIGINT;
+    DECLARE v_minutes INT;
+    DECLARE CONTINUE HANDLER FOR NOT FOUND SET v_id = NULL;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION BEGIN ROLLBACK; RESIGNAL; END;
+
+    START TRANSACTION;
+    -- Bookings of the same venue queue behind this row lock, as in booking.py
+    IF p_venue_id IS NULL THEN
+        SELECT ID, Price_per_hour INTO v_id, v_price FROM Venues WHERE Name = p_venue FOR UPDATE;
+    ELSE
+        SELECT ID, Price_per_hour INTO v_id, v_price FROM Venues WHERE ID = p_venue_id FOR UPDATE;
+    END IF;
+    IF v_id IS NULL THEN
+        ROLLBACK;
+        SELECT '{NO_VENUE}' AS Status, NULL AS BookingID;
+    ELSEIF EXISTS (SELECT 1 FROM Bookings b WHERE b.VenueID = v_id AND b.Date = p_date
+                   AND NOT (p_start >= b.End_time OR p_end <= b.Start_time)) THEN
+        ROLLBACK;
+        SELECT '{CONFLICT}' AS Status, NULL AS BookingID;
+    ELSE
+        CALL sp_next_id(v_booking);
+        INSERT INTO Bookings (ID, VenueID, Client_name, Date, Start_time, End_time)
+        VALUES (v_booking, v_id, p_client, p_date, p_start, p_end);
+        INSERT INTO VenueUsed (VenueID, BookingID) VALUES (v_id, v_booking);
+        SET v_minutes = (TIME_TO_SEC(p_end) - TIME_TO_SEC(p_start)) DIV 60;
+        INSERT INTO VenueDailyStats (VenueID, Date, Booked_minutes, Bookings, Revenue)
+        VALUES (v_id, p_date, v_minutes, 1, v_minutes * COALESCE(v_price, 0) / 60)
+        ON DUPLICATE KEY UPDATE Booked_minutes = Booked_minutes + VALUES(Booked_minutes),
+                                Bookings = Bookings + 1, Revenue = Revenue + VALUES(Revenue);
+        COMMIT;
+        SELECT '{BOOKED}' AS Status, v_booking AS BookingID;
+    END IF;
+END
+"""
+
+UPSERT_VENUE = f"""
+CREATE PROCEDURE sp_upsert_venue(IN p_name VARCHAR(255), IN p_city VARCHAR(100), IN p_capacity INT,
+                                 IN p_price DECIMAL(10,2), IN p_overwrite BOOLEAN)
+BEGIN
+    DECLARE v_id BIGINT DEFAULT NULL;
+    DECLARE v_status VARCHAR(20) DEFAULT NULL;
+    DECLARE CONTINUE HANDLER FOR NOT FOUND SET v_id = NULL;
+    -- A concurrent insert of the same name got there first
+    DECLARE CONTINUE HANDLER FOR 1062 SET v_status = '{EXISTS}';
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION BEGIN ROLLBACK; RESIGNAL; END;
+
+    START TRANSACTION;
+    SELECT ID INTO v_id FROM Venues WHERE Name = p_name FOR UPDATE;
+    IF v_id IS NULL THEN
+        CALL sp_next_id(v_id);
+        INSERT INTO Venues (ID, Name, City, Capacity, Price_per_hour) VALUES (v_id, p_name, p_city, p_capacity, p_price);
+        SET v_status = COALESCE(v_status, '{ADDED}');
+    ELSEIF p_overwrite THEN
+        UPDATE Venues SET City = p_city, Capacity = p_capacity, Price_per_hour = p_price WHERE ID = v_id;
+        UPDATE VenueDailyStats SET Revenue = Booked_minutes * p_price / 60 WHERE VenueID = v_id;
+        SET v_status = '{UPDATED}';
+    ELSE
+        SET v_status = '{EXISTS}';
+    END IF;
+    COMMIT;
+    SELECT v_status AS Status, ID, Name, City, Capacity, Price_per_hour FROM Venues WHERE Name = p_name;
+END
+"""
+
+# The venue is given by its ID, or by name when p_venue_id is NULL, as in sp_book_venue
+UPDATE_VENUE = f"""
+CREATE PROCEDURE sp_update_venue(IN p_venue_id BIGINT, IN p_name VARCHAR(255), IN p_city VARCHAR(100),
+                                 IN p_capacity INT, IN p_price DECIMAL(10,2))
+BEGIN
+    DECLARE v_id BIGINT DEFAULT NULL;
+    DECLARE CONTINUE HANDLER FOR NOT FOUND SET v_id = NULL;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION BEGIN ROLLBACK; RESIGNAL; END;
+
+    START TRANSACTION;
+    IF p_venue_id IS NULL THEN
+        SELECT ID INTO v_id FROM Venues WHERE Name = p_name FOR UPDATE;
+    ELSE
+        SELECT ID INTO v_id FROM Venues WHERE ID = p_venue_id FOR UPDATE;
+    END IF;
+    IF v_id IS NULL THEN
+        ROLLBACK;
+        SELECT '{NO_VENUE}' AS Status, NULL AS ID, NULL AS Name, NULL AS City, NULL AS Capacity, NULL AS Price_per_hour;
+    ELSE
+        -- NULL leaves a column unchanged
+        UPDATE Venues SET City = COALESCE(p_city, City), Capacity = COALESCE(p_capacity, Capacity),
+                          Price_per_hour = COALESCE(p_price, Price_per_hour)
+        WHERE ID = v_id;
+        IF p_price IS NOT NULL THEN
+            UPDATE VenueDailyStats SET Revenue = Booked_minutes * p_price / 60 WHERE VenueID = v_id;
+        END IF;
+        COMMIT;
+        SELECT '{UPDATED}' AS Status, ID, Name, City, Capacity, Price_per_hour FROM Venues WHERE ID = v_id;
+    END IF;
+END
+"""
+
+# The same batches as retention.delete_venue: each transaction locks the venue row, removes up to
+# p_batch_size of its bookings and commits; the last one also removes the rollups and the venue.
+# The venue is given by its ID, or by name when p_venue_id is NULL.
+DELETE_VENUE = f"""
+CREATE PROCEDURE sp_delete_venue(IN p_venue_id BIGINT, IN p_name VARCHAR(255), IN p_batch_size INT)
+BEGIN
+    DECLARE v_id BIGINT DEFAULT NULL;
+    DECLARE v_found BOOLEAN DEFAULT FALSE;
+    DECLARE v_batch INT DEFAULT 0;
+    DECLARE v_deleted INT DEFAULT 0;
+    DECLARE v_archived INT DEFAULT 0;
+    DECLARE v_table VARCHAR(64) DEFAULT NULL;
+    DECLARE CONTINUE HANDLER FOR NOT FOUND SET v_id = NULL;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION BEGIN ROLLBACK; RESIGNAL; END;
+
+    CREATE TEMPORARY TABLE IF NOT EXISTS DeleteVenueBatch (BookingID BIGINT PRIMARY KEY);
+    -- The archive tables (see retention.py) are walked in name order; MIN gives NULL past the last one
+    SELECT MIN(TABLE_NAME) INTO v_table FROM information_schema.TABLES
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE '{ARCHIVE_PATTERN}';
+    deleting: LOOP
+        START TRANSACTION;
+        SET v_id = NULL;
+        IF p_venue_id IS NULL THEN
+            SELECT ID INTO v_id FROM Venues WHERE Name = p_name FOR UPDATE;
+        ELSE
+            SELECT ID INTO v_id FROM Venues WHERE ID = p_venue_id FOR UPDATE;
+        END IF;
+        IF v_id IS NULL THEN
+            ROLLBACK;
+            LEAVE deleting;
+        END IF;
+        SET v_found = TRUE;
+        -- Archived bookings first, up to p_batch_size of them per transaction across the month tables
+        SET v_archived = 0;
+        WHILE v_table IS NOT NULL AND v_archived < p_batch_size DO
+            SET @delete_archived = CONCAT('DELETE FROM ', v_table, ' WHERE VenueID = ? LIMIT ?');
+            SET @venue_id = v_id, @batch = p_batch_size - v_archived;
+            PREPARE delete_archived FROM @delete_archived;
+            EXECUTE delete_archived USING @venue_id, @batch;
+            SET v_batch = ROW_COUNT();
+            DEALLOCATE PREPARE delete_archived;
+            SET v_archived = v_archived + v_batch;
+            IF v_batch < @batch THEN
+                SELECT MIN(TABLE_NAME) INTO v_table FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE '{ARCHIVE_PATTERN}' AND TABLE_NAME > v_table;
+            END IF;
+        END WHILE;
+        SET v_deleted = v_deleted + v_archived;
+        IF v_table IS NOT NULL THEN
+            COMMIT;
+            ITERATE deleting;
+        END IF;
+        DELETE FROM DeleteVenueBatch;
+        INSERT INTO DeleteVenueBatch SELECT BookingID FROM VenueUsed WHERE VenueID = v_id LIMIT p_batch_size;
+        SET v_batch = ROW_COUNT();
+        DELETE vu FROM VenueUsed vu JOIN DeleteVenueBatch d ON d.BookingID = vu.BookingID WHERE vu.VenueID = v_id;
+        -- Only bookings no other venue still uses are removed
+        DELETE b FROM Bookings b JOIN DeleteVenueBatch d ON d.BookingID = b.ID
+        LEFT JOIN VenueUsed vu ON vu.BookingID = b.ID WHERE vu.BookingID IS NULL;
+        SET v_deleted = v_deleted + ROW_COUNT();
+        IF v_batch < p_batch_size THEN
+            -- The archiver may have moved some of the venue's bookings after their table was done
+            SELECT MIN(TABLE_NAME) INTO v_table FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE '{ARCHIVE_PATTERN}';
+            WHILE v_table IS NOT NULL DO
+                SET @delete_archived = CONCAT('DELETE FROM ', v_table, ' WHERE VenueID = ?');
+                SET @venue_id = v_id;
+                PREPARE delete_archived FROM @delete_archived;
+                EXECUTE delete_archived USING @venue_id;
+                SET v_deleted = v_deleted + ROW_COUNT();
+                DEALLOCATE PREPARE delete_archived;
+                SELECT MIN(TABLE_NAME) INTO v_table FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE '{ARCHIVE_PATTERN}' AND TABLE_NAME > v_table;
+            END WHILE;
+            DELETE FROM VenueDailyStats WHERE VenueID = v_id;
+            DELETE FROM Venues WHERE ID = v_id;
+            COMMIT;
+            LEAVE deleting;
+        END IF;
+        COMMIT;
+    END LOOP;
+    DROP TEMPORARY TABLE IF EXISTS DeleteVenueBatch;
+    SELECT IF(v_found, '{DELETED}', '{NO_VENUE}') AS Status, v_deleted AS Bookings;
+END
+"""
+
+PROCEDURES = {'sp_next_id': NEXT_ID, 'sp_book_venue': BOOK_VENUE, 'sp_upsert_venue': UPSERT_VENUE, 'sp_update_venue': UPDATE_VENUE,
+              'sp_delete_venue': DELETE_VENUE}
+
+
+def install_procedures(cursor):
+    """Create (or replace) the stored procedures"""
+    for name, definition in PROCEDURES.items():
+        cursor.execute(f"DROP PROCEDURE IF EXISTS {name}")
+        cursor.execute(definition)
+
+
+# Shards found without the procedures -> when; they are tried again after RECHECK_SECONDS
+_missing = {}
+
+
+def call_procedure(connection, name, *args):
+    """
+    Runs CALL name(args) in one round trip and returns its status row, or None if the shard does
+    not have the procedure yet, in which case the caller runs the equivalent statements itself.
+    """
+    shard = getattr(connection, 'shard_name', None)
+    if time.monotonic() - _missing.get(shard, -RECHECK_SECONDS) < RECHECK_SECONDS:
+        return None
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(f"CALL {name}({', '.join(['%s'] * len(args))})", args)
+        except pymysql.err.MySQLError as e:
+            if e.args[0] != ER_SP_DOES_NOT_EXIST:
+                raise
+            _missing[shard] = time.monotonic()
+            return None
+        row = cursor.fetchone()
+        # CALL answers with the status row and a final OK packet, both already on their way
+        while cursor.nextset():
+            pass
+    return row
+
+
+def _venue(row):
+    if row is None or row['Name'] is None:
+        return None
+    return {'ID': row['ID'], 'Name': row['Name'], 'City': row['City'], 'Capacity': row['Capacity'],
+            'Price_per_hour': row['Price_per_hour']}
+
+
+def upsert_venue(connection, venue_name, city, capacity, price_per_hour, overwrite=False):
+    """
+    Adds a venue, or with overwrite replaces an existing venue's details (repricing its rollups).
+    Returns (ADDED, venue), (UPDATED, venue) or (EXISTS, venue).
+    """
+    # The procedure draws the ID in its transaction, so the counter is kept up beforehand
+    keep_up(connection)
+    row = call_procedure(connection, 'sp_upsert_venue', venue_name, city, capacity, price_per_hour, overwrite)
+    if row is not None:
+        return row['Status'], _venue(row)
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT ID FROM Venues WHERE Name = %s FOR UPDATE", (venue_name,))
+        existing = cursor.fetchone()
+        if existing is None:
+            cursor.execute("INSERT INTO Venues (ID, Name, City, Capacity, Price_per_hour) VALUES (%s, %s, %s, %s, %s)",
+                           (next_ids(cursor)[0], venue_name, city, capacity, price_per_hour))
+            status = ADDED
+        elif overwrite:
+            cursor.execute("UPDATE Venues SET City = %s, Capacity = %s, Price_per_hour = %s WHERE ID = %s",
+                           (city, capacity, price_per_hour, existing['ID']))
+            reprice_venues(cursor, [existing['ID']], 'ID')
+            status = UPDATED
+        else:
+            status = EXISTS
+        cursor.execute("SELECT ID, Name, City, Capacity, Price_per_hour FROM Venues WHERE Name = %s", (venue_name,))
+        venue = cursor.fetchone()
+    connection.commit()
+    return status, _venue(venue)
+
+
+def update_venue(connection, venue_name, city=None, capacity=None, price_per_hour=None, venue_id=None):
+    """
+    Changes the given details of a venue (None leaves one as it is), found by venue_id when given and
+    else by name. Returns (UPDATED, venue) or (NO_VENUE, None).
+    """
+    row = call_procedure(connection, 'sp_update_venue', venue_id, venue_name, city, capacity, price_per_hour)
+    if row is not None:
+        return row['Status'], _venue(row)
+
+    key, value = ('ID', venue_id) if venue_id is not None else ('Name', venue_name)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE Venues SET City = COALESCE(%s, City), Capacity = COALESCE(%s, Capacity),
+                              Price_per_hour = COALESCE(%s, Price_per_hour)
+            WHERE {key} = %s
+            """, (city, capacity, price_per_hour, value))
+        if price_per_hour is not None:
+            reprice_venues(cursor, [value], key)
+        cursor.execute(f"SELECT ID, Name, City, Capacity, Price_per_hour FROM Venues WHERE {key} = %s", (value,))
+        venue = cursor.fetchone()
+    connection.commit()
+    return (UPDATED, _venue(venue)) if venue else (NO_VENUE, None)
+
+
+def delete_venue(connection, venue_name, batch_size=1000, venue_id=None):
+    """
+    Deletes a venue with its bookings and rollups, found by venue_id when given and else by name.
+    Returns (DELETED, bookings deleted) or (NO_VENUE, None).
+    """
+    row = call_procedure(connection, 'sp_delete_venue', venue_id, venue_name, batch_size)
+    if row is not None:
+        return row['Status'], row['Bookings'] if row['Status'] == DELETED else None
+
+    deleted = delete_venue_in_batches(connection, venue_name, batch_size, venue_id=venue_id)
+    return (NO_VENUE, None) if deleted is None else (DELETED, deleted)
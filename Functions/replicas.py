@@ -0,0 +1,261 @@
+# IMPORT LIBRARIES
+import sys
+import time
+import atexit
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pymysql
+from shard_pool import get_pool
+
+# Hedged attempts run here; an attempt that loses keeps running and gives its connection back when done
+_hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='hedge')
+atexit.register(_hedge_executor.shutdown, wait=False)
+
+ROUND_ROBIN = 'round_robin'
+LEAST_LATENCY = 'least_latency'
+
+
+class Replica:
+    def __init__(self, name, params):
+        self.name = name  # pool name, e.g. EventManager1/replica1
+        self.params = params
+        self.lag = None  # seconds behind the primary at the last check
+        self.latency = None  # moving average of the lag check's round trip, in seconds
+        self.checked_at = None
+        self.down_until = 0.0  # skipped until then after failing or falling behind
+        self.error = None
+        self.reads = 0
+
+    def snapshot(self):
+        return {'lag_seconds': self.lag, 'latency_ms': round(self.latency * 1000, 2) if self.latency is not None else None,
+                'available': time.monotonic() >= self.down_until, 'reads': self.reads, 'error': self.error}
+
+
+def _replica_lag(connection):
+    """Seconds the server is behind its source, 0 if it is not a replica, None if replication is stopped"""
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except pymysql.err.ProgrammingError:
+            cursor.execute("SHOW SLAVE STATUS")  # MySQL before 8.0.22
+        status = cursor.fetchone()
+    if status is None:
+        # A server that replicates from nothing (such as a plain second instance used for testing) counts as caught up
+        return 0
+    lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    return None if lag is None else int(lag)
+
+
+class ReplicaRouter:
+    """
+    Sends each shard's reads to one of its replicas and leaves everything else on the primary.
+
+    shard_params maps shard names to their connection params; a shard's optional 'replicas' list
+    holds the params of its replicas, each inheriting the keys it leaves out from the primary.
+    Replicas are picked round-robin or by the lowest latency and are checked at most every
+    check_interval seconds: one more than max_lag seconds behind, or failing, is skipped for a
+    while. A session that has just written reads from the primaries for sticky_seconds, so it
+    sees its own booking. Without an available replica, reads go to the primary.
+    hedged_read also sends a read to a second target when the first is slower than the shard's
+    usual p95 (hedge_after seconds until enough reads have been timed).
+    """
+    def __init__(self, shard_params, policy=ROUND_ROBIN, max_lag=5.0, check_interval=2.0, sticky_seconds=None,
+                 retry_after=30.0, hedge_after=0.1):
+        if policy not in (ROUND_ROBIN, LEAST_LATENCY):
+            raise ValueError(f"unknown replica policy {policy}")
+        self.policy = policy
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        # Long enough for a replica within max_lag to have applied the write, plus the time until its next check
+        self.sticky_seconds = sticky_seconds if sticky_seconds is not None else max_lag + check_interval
+        self.retry_after = retry_after
+        self.hedge_after = hedge_after
+        self.primaries = {}
+        self.replicas = {}
+        for shard, params in shard_params.items():
+            params = dict(params)
+            replica_params = [dict(params, **dict(replica)) for replica in params.pop('replicas', None) or []]
+            for replica in replica_params:
+                replica.pop('replicas', None)
+            self.primaries[shard] = params
+            self.replicas[shard] = [Replica(f"{shard}/replica{number}", replica)
+                                    for number, replica in enumerate(replica_params, 1)]
+        self._lock = threading.Lock()
+        self._next = {shard: 0 for shard in self.primaries}
+        self._writes = {}  # session -> monotonic time of its last write
+        self._latencies = {shard: deque(maxlen=200) for shard in self.primaries}  # recent hedged_read times
+        self.hedges = {shard: {'reads': 0, 'hedged': 0, 'hedge_won': 0} for shard in self.primaries}
+
+    def primary(self, shard):
+        return get_pool(shard, self.primaries[shard]).connection()
+
+    def note_write(self, session):
+        """Keep this session's reads on the primaries for sticky_seconds"""
+        now = time.monotonic()
+        with self._lock:
+            self._writes[session] = now
+            if len(self._writes) > 10000:
+                self._writes = {key: at for key, at in self._writes.items() if now - at < self.sticky_seconds}
+
+    def _sticky(self, session):
+        if session is None:
+            return False
+        with self._lock:
+            wrote_at = self._writes.get(session)
+        return wrote_at is not None and time.monotonic() - wrote_at < self.sticky_seconds
+
+    def _candidates(self, shard):
+        now = time.monotonic()
+        replicas = [replica for replica in self.replicas[shard] if now >= replica.down_until]
+        if self.policy == LEAST_LATENCY:
+            # Replicas not measured yet go first so every replica gets a latency
+            return sorted(replicas, key=lambda replica: -1.0 if replica.latency is None else replica.latency)
+        with self._lock:
+            start = self._next[shard]
+            self._next[shard] = start + 1
+        return [replicas[(start + offset) % len(replicas)] for offset in range(len(replicas))]
+
+    def _mark_down(self, replica, error, seconds):
+        replica.down_until = time.monotonic() + seconds
+        replica.error = error
+
+    # Borrow a connection from the replica if it is reachable and close enough to the primary
+    def _borrow(self, replica):
+        context = get_pool(replica.name, replica.params).connection()
+        try:
+            connection = context.__enter__()
+        except Exception as e:
+            self._mark_down(replica, str(e), self.retry_after)
+            return None
+        try:
+            if replica.checked_at is None or time.monotonic() - replica.checked_at >= self.check_interval:
+                started = time.monotonic()
+                replica.lag = _replica_lag(connection)
+                elapsed = time.monotonic() - started
+                replica.latency = elapsed if replica.latency is None else 0.7 * replica.latency + 0.3 * elapsed
+                replica.checked_at = time.monotonic()
+            if replica.lag is None or replica.lag > self.max_lag:
+                # A lagging replica is checked again soon, it usually catches up quickly
+                self._mark_down(replica, "replication stopped" if replica.lag is None else f"{replica.lag}s behind",
+                                self.check_interval)
+                replica.checked_at = None
+                context.__exit__(None, None, None)
+                return None
+        except Exception as e:
+            context.__exit__(*sys.exc_info())
+            self._mark_down(replica, str(e), self.retry_after)
+            return None
+        replica.error = None
+        replica.reads += 1
+        return context, connection
+
+    @contextmanager
+    def read(self, shard, session=None):
+        borrowed = None
+        if not self._sticky(session):
+            for replica in self._candidates(shard):
+                borrowed = self._borrow(replica)
+                if borrowed is not None:
+                    break
+        if borrowed is None:
+            with self.primary(shard) as connection:
+                yield connection
+            return
+        context, connection = borrowed
+        try:
+            yield connection
+        except BaseException:
+            if not context.__exit__(*sys.exc_info()):
+                raise
+        else:
+            context.__exit__(None, None, None)
+
+    # Run work(connection) on one target: a replica, if it can be used now, or the primary (None)
+    def _attempt(self, shard, replica, work):
+        if replica is None:
+            with self.primary(shard) as connection:
+                return work(connection)
+        borrowed = self._borrow(replica)
+        if borrowed is None:
+            raise pymysql.err.OperationalError(f"{replica.name} is not available: {replica.error}")
+        context, connection = borrowed
+        try:
+            result = work(connection)
+        except BaseException:
+            if not context.__exit__(*sys.exc_info()):
+                raise
+        else:
+            context.__exit__(None, None, None)
+            return result
+
+    def _hedge_delay(self, shard):
+        with self._lock:
+            latencies = sorted(self._latencies[shard])
+        if len(latencies) < 20:
+            return self.hedge_after
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def hedged_read(self, shard, work, session=None):
+        """
+        Runs work(connection) on a read target of the shard and returns its result. If it has not
+        answered within the shard's p95 read time, the same work also starts on the next target
+        (another replica, then the primary) and the first answer wins; a target that fails hands
+        over to the next at once. With a single target this is a plain read.
+        """
+        targets = ([] if self._sticky(session) else self._candidates(shard)) + [None]
+        delay = self._hedge_delay(shard)
+        started = time.monotonic()
+        next_hedge = started
+        pending = {}  # future -> whether it was started as a hedge next to a running attempt
+        errors = []
+        while True:
+            # The next target starts when nothing is running any more or the running attempts are too slow
+            if targets and (not pending or time.monotonic() >= next_hedge):
+                future = _hedge_executor.submit(contextvars.copy_context().run, self._attempt, shard, targets.pop(0), work)
+                pending[future] = bool(pending)
+                next_hedge = time.monotonic() + delay
+                if pending[future]:
+                    with self._lock:
+                        self.hedges[shard]['hedged'] += 1
+            if not pending:
+                raise errors[-1]
+            done, _ = wait(pending, timeout=max(0.0, next_hedge - time.monotonic()) if targets else None,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                hedge = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                with self._lock:
+                    self._latencies[shard].append(time.monotonic() - started)
+                    self.hedges[shard]['reads'] += 1
+                    self.hedges[shard]['hedge_won'] += hedge
+                return result
+
+    def snapshot(self):
+        return {replica.name: replica.snapshot() for replicas in self.replicas.values() for replica in replicas}
+
+    def hedge_snapshot(self):
+        with self._lock:
+            hedges = {shard: dict(stats) for shard, stats in self.hedges.items()}
+        return {shard: dict(stats, hedge_after_ms=round(self._hedge_delay(shard) * 1000, 1))
+                for shard, stats in hedges.items()}
+
+
+# Process-wide registry, like the pools, so replica health survives Streamlit reruns
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_replica_router(name, shard_params, **options):
+    with _routers_lock:
+        router = _routers.get(name)
+        if router is None:
+            router = ReplicaRouter(shard_params, **options)
+            _routers[name] = router
+        return router
@@ -0,0 +1,174 @@
+# IMPORT LIBRARIES
+import sys
+import time
+import argparse
+from shard_config import router, connect_to_shard
+from rollups import add_bookings, remove_venues
+from retention import ARCHIVE_TABLE, archive_tables
+from global_ids import next_ids
+
+
+# Walk one shard in ID order and yield, per batch, the venues whose ring owner is another shard
+def misplaced_venues(source, batch_size):
+    last_id = 0
+    while True:
+        with connect_to_shard(source) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT ID, Name FROM Venues WHERE ID > %s ORDER BY ID LIMIT %s", (last_id, batch_size))
+                rows = cursor.fetchall()
+        if not rows:
+            return
+        last_id = rows[-1]['ID']
+        moves = {}
+        for row in rows:
+            owner = router.shard_for(row['Name'])
+            if owner != source:
+                moves.setdefault(owner, []).append(row['ID'])
+        yield moves
+
+
+def _archived_bookings(cursor, venue_ids):
+    # The venues' rows in each monthly archive table that has any (see retention.py)
+    archived = {}
+    for table in archive_tables(cursor):
+        cursor.execute(f"""
+            SELECT BookingID, VenueID, Client_name, Date, Start_time, End_time FROM {table}
+            WHERE VenueID IN ({', '.join(['%s'] * len(venue_ids))}) FOR UPDATE
+            """, venue_ids)
+        rows = cursor.fetchall()
+        if rows:
+            archived[table] = rows
+    return archived
+
+
+def move_venues(source, target, venue_ids):
+    """
+    Copies a batch of venues with their Bookings and VenueUsed rows and their archived
+    bookings from source to target, then deletes them from source. The venue rows stay
+    locked on source until the delete commits, so bookings made against the old copy wait
+    instead of being lost. Re-running after a failure between the two commits does not
+    duplicate venues or bookings.
+    """
+    placeholders = ', '.join(['%s'] * len(venue_ids))
+    moved_bookings = 0
+    with connect_to_shard(source) as source_connection, connect_to_shard(target) as target_connection:
+        with source_connection.cursor() as source_cursor, target_connection.cursor() as target_cursor:
+            source_cursor.execute(
+                f"SELECT ID, Name, City, Capacity, Price_per_hour FROM Venues WHERE ID IN ({placeholders}) FOR UPDATE",
+                venue_ids)
+            venues = source_cursor.fetchall()
+            source_cursor.execute(f"""
+                SELECT vu.VenueID, b.ID, b.Client_name, b.Date, b.Start_time, b.End_time
+                FROM VenueUsed vu JOIN Bookings b ON b.ID = vu.BookingID
+                WHERE vu.VenueID IN ({placeholders}) FOR UPDATE
+                """, venue_ids)
+            bookings = source_cursor.fetchall()
+            archived = _archived_bookings(source_cursor, venue_ids)
+            # Create the archive tables first: DDL commits, and the target has written nothing yet
+            for table in archived:
+                target_cursor.execute(ARCHIVE_TABLE.format(table=table))
+
+            # Copy the venues, reusing a venue of the same name if an earlier run already copied it
+            new_venue_ids = {}
+            already_copied = set()
+            for venue in venues:
+                target_cursor.execute("SELECT ID FROM Venues WHERE Name = %s", (venue['Name'],))
+                existing = target_cursor.fetchone()
+                if existing:
+                    new_venue_ids[venue['ID']] = existing['ID']
+                    target_cursor.execute("""
+                        SELECT b.Client_name, b.Date, b.Start_time, b.End_time
+                        FROM VenueUsed vu JOIN Bookings b ON b.ID = vu.BookingID WHERE vu.VenueID = %s
+                        """, (existing['ID'],))
+                    already_copied.update((existing['ID'], row['Client_name'], row['Date'], row['Start_time'], row['End_time'])
+                                          for row in target_cursor.fetchall())
+                    for table in archived:
+                        target_cursor.execute(f"""
+                            SELECT VenueID, Client_name, Date, Start_time, End_time FROM {table} WHERE VenueID = %s
+                            """, (existing['ID'],))
+                        already_copied.update((table, row['VenueID'], row['Client_name'], row['Date'], row['Start_time'],
+                                               row['End_time']) for row in target_cursor.fetchall())
+                else:
+                    # A moved venue gets a new ID from its new shard, so its ID keeps routing to it
+                    new_venue_ids[venue['ID']] = next_ids(target_cursor)[0]
+                    target_cursor.execute(
+                        "INSERT INTO Venues (ID, Name, City, Capacity, Price_per_hour) VALUES (%s, %s, %s, %s, %s)",
+                        (new_venue_ids[venue['ID']], venue['Name'], venue['City'], venue['Capacity'],
+                         venue['Price_per_hour']))
+
+            # Copy the bookings with new IDs and link them to the venue's new ID
+            copied = []
+            for booking in bookings:
+                venue_id = new_venue_ids[booking['VenueID']]
+                key = (venue_id, booking['Client_name'], booking['Date'], booking['Start_time'], booking['End_time'])
+                if key in already_copied:
+                    continue
+                booking_id = next_ids(target_cursor)[0]
+                target_cursor.execute(
+                    "INSERT INTO Bookings (ID, VenueID, Client_name, Date, Start_time, End_time) VALUES (%s, %s, %s, %s, %s, %s)",
+                    (booking_id,) + key)
+                target_cursor.execute("INSERT INTO VenueUsed (VenueID, BookingID) VALUES (%s, %s)",
+                                      (venue_id, booking_id))
+                copied.append((venue_id, booking['Date'], booking['Start_time'], booking['End_time']))
+                moved_bookings += 1
+
+            # Archived bookings go to the same month's archive table, and their days' rollups with them
+            for table, rows in archived.items():
+                rows = [(new_venue_ids[row['VenueID']], row['Client_name'], row['Date'], row['Start_time'], row['End_time'])
+                        for row in rows]
+                rows = [row for row in rows if (table,) + row not in already_copied]
+                if not rows:
+                    continue
+                target_cursor.execute(
+                    f"INSERT INTO {table} (BookingID, VenueID, Client_name, Date, Start_time, End_time) VALUES "
+                    + ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(rows)),
+                    [value for booking_id, row in zip(next_ids(target_cursor, len(rows)), rows)
+                     for value in (booking_id,) + row])
+                copied.extend((venue_id, day, start, end) for venue_id, _, day, start, end in rows)
+                moved_bookings += len(rows)
+            add_bookings(target_cursor, copied)
+            target_connection.commit()
+
+            # Remove the originals now that the target copy is committed
+            remove_venues(source_cursor, venue_ids)
+            source_cursor.execute(f"DELETE FROM VenueUsed WHERE VenueID IN ({placeholders})", venue_ids)
+            for table in archived:
+                source_cursor.execute(f"DELETE FROM {table} WHERE VenueID IN ({placeholders})", venue_ids)
+            booking_ids = [booking['ID'] for booking in bookings]
+            if booking_ids:
+                source_cursor.execute(
+                    f"DELETE FROM Bookings WHERE ID IN ({', '.join(['%s'] * len(booking_ids))})", booking_ids)
+            source_cursor.execute(f"DELETE FROM Venues WHERE ID IN ({placeholders})", venue_ids)
+            source_connection.commit()
+    return len(venues), moved_bookings
+
+
+def reshard(batch_size=500, pause=0.05, dry_run=False):
+    totals = {}
+    for source in router.shards:
+        for moves in misplaced_venues(source, batch_size):
+            for target, venue_ids in moves.items():
+                if dry_run:
+                    venues, bookings = len(venue_ids), 0
+                else:
+                    venues, bookings = move_venues(source, target, venue_ids)
+                moved = totals.setdefault((source, target), [0, 0])
+                moved[0] += venues
+                moved[1] += bookings
+            # Give live traffic room between batches
+            time.sleep(pause)
+    for (source, target), (venues, bookings) in totals.items():
+        action = "would move" if dry_run else "moved"
+        print(f"{source} -> {target}: {action} {venues} venues and {bookings} bookings.")
+    if not totals:
+        print("Every venue already lives on its owner shard.")
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move venues whose owner changed in the shard map to their new shard.")
+    parser.add_argument('--batch-size', type=int, default=500, help="venues scanned per batch")
+    parser.add_argument('--pause', type=float, default=0.05, help="seconds to sleep between batches")
+    parser.add_argument('--dry-run', action='store_true', help="only count the venues that would move")
+    args = parser.parse_args(sys.argv[1:])
+    reshard(args.batch_size, args.pause, args.dry_run)
@@ -0,0 +1,156 @@
+# IMPORT LIBRARIES
+import time
+import socket
+import threading
+import contextvars
+from contextlib import contextmanager
+import pymysql
+
+# Deadlines: a call says how long it may take with `with deadline(seconds)`, and the deadline follows it
+# onto worker threads with the rest of its context. The pools turn what is left of it into the checkout
+# wait, pymysql's connect timeout and the socket read / write timeout of every statement, so a stalled
+# shard fails the call on time instead of hanging it. A nested deadline never extends an outer one.
+#
+# Circuit breakers, one per pool: after failure_threshold failures to connect in a row the pool's server
+# is not contacted for reset_after seconds (CircuitOpen is raised at once), then a single probe is let
+# through. Its success closes the breaker and its failure opens it again. Only connecting counts: errors
+# of a statement, including a read that outlives the caller's deadline and loses its connection, say
+# nothing of whether the server can be reached, so slow reads never open the breaker writes go through.
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Can't connect, server gone away, lost connection (also raised on a socket timeout), connection refused
+CONNECTION_ERRORS = {2003, 2006, 2013, 2055}
+
+
+class DeadlineExceeded(pymysql.err.OperationalError):
+    pass
+
+
+class CircuitOpen(pymysql.err.OperationalError):
+    pass
+
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    at = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(at if outer is None else min(at, outer))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left before the current deadline, None without one"""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def check_deadline():
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("The call ran out of time before reaching the database")
+    return left
+
+
+def is_connection_failure(error):
+    if isinstance(error, CircuitOpen):
+        return False
+    if isinstance(error, (socket.timeout, ConnectionError, pymysql.err.InterfaceError)):
+        return True
+    return isinstance(error, pymysql.err.OperationalError) and bool(error.args) and error.args[0] in CONNECTION_ERRORS
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_after=10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after  # seconds an open breaker waits before letting a probe through
+        self.state = CLOSED
+        self.failures = 0  # connection failures in a row
+        self.opened_at = None
+        self.probe_started = None
+        self.error = None
+        self._lock = threading.Lock()
+        self.stats = {'rejected': 0, 'opened': 0, 'probes': 0}
+
+    def allow(self):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now - self.opened_at >= self.reset_after:
+                self.state = HALF_OPEN
+                self.probe_started = None
+            # One probe at a time; a probe that never reported back is replaced after reset_after
+            if self.state == HALF_OPEN and (self.probe_started is None or now - self.probe_started >= self.reset_after):
+                self.probe_started = now
+                self.stats['probes'] += 1
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpen(f"{self.name} is unavailable after repeated failures ({self.error}); not retried for now")
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.probe_started = None
+
+    # A probe that never reached the server (a full pool) says nothing: the next caller may probe instead
+    def release_probe(self):
+        with self._lock:
+            self.probe_started = None
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            self.error = str(error) if error is not None else self.error
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.stats['opened'] += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+
+    def record(self, error):
+        if is_connection_failure(error):
+            self.record_failure(error)
+        else:
+            self.record_success()
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = max(0.0, self.reset_after - (time.monotonic() - self.opened_at)) if self.state == OPEN else 0.0
+            return dict(self.stats, state=self.state, failures=self.failures, retry_in=round(retry_in, 1),
+                        error=self.error if self.state != CLOSED else None)
+
+
+# Process-wide registry like the pools, so a breaker's state survives Streamlit reruns
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, **options):
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, **options)
+            _breakers[name] = breaker
+        return breaker
+
+
+def breaker_stats():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
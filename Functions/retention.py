@@ -0,0 +1,280 @@
+# IMPORT LIBRARIES
+import sys
+import time
+import argparse
+from datetime import date, timedelta
+from availability import to_date
+from rollups import remove_venues
+from partitions import partitions, drop_partition, ensure_partitions
+from global_ids import prune_id_sequence
+
+# Bookings older than the retention period move, with their venue, into one compressed archive table
+# per month on the same shard (BookingsArchive_YYYYMM), so Bookings and every overlap scan only hold
+# recent bookings. Archived days keep their VenueDailyStats rollups; analytics reads the archive tables
+# alongside Bookings, and rollups.py leaves archived days alone. ArchiveRuns records each run and its cutoff.
+# Months wholly before the cutoff are copied partition by partition and their partition then dropped
+# (see partitions.py); only the cutoff's own month is deleted from Bookings row by row.
+
+ARCHIVE_PREFIX = 'BookingsArchive_'
+ARCHIVE_PATTERN = ARCHIVE_PREFIX.replace('_', '\\_') + '%'  # every archive table's name, for LIKE
+
+ARCHIVE_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    BookingID BIGINT NOT NULL,
+    VenueID BIGINT NOT NULL,
+    Client_name VARCHAR(255),
+    Date DATE NOT NULL,
+    Start_time TIME,
+    End_time TIME,
+    PRIMARY KEY (BookingID, VenueID),
+    KEY idx_archive_date (Date),
+    KEY idx_archive_venue (VenueID, Date)
+) ROW_FORMAT=COMPRESSED
+"""
+
+
+def archive_table(day):
+    return f"{ARCHIVE_PREFIX}{day:%Y%m}"
+
+
+def archive_tables(cursor, start_date=None, end_date=None):
+    """Names of the shard's archive tables, only those for months between start_date and end_date if given"""
+    cursor.execute("""
+        SELECT TABLE_NAME FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE %s ORDER BY TABLE_NAME
+        """, (ARCHIVE_PATTERN,))
+    tables = [row['TABLE_NAME'] for row in cursor.fetchall()]
+    if start_date is not None:
+        tables = [table for table in tables if table >= archive_table(start_date)]
+    if end_date is not None:
+        tables = [table for table in tables if table <= archive_table(end_date)]
+    return tables
+
+
+def _delete_bookings(cursor, booking_ids):
+    # Only bookings no other venue still uses are removed
+    placeholders = ', '.join(['%s'] * len(booking_ids))
+    cursor.execute(f"""
+        DELETE b FROM Bookings b LEFT JOIN VenueUsed vu ON vu.BookingID = b.ID
+        WHERE b.ID IN ({placeholders}) AND vu.BookingID IS NULL
+        """, list(booking_ids))
+    return cursor.rowcount
+
+
+def delete_venue(connection, venue_name, batch_size=1000, pause=0.0, log=None, venue_id=None):
+    """
+    Deletes a venue (found by venue_id when given, else by name) with its VenueUsed rows, its
+    bookings, its archived bookings and its rollups. The archived and then the live bookings go in
+    transactions of batch_size, each holding the venue row lock only for its own batch, so
+    bookings of other venues never wait long. The last transaction deletes whatever was booked
+    or archived meanwhile together with the venue itself. Returns the number of bookings deleted,
+    archived ones included, or None if there is no such venue.
+    """
+    deleted = 0
+    key, value = ('ID', venue_id) if venue_id is not None else ('Name', venue_name)
+    with connection.cursor() as cursor:
+        tables = archive_tables(cursor)
+        while True:
+            cursor.execute(f"SELECT ID FROM Venues WHERE {key} = %s FOR UPDATE", (value,))
+            venue = cursor.fetchone()
+            if venue is None:
+                connection.rollback()
+                return None
+            # Archived bookings first, up to batch_size of them per transaction across the month tables
+            archived = 0
+            while tables and archived < batch_size:
+                cursor.execute(f"DELETE FROM {tables[0]} WHERE VenueID = %s LIMIT %s", (venue['ID'], batch_size - archived))
+                if cursor.rowcount < batch_size - archived:
+                    tables.pop(0)
+                archived += cursor.rowcount
+            deleted += archived
+            if tables:
+                connection.commit()
+                if log:
+                    log(f"deleted {deleted} bookings of '{venue_name}'")
+                time.sleep(pause)
+                continue
+
+            cursor.execute("SELECT BookingID FROM VenueUsed WHERE VenueID = %s LIMIT %s", (venue['ID'], batch_size))
+            booking_ids = [row['BookingID'] for row in cursor.fetchall()]
+            if len(booking_ids) < batch_size:
+                break
+            cursor.execute(f"DELETE FROM VenueUsed WHERE VenueID = %s AND BookingID IN ({', '.join(['%s'] * len(booking_ids))})",
+                           [venue['ID']] + booking_ids)
+            deleted += _delete_bookings(cursor, booking_ids)
+            connection.commit()
+            if log:
+                log(f"deleted {deleted} bookings of '{venue_name}'")
+            time.sleep(pause)
+
+        # Fewer than a batch left: finish in the transaction that still holds the venue lock
+        cursor.execute("DELETE FROM VenueUsed WHERE VenueID = %s", (venue['ID'],))
+        if booking_ids:
+            deleted += _delete_bookings(cursor, booking_ids)
+        # The archiver may have moved some of the venue's bookings after their table was done
+        for table in archive_tables(cursor):
+            cursor.execute(f"DELETE FROM {table} WHERE VenueID = %s", (venue['ID'],))
+            deleted += cursor.rowcount
+        remove_venues(cursor, [venue['ID']])
+        cursor.execute("DELETE FROM Venues WHERE ID = %s", (venue['ID'],))
+        connection.commit()
+    return deleted
+
+
+def purge_orphans(connection, batch_size=1000, log=None):
+    """Deletes bookings that no venue uses any more (left behind by deletes before delete_venue cascaded)"""
+    purged = 0
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute("""
+                SELECT b.ID FROM Bookings b LEFT JOIN VenueUsed vu ON vu.BookingID = b.ID
+                WHERE vu.BookingID IS NULL LIMIT %s
+                """, (batch_size,))
+            booking_ids = [row['ID'] for row in cursor.fetchall()]
+            if not booking_ids:
+                return purged
+            purged += _delete_bookings(cursor, booking_ids)
+            connection.commit()
+            if log:
+                log(f"purged {purged} orphaned bookings")
+
+
+def _archive_rows(cursor, rows, run_id, delete_bookings=True):
+    by_table = {}
+    for row in rows:
+        by_table.setdefault(archive_table(to_date(row['Date'])), []).append(
+            (row['ID'], row['VenueID'], row['Client_name'], row['Date'], row['Start_time'], row['End_time']))
+    for table, values in by_table.items():
+        cursor.executemany(f"INSERT IGNORE INTO {table} (BookingID, VenueID, Client_name, Date, Start_time, End_time) "
+                           "VALUES (%s, %s, %s, %s, %s, %s)", values)
+    pairs = [(row['VenueID'], row['ID']) for row in rows]
+    cursor.execute(f"DELETE FROM VenueUsed WHERE (VenueID, BookingID) IN ({', '.join(['(%s, %s)'] * len(pairs))})",
+                   [value for pair in pairs for value in pair])
+    if delete_bookings:
+        _delete_bookings(cursor, sorted({row['ID'] for row in rows}))
+    cursor.execute("UPDATE ArchiveRuns SET Bookings = Bookings + %s WHERE ID = %s", (len(rows), run_id))
+
+
+def archive_partition(connection, partition, run_id, batch_size=1000, pause=0.0, log=None):
+    """
+    Archives one monthly Bookings partition in batches, unlinking each batch from VenueUsed but
+    leaving the Bookings rows, then drops the partition with all of them at once. Unlinked
+    bookings count for nothing but overlap checks of their past dates. Returns the number archived.
+    """
+    archived = 0
+    last_id = -1
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute(f"""
+                SELECT b.ID, vu.VenueID, b.Client_name, b.Date, b.Start_time, b.End_time
+                FROM Bookings PARTITION ({partition}) b JOIN VenueUsed vu ON vu.BookingID = b.ID
+                WHERE b.ID > %s ORDER BY b.ID LIMIT %s FOR UPDATE
+                """, (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            _archive_rows(cursor, rows, run_id, delete_bookings=False)
+            connection.commit()
+            archived += len(rows)
+            last_id = rows[-1]['ID']
+            if log:
+                log(f"archived {archived} bookings of partition {partition}")
+            time.sleep(pause)
+        if drop_partition(cursor, partition) and log:
+            log(f"dropped partition {partition}")
+    return archived
+
+
+def archive_bookings(connection, cutoff, batch_size=1000, pause=0.0, log=None):
+    """
+    Moves every booking dated before cutoff into its month's archive table, batch_size bookings
+    per transaction (copy, then delete from VenueUsed and Bookings; whole months of a partitioned
+    Bookings go with archive_partition). The run is recorded in ArchiveRuns and can be stopped
+    and started again at any point. Returns the number of bookings archived.
+    """
+    archived = 0
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO ArchiveRuns (Archived_before) VALUES (%s)", (cutoff,))
+        run_id = cursor.lastrowid
+        connection.commit()
+
+        # CREATE TABLE commits implicitly, so every month's table is created before the batches start
+        cursor.execute("SELECT MIN(Date) AS First FROM Bookings WHERE Date < %s", (cutoff,))
+        first = cursor.fetchone()['First']
+        month = to_date(first).replace(day=1) if first else cutoff
+        while month < cutoff:
+            cursor.execute(ARCHIVE_TABLE.format(table=archive_table(month)))
+            month = (month + timedelta(days=32)).replace(day=1)
+
+        for partition, bound, _ in partitions(cursor):
+            if bound is None or bound > cutoff:
+                break
+            archived += archive_partition(connection, partition, run_id, batch_size, pause, log)
+
+        while True:
+            cursor.execute("""
+                SELECT b.ID, vu.VenueID, b.Client_name, b.Date, b.Start_time, b.End_time
+                FROM Bookings b JOIN VenueUsed vu ON vu.BookingID = b.ID
+                WHERE b.Date < %s ORDER BY b.Date, b.ID LIMIT %s FOR UPDATE
+                """, (cutoff, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            _archive_rows(cursor, rows, run_id)
+            connection.commit()
+            archived += len(rows)
+            if log:
+                log(f"archived {archived} bookings (up to {to_date(rows[-1]['Date'])})")
+            time.sleep(pause)
+
+        cursor.execute("UPDATE ArchiveRuns SET Finished_at = CURRENT_TIMESTAMP WHERE ID = %s", (run_id,))
+        connection.commit()
+    return archived
+
+
+if __name__ == "__main__":
+    from shard_config import router, connect_to_shard
+    from shard_router import locate_venue
+
+    parser = argparse.ArgumentParser(description="Archive old bookings, delete venues with their bookings, or purge orphaned bookings.")
+    subcommands = parser.add_subparsers(dest='action', required=True)
+    archive = subcommands.add_parser('archive', help="move bookings older than --days into monthly archive tables")
+    archive.add_argument('--days', type=int, default=365, help="bookings older than this many days are archived")
+    archive.add_argument('--every', type=float, default=None, help="keep running, archiving again every this many hours")
+    delete = subcommands.add_parser('delete-venue', help="delete one venue with all of its bookings")
+    delete.add_argument('venue_name')
+    subcommands.add_parser('purge-orphans', help="delete bookings no venue uses")
+    for subcommand in subcommands.choices.values():
+        subcommand.add_argument('--batch-size', type=int, default=1000, help="rows per transaction")
+        subcommand.add_argument('--pause', type=float, default=0.0, help="seconds to sleep between batches")
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.action == 'delete-venue':
+        db_name = locate_venue(router, connect_to_shard, args.venue_name)
+        with connect_to_shard(db_name) as connection:
+            deleted = delete_venue(connection, args.venue_name, args.batch_size, args.pause, log=print)
+        print(f"No venue named '{args.venue_name}'." if deleted is None else
+              f"Deleted '{args.venue_name}' and {deleted} bookings from {db_name}.")
+        sys.exit(0 if deleted is not None else 1)
+
+    while True:
+        for shard in router.shards:
+            with connect_to_shard(shard) as connection:
+                if args.action == 'purge-orphans':
+                    count = purge_orphans(connection, args.batch_size, log=lambda message: print(f"{shard}: {message}"))
+                    print(f"{shard}: {count} orphaned bookings purged")
+                else:
+                    # Each run also prepares the coming months' partitions
+                    with connection.cursor() as cursor:
+                        added = ensure_partitions(cursor)
+                    if added:
+                        print(f"{shard}: added partitions {', '.join(added)}")
+                    cutoff = date.today() - timedelta(days=args.days)
+                    count = archive_bookings(connection, cutoff, args.batch_size, args.pause,
+                                             log=lambda message: print(f"{shard}: {message}"))
+                    print(f"{shard}: {count} bookings before {cutoff} archived")
+                    # The archive job also clears the ID counter's drawn rows (see global_ids.py)
+                    print(f"{shard}: {prune_id_sequence(connection)} drawn IDs pruned")
+        if args.action != 'archive' or args.every is None:
+            break
+        time.sleep(args.every * 3600)
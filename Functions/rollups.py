@@ -0,0 +1,239 @@
+# IMPORT LIBRARIES
+import sys
+import argparse
+from datetime import date, timedelta
+from availability import to_minutes, to_date
+from scatter_gather import scatter_gather
+
+# VenueDailyStats holds, per venue and day on each shard, the booked minutes, the number of bookings and
+# the revenue at the venue's current hourly rate. The write paths update it in their own transactions:
+# book_venue and insert_bookings add bookings, delete_venue and reshard remove venues, and price changes
+# reprice the venue's rows. rebuild() recomputes it from Bookings and check() compares the two; days
+# whose bookings retention.py has moved to the archive tables keep their rollups and are skipped.
+
+BOOKED_MINUTES = "(TIME_TO_SEC(b.End_time) - TIME_TO_SEC(b.Start_time)) DIV 60"
+
+# Rollup rows computed from the base tables for a date range
+SOURCE_QUERY = f"""
+SELECT vu.VenueID, b.Date, SUM({BOOKED_MINUTES}) AS Booked_minutes, COUNT(*) AS Bookings,
+       SUM({BOOKED_MINUTES}) * v.Price_per_hour / 60 AS Revenue
+FROM VenueUsed vu
+JOIN Bookings b ON b.ID = vu.BookingID
+JOIN Venues v ON v.ID = vu.VenueID
+WHERE b.Date BETWEEN %s AND %s
+GROUP BY vu.VenueID, b.Date, v.Price_per_hour
+"""
+
+ADD_QUERY = """
+INSERT INTO VenueDailyStats (VenueID, Date, Booked_minutes, Bookings, Revenue) VALUES {values}
+ON DUPLICATE KEY UPDATE Booked_minutes = Booked_minutes + VALUES(Booked_minutes),
+                        Bookings = Bookings + VALUES(Bookings), Revenue = Revenue + VALUES(Revenue)
+"""
+
+FIRST_DATE = date(1000, 1, 1)
+LAST_DATE = date(9999, 12, 31)
+
+
+def add_bookings(cursor, bookings, prices=None):
+    """
+    Adds (venue_id, date, start_time, end_time) bookings to the rollups in the caller's transaction.
+    prices maps venue_id to Price_per_hour; venues missing from it are looked up.
+    """
+    totals = {}
+    for venue_id, day, start_time, end_time in bookings:
+        key = (venue_id, to_date(day))
+        minutes, count = totals.get(key, (0, 0))
+        totals[key] = (minutes + to_minutes(end_time) - to_minutes(start_time), count + 1)
+    if not totals:
+        return
+    prices = dict(prices or {})
+    missing = sorted({venue_id for venue_id, _ in totals if venue_id not in prices})
+    if missing:
+        cursor.execute(f"SELECT ID, Price_per_hour FROM Venues WHERE ID IN ({', '.join(['%s'] * len(missing))})",
+                       missing)
+        prices.update((row['ID'], row['Price_per_hour']) for row in cursor.fetchall())
+    rows = [(venue_id, day, minutes, count, float(prices.get(venue_id) or 0) * minutes / 60)
+            for (venue_id, day), (minutes, count) in totals.items()]
+    cursor.execute(ADD_QUERY.format(values=', '.join(['(%s, %s, %s, %s, %s)'] * len(rows))),
+                   [value for row in rows for value in row])
+
+
+def remove_venues(cursor, venue_ids):
+    if venue_ids:
+        cursor.execute(f"DELETE FROM VenueDailyStats WHERE VenueID IN ({', '.join(['%s'] * len(venue_ids))})",
+                       list(venue_ids))
+
+
+# Revenue follows the venue's current rate, so a price change rewrites that venue's rows
+def reprice_venues(cursor, names, column='Name'):
+    """Recomputes the revenue rollups of the venues whose column ('Name' or 'ID') is in names"""
+    if names:
+        cursor.execute(f"""
+            UPDATE VenueDailyStats s JOIN Venues v ON v.ID = s.VenueID
+            SET s.Revenue = s.Booked_minutes * v.Price_per_hour / 60
+            WHERE v.{column} IN ({', '.join(['%s'] * len(names))})
+            """, list(names))
+
+
+def backfill_rollups(cursor):
+    """Fill VenueDailyStats from the existing bookings"""
+    cursor.execute("DELETE FROM VenueDailyStats")
+    cursor.execute("INSERT INTO VenueDailyStats (VenueID, Date, Booked_minutes, Bookings, Revenue) " + SOURCE_QUERY,
+                   (FIRST_DATE, LAST_DATE))
+
+
+def _months(start_date, end_date):
+    first = start_date
+    while first <= end_date:
+        following = (first.replace(day=1) + timedelta(days=32)).replace(day=1)
+        yield first, min(end_date, following - timedelta(days=1))
+        first = following
+
+
+def _booking_range(cursor):
+    cursor.execute("""
+        SELECT LEAST(COALESCE((SELECT MIN(Date) FROM Bookings), %s), COALESCE((SELECT MIN(Date) FROM VenueDailyStats), %s)) AS First,
+               GREATEST(COALESCE((SELECT MAX(Date) FROM Bookings), %s), COALESCE((SELECT MAX(Date) FROM VenueDailyStats), %s)) AS Last
+        """, (LAST_DATE, LAST_DATE, FIRST_DATE, FIRST_DATE))
+    row = cursor.fetchone()
+    if row['First'] > row['Last']:
+        return None
+    return to_date(row['First']), to_date(row['Last'])
+
+
+# Bookings before this date may already be archived (set by retention.py, including runs still in progress)
+def _archived_before(cursor):
+    cursor.execute("SELECT MAX(Archived_before) AS Archived_before FROM ArchiveRuns")
+    row = cursor.fetchone()
+    return to_date(row['Archived_before']) if row['Archived_before'] else None
+
+
+def _unarchived_range(cursor, start_date, end_date):
+    bounds = _booking_range(cursor)
+    if bounds is None:
+        return None
+    start_date, end_date = start_date or bounds[0], end_date or bounds[1]
+    archived = _archived_before(cursor)
+    if archived is not None:
+        start_date = max(start_date, archived)
+    return (start_date, end_date) if start_date <= end_date else None
+
+
+def rebuild(connection, start_date=None, end_date=None, log=print):
+    """
+    Recomputes the rollups of one shard from Bookings, one month per transaction. Reading the
+    bookings with INSERT ... SELECT locks them, so bookings made in that month meanwhile wait
+    for the month's commit instead of being counted twice or lost.
+    """
+    with connection.cursor() as cursor:
+        bounds = _unarchived_range(cursor, start_date, end_date)
+        if bounds is None:
+            return 0
+        start_date, end_date = bounds
+        rows = 0
+        for first, last in _months(start_date, end_date):
+            cursor.execute("DELETE FROM VenueDailyStats WHERE Date BETWEEN %s AND %s", (first, last))
+            cursor.execute("INSERT INTO VenueDailyStats (VenueID, Date, Booked_minutes, Bookings, Revenue) "
+                           + SOURCE_QUERY, (first, last))
+            rows += cursor.rowcount
+            connection.commit()
+            log(f"rebuilt {first:%Y-%m}: {cursor.rowcount} venue days")
+    return rows
+
+
+def check(connection, start_date=None, end_date=None, tolerance=0.01):
+    """
+    Compares the rollups of one shard with the totals recomputed from Bookings, month by month.
+    Returns (venue_id, date, rollup, actual) for every venue day that differs, where rollup and
+    actual are (booked_minutes, bookings, revenue) or None when the row is missing.
+    """
+    mismatches = []
+    with connection.cursor() as cursor:
+        bounds = _unarchived_range(cursor, start_date, end_date)
+        if bounds is None:
+            return mismatches
+        start_date, end_date = bounds
+        for first, last in _months(start_date, end_date):
+            cursor.execute(SOURCE_QUERY, (first, last))
+            actual = {(row['VenueID'], to_date(row['Date'])): (int(row['Booked_minutes']), row['Bookings'],
+                                                               float(row['Revenue']))
+                      for row in cursor.fetchall()}
+            cursor.execute("""
+                SELECT VenueID, Date, Booked_minutes, Bookings, Revenue FROM VenueDailyStats
+                WHERE Date BETWEEN %s AND %s
+                """, (first, last))
+            rollup = {(row['VenueID'], to_date(row['Date'])): (row['Booked_minutes'], row['Bookings'],
+                                                               float(row['Revenue']))
+                      for row in cursor.fetchall()}
+            for key in sorted(set(actual) | set(rollup)):
+                have, want = rollup.get(key), actual.get(key)
+                if have is None or want is None or have[:2] != want[:2] or abs(have[2] - want[2]) > tolerance:
+                    mismatches.append((key[0], key[1], have, want))
+    return mismatches
+
+
+# Dashboard reads: totals over a date range from the rollups of every shard
+def busiest_venues(connect, db_names, start_date, end_date, limit=20, order_by='Booked_minutes', timeout=5.0):
+    """Top venues across all shards by booked minutes (or Revenue / Bookings) in the date range"""
+    if order_by not in ('Booked_minutes', 'Revenue', 'Bookings'):
+        raise ValueError(f"cannot order venues by {order_by}")
+    result = scatter_gather(connect, db_names, f"""
+        SELECT v.Name, v.City, SUM(s.Bookings) AS Bookings, SUM(s.Booked_minutes) AS Booked_minutes,
+               SUM(s.Revenue) AS Revenue
+        FROM VenueDailyStats s JOIN Venues v ON v.ID = s.VenueID
+        WHERE s.Date BETWEEN %s AND %s
+        GROUP BY s.VenueID, v.Name, v.City
+        ORDER BY {order_by} DESC LIMIT %s
+        """, (start_date, end_date, limit), timeout=timeout, sort_key=lambda row: -float(row[order_by]),
+        shard_column='Shard')
+    result.rows = result.rows[:limit]
+    return result
+
+
+def totals_by(connect, db_names, start_date, end_date, group, timeout=5.0):
+    """
+    Bookings, booked minutes and revenue per 'City' or per 'Date' across all shards.
+    Each shard groups its own rollups; the shards' groups are then summed.
+    """
+    column = {'City': 'v.City', 'Date': 's.Date'}[group]
+    result = scatter_gather(connect, db_names, f"""
+        SELECT {column} AS {group}, COUNT(DISTINCT s.VenueID) AS Venues, SUM(s.Bookings) AS Bookings,
+               SUM(s.Booked_minutes) AS Booked_minutes, SUM(s.Revenue) AS Revenue
+        FROM VenueDailyStats s JOIN Venues v ON v.ID = s.VenueID
+        WHERE s.Date BETWEEN %s AND %s
+        GROUP BY {column}
+        """, (start_date, end_date), timeout=timeout)
+    totals = {}
+    for row in result.rows:
+        total = totals.setdefault(row[group], {group: row[group], 'Venues': 0, 'Bookings': 0, 'Booked_minutes': 0,
+                                                'Revenue': 0.0})
+        total['Venues'] += row['Venues']
+        total['Bookings'] += int(row['Bookings'])
+        total['Booked_minutes'] += int(row['Booked_minutes'])
+        total['Revenue'] += float(row['Revenue'])
+    result.rows = sorted(totals.values(), key=lambda total: (total[group] is None, total[group]))
+    return result
+
+
+if __name__ == "__main__":
+    from shard_config import router, connect_to_shard
+
+    parser = argparse.ArgumentParser(description="Rebuild or check the VenueDailyStats rollups on every shard.")
+    parser.add_argument('action', choices=['rebuild', 'check'])
+    parser.add_argument('--start', type=date.fromisoformat, default=None, help="first date (default: oldest booking)")
+    parser.add_argument('--end', type=date.fromisoformat, default=None, help="last date (default: newest booking)")
+    args = parser.parse_args(sys.argv[1:])
+
+    failed = False
+    for shard in router.shards:
+        with connect_to_shard(shard) as connection:
+            if args.action == 'rebuild':
+                rows = rebuild(connection, args.start, args.end, log=lambda message: print(f"{shard}: {message}"))
+                print(f"{shard}: {rows} venue days rebuilt")
+            else:
+                mismatches = check(connection, args.start, args.end)
+                for venue_id, day, have, want in mismatches[:50]:
+                    print(f"{shard}: venue {venue_id} on {day}: rollup {have}, bookings say {want}")
+                print(f"{shard}: {len(mismatches)} venue days differ")
+                failed = failed or bool(mismatches)
+    sys.exit(1 if failed else 0)
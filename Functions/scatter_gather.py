@@ -0,0 +1,105 @@
+# IMPORT LIBRARIES
+import time
+import heapq
+import atexit
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+from db_metrics import InstrumentedSSDictCursor
+from resilience import deadline
+
+# One shared worker pool for all fan-out reads, so a query does not pay thread start-up per shard
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='scatter')
+atexit.register(_executor.shutdown, wait=False)
+
+
+class ScatterResult:
+    def __init__(self, rows, errors, timings):
+        self.rows = rows  # merged rows from every shard that answered in time
+        self.errors = errors  # shard name -> error message for shards that failed or timed out
+        self.timings = timings  # shard name -> seconds spent on that shard
+
+    @property
+    def partial(self):
+        return bool(self.errors)
+
+
+# Run the query on one shard and return every row; executed on a worker thread.
+# Unbuffered queries stream rows off the socket one at a time instead of reading the whole result first.
+# The timeout is the worker's deadline too, so a stalled shard's socket gives up and frees its connection.
+def _query_shard(connect, db_name, query, params, shard_column, unbuffered, timeout, hedge):
+    start = time.monotonic()
+
+    def work(connection):
+        with connection.cursor(InstrumentedSSDictCursor if unbuffered else None) as cursor:
+            cursor.execute(query, params)
+            return list(cursor)
+    with deadline(timeout):
+        if hedge is not None:
+            rows = hedge(db_name, work)
+        else:
+            with connect(db_name) as connection:
+                rows = work(connection)
+    if shard_column:
+        for row in rows:
+            row[shard_column] = db_name
+    return rows, time.monotonic() - start
+
+
+def _drop_duplicates(rows, key):
+    previous = object()
+    for row in rows:
+        value = key(row)
+        if value != previous:
+            yield row
+            previous = value
+
+
+def scatter_gather(connect, db_names, query, params=None, timeout=5.0, sort_key=None, distinct=False,
+                   shard_column=None, unbuffered=False, hedge=None):
+    """
+    Runs the same parameterized query on every shard at the same time.
+
+    connect is a callable taking a shard name and returning a connection context manager
+    (for example a pooled connect_to_db). If sort_key is given, each shard must return its
+    rows already ordered by that key and the partial results are k-way merged; with
+    distinct=True rows with equal keys coming from different shards are collapsed.
+    Shards that fail or do not answer within timeout seconds are reported in errors and
+    the remaining shards' rows are still returned. shard_column, if set, is added to every
+    row with the name of the shard it came from. unbuffered=True reads each shard's rows with
+    a streaming (SSCursor) cursor; use it with a LIMIT to keep memory bounded per shard.
+    hedge, if given, runs each shard's query instead of connect: hedge(db_name, work) calls
+    work(connection) and returns its rows (such as ReplicaRouter.hedged_read).
+    """
+    start = time.monotonic()
+    # Each worker runs in a copy of the caller's context, so per-rerun metrics scopes follow the query
+    futures = {_executor.submit(contextvars.copy_context().run, _query_shard, connect, db_name, query, params,
+                                shard_column, unbuffered, timeout, hedge): db_name
+               for db_name in db_names}
+    done, pending = wait(futures, timeout=timeout)
+
+    partials = []
+    errors = {}
+    timings = {}
+    for future in done:
+        db_name = futures[future]
+        try:
+            rows, elapsed = future.result()
+            partials.append(rows)
+            timings[db_name] = elapsed
+        except Exception as e:
+            errors[db_name] = str(e)
+            timings[db_name] = time.monotonic() - start
+    for future in pending:
+        # The worker keeps running and gives its connection back when the query finishes
+        db_name = futures[future]
+        errors[db_name] = f"Timed out after {timeout:.1f}s"
+        timings[db_name] = timeout
+
+    if sort_key is None:
+        rows = [row for partial in partials for row in partial]
+    else:
+        merged = heapq.merge(*partials, key=sort_key)
+        if distinct:
+            merged = _drop_duplicates(merged, sort_key)
+        rows = list(merged)
+    return ScatterResult(rows, errors, timings)
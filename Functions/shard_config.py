@@ -0,0 +1,56 @@
+# Shard configuration for the command line scripts.
+# The Streamlit app reads the same shard names from its secrets ([EventManager1], [EventManager2], [shard_map]).
+
+# IMPORT LIBRARIES
+from shard_router import load_router
+from replicas import get_replica_router
+
+# Replace the placeholders with the actual database connection details.
+# Each shard may list read replicas; a replica's missing keys are taken from its primary,
+# e.g. 'replicas': [{'host': 'replica1.example.com'}, {'host': 'localhost', 'port': 3307}]
+SHARDS = {
+    'EventManager1': {
+        'host': 'localhost',
+        'user': 'dsci551',
+        'password': 'Dsci-551',
+        'database': 'Event_Manager1',
+        'replicas': [],
+    },
+    'EventManager2': {
+        'host': 'localhost',
+        'user': 'dsci551',
+        'password': 'Dsci-551',
+        'database': 'Event_Manager2',
+        'replicas': [],
+    },
+}
+
+# Consistent-hash ring over the shards above. Venues were originally placed with sha256 % 2, so that
+# layout is kept as the previous placement until reshard.py has moved every venue to its ring owner.
+# 'numbers' is embedded in every venue and booking ID; a shard keeps its number for good.
+SHARD_MAP = {
+    'shards': list(SHARDS),
+    'numbers': {'EventManager1': 1, 'EventManager2': 2},
+    'virtual_nodes': 64,
+    'previous': {'scheme': 'modulo', 'shards': ['EventManager1', 'EventManager2']},
+}
+
+router = load_router(SHARD_MAP)
+
+
+replica_router = get_replica_router('scripts', SHARDS)
+
+
+# Borrow a pooled connection to one shard's primary
+def connect_to_shard(shard):
+    return replica_router.primary(shard)
+
+
+# Borrow a pooled connection for reads only: one of the shard's replicas, or its primary without one
+def read_from_shard(shard):
+    return replica_router.read(shard)
+
+
+# Run work(connection) as a read, also on a second replica or the primary if the first is slow
+def hedged_read(shard, work):
+    return replica_router.hedged_read(shard, work)
@@ -0,0 +1,264 @@
+# IMPORT LIBRARIES
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+import pymysql
+from pymysql.constants import SERVER_STATUS
+from db_metrics import metrics, InstrumentedDictCursor
+from resilience import get_breaker, remaining, check_deadline
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# A bounded pool of pymysql connections to a single shard (one secrets / params entry). The caller's
+# deadline (see resilience.py) bounds the checkout and every statement, and the pool's circuit breaker
+# stops it from contacting a server that keeps failing.
+class ShardPool:
+    def __init__(self, name, params, max_size=5, idle_timeout=300, checkout_timeout=10, ping_after=2.0,
+                 connect_timeout=10):
+        self.name = name
+        self.params = dict(params)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout  # seconds a connection may sit idle before it is closed
+        self.checkout_timeout = checkout_timeout  # seconds to wait for a free connection when the pool is full
+        self.ping_after = ping_after  # idle connections older than this are pinged before being handed out
+        self.connect_timeout = connect_timeout  # seconds to open a connection, and to end a transaction on release
+        self.breaker = get_breaker(name)
+        self._idle = deque()  # (connection, returned_at), most recently returned on the right
+        self._size = 0  # open connections, idle or checked out
+        self._cond = threading.Condition()
+        self._side = None  # the side connection, opened on first use
+        self._side_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'waits': 0, 'wait_time': 0.0, 'timeouts': 0,
+                      'evicted': 0, 'discarded': 0, 'checkouts': 0}
+
+    def _connect(self):
+        connection = pymysql.connect(host=self.params['host'],
+                                     port=int(self.params.get('port', 3306)),
+                                     user=self.params['user'],
+                                     password=self.params['password'],
+                                     database=self.params['database'],
+                                     charset=self.params.get('charset', 'utf8mb4'),
+                                     cursorclass=InstrumentedDictCursor,
+                                     connect_timeout=self._limit(self.connect_timeout))
+        # Lets the instrumented cursors record each statement against its shard, and bookkeeping find the side connection
+        connection.shard_name = self.name
+        connection.side_connection = self.side_connection
+        return connection
+
+    # The pool's own limit, cut short by the caller's deadline
+    def _limit(self, seconds):
+        left = remaining()
+        return seconds if left is None else max(0.001, min(seconds, left))
+
+    # Socket timeouts for the statements of one checkout: what is left of the deadline, or none
+    def _set_timeouts(self, connection, seconds):
+        connection._read_timeout = seconds
+        connection._write_timeout = seconds
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    # Pop connections that have been idle for longer than idle_timeout (oldest are on the left)
+    def _evict_idle(self, now):
+        expired = []
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            expired.append(self._idle.popleft()[0])
+        self._size -= len(expired)
+        self.stats['evicted'] += len(expired)
+        return expired
+
+    def acquire(self):
+        start = time.monotonic()
+        checkout_timeout = self._limit(self.checkout_timeout)
+        waited = False
+        while True:
+            with self._cond:
+                expired = self._evict_idle(time.monotonic())
+                if expired:
+                    self._cond.notify(len(expired))
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                    reuse = True
+                elif self._size < self.max_size:
+                    self._size += 1
+                    connection, returned_at = None, None
+                    reuse = False
+                else:
+                    wait_left = checkout_timeout - (time.monotonic() - start)
+                    if wait_left <= 0:
+                        self.stats['timeouts'] += 1
+                        raise PoolTimeout(f"Timed out waiting for a connection to {self.name}")
+                    if not waited:
+                        self.stats['waits'] += 1
+                        waited = True
+                    self._cond.wait(wait_left)
+                    continue
+            for stale in expired:
+                self._close(stale)
+            if reuse:
+                left = remaining()
+                self._set_timeouts(connection, None if left is None else max(0.001, left))
+                # Health check idle connections before handing them out; a dead one is replaced within
+                # the same checkout timeout
+                if time.monotonic() - returned_at > self.ping_after:
+                    try:
+                        connection.ping(reconnect=False)
+                    except Exception:
+                        self._close(connection)
+                        with self._cond:
+                            self.stats['discarded'] += 1
+                            self._size -= 1
+                            self._cond.notify()
+                        continue
+            break
+
+        if waited:
+            with self._cond:
+                self.stats['wait_time'] += time.monotonic() - start
+
+        if reuse:
+            with self._cond:
+                self.stats['hits'] += 1
+                self.stats['checkouts'] += 1
+            return connection
+
+        try:
+            connection = self._connect()
+            left = remaining()
+            self._set_timeouts(connection, None if left is None else max(0.001, left))
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.stats['misses'] += 1
+            self.stats['checkouts'] += 1
+        return connection
+
+    def release(self, connection, discard=False):
+        # End an open transaction so the next borrower does not see a stale snapshot. The server reports
+        # whether one is open with every reply, so a connection that committed costs no extra round trip.
+        # A server that stalls gets connect_timeout seconds for it, however little was left of the deadline.
+        if not discard and connection.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            self._set_timeouts(connection, self.connect_timeout)
+            try:
+                connection.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._close(connection)
+        with self._cond:
+            if discard:
+                self._size -= 1
+                self.stats['discarded'] += 1
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    # Borrow a connection for the duration of a with-block and hand it back afterwards
+    @contextmanager
+    def connection(self):
+        check_deadline()
+        self.breaker.check()
+        started = time.monotonic()
+        try:
+            connection = self.acquire()
+        except PoolTimeout:
+            # A full pool says nothing about the server; a probe hands its turn on without closing the breaker
+            self.breaker.release_probe()
+            raise
+        except Exception as e:
+            self.breaker.record(e)
+            raise
+        self.breaker.record_success()
+        metrics.record_acquire(self.name, time.monotonic() - started)
+        try:
+            yield connection
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            # The connection may be broken, do not put it back into the pool
+            self.release(connection, discard=True)
+            raise
+        except BaseException:
+            self.release(connection)
+            raise
+        else:
+            self.release(connection)
+
+    # One autocommit connection beside the pool, for bookkeeping that must commit on its own whatever the
+    # borrower's transaction does (see global_ids.keep_up). Callers take turns on it, and its statements give
+    # up on a row lock after a second rather than queue behind the borrowers' transactions.
+    @contextmanager
+    def side_connection(self):
+        with self._side_lock:
+            if self._side is None:
+                side = self._connect()
+                side.autocommit(True)
+                with side.cursor() as cursor:
+                    cursor.execute("SET SESSION innodb_lock_wait_timeout = 1")
+                self._side = side
+            self._set_timeouts(self._side, self._limit(self.connect_timeout))
+            try:
+                yield self._side
+            except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+                self._close(self._side)
+                self._side = None
+                raise
+
+    def snapshot(self):
+        with self._cond:
+            stats = dict(self.stats)
+            stats['open'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        with self._cond:
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for connection in idle:
+            self._close(connection)
+        with self._side_lock:
+            if self._side is not None:
+                self._close(self._side)
+                self._side = None
+
+
+# Process-wide registry so every caller (and every Streamlit rerun) shares one pool per shard
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name, params, **pool_options):
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = ShardPool(name, params, **pool_options)
+            _pools[name] = pool
+        return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.name: pool.snapshot() for pool in pools}
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,554 @@
+# IMPORT LIBRARIES
+import re
+import sys
+import time
+import uuid
+import queue
+import heapq
+import atexit
+import argparse
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+from db_metrics import InstrumentedSSDictCursor
+from resilience import deadline
+
+# Ad-hoc queries across every shard. A read-only SELECT runs on all shards at once inside READ ONLY
+# transactions and its rows are streamed back; the coordinator merges the shards' ORDER BY, applies
+# LIMIT, and combines COUNT / SUM / MIN / MAX / AVG per GROUP BY group. Anything else is a write and
+# only runs in write mode, as one XA transaction per shard committed with two-phase commit.
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='shard-query')
+atexit.register(_executor.shutdown, wait=False)
+
+MAX_GROUPS = 100000  # groups an aggregate query may hold on the coordinator
+
+_CLAUSE = re.compile(r"\b(SELECT|FROM|WHERE|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT|UNION|INTO|FOR\s+UPDATE|FOR\s+SHARE|"
+                     r"LOCK\s+IN\s+SHARE\s+MODE|WINDOW)\b", re.IGNORECASE)
+_CLAUSE_ORDER = ['SELECT', 'FROM', 'WHERE', 'GROUP BY', 'HAVING', 'ORDER BY', 'LIMIT']
+_AGGREGATE_CALL = re.compile(r"\b(COUNT|SUM|MIN|MAX|AVG)\s*\(", re.IGNORECASE)
+_PLAIN_AGGREGATE = re.compile(r"^(COUNT|SUM|MIN|MAX|AVG)\s*\((.*)\)$", re.IGNORECASE | re.DOTALL)
+_ALIAS = re.compile(r"^(.*\S)\s+AS\s+(`[^`]+`|\w+)$", re.IGNORECASE | re.DOTALL)
+_IMPLICIT_ALIAS = re.compile(r"^(.*[\w)`'\"])\s+(`[^`]+`|[A-Za-z_]\w*)$", re.DOTALL)
+_COLUMN = re.compile(r"^(?:(?:`[^`]+`|\w+)\.)*(`[^`]+`|\w+)$")
+_ORDER_TERM = re.compile(r"^(.*?)(?:\s+(ASC|DESC))?$", re.IGNORECASE | re.DOTALL)
+_LIMIT = re.compile(r"^(\d+)(?:\s*,\s*(\d+)|\s+OFFSET\s+(\d+))?$", re.IGNORECASE)
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _mask(sql):
+    """
+    sql with the insides of quotes, parentheses and comments blanked out (same length), so
+    clause keywords and commas found in it are at the top level of the statement.
+    """
+    masked = []
+    depth = 0
+    quote = None
+    position = 0
+    while position < len(sql):
+        char = sql[position]
+        if quote:
+            masked.append(' ')
+            if char == '\\' and quote != '`':
+                masked.append(' ')
+                position += 1
+            elif char == quote:
+                quote = None
+                masked[-1] = char
+        elif char in '\'"`':
+            quote = char
+            masked.append(char)
+        elif sql.startswith('--', position) or char == '#' or sql.startswith('/*', position):
+            end = sql.find('*/', position) + 2 if char == '/' else sql.find('\n', position)
+            end = len(sql) if end < 2 else end
+            masked.append(' ' * (end - position))
+            position = end
+            continue
+        elif char == '(':
+            depth += 1
+            masked.append('(' if depth == 1 else ' ')
+        elif char == ')':
+            depth -= 1
+            masked.append(')' if depth == 0 else ' ')
+        else:
+            masked.append(char if depth == 0 else ' ')
+        position += 1
+    if quote or depth:
+        raise QueryError("unbalanced quotes or parentheses")
+    return ''.join(masked)
+
+
+def _split_top_level(text, masked, separator=','):
+    parts = []
+    start = 0
+    for position, char in enumerate(masked):
+        if char == separator:
+            parts.append(text[start:position].strip())
+            start = position + 1
+    parts.append(text[start:].strip())
+    return parts
+
+
+def _normalize(expression):
+    return ' '.join(expression.replace('`', '').split()).casefold()
+
+
+def _unquote(name):
+    return name[1:-1] if name.startswith('`') else name
+
+
+def is_select(sql):
+    return _mask(sql).lstrip().upper().startswith('SELECT')
+
+
+class SelectItem:
+    def __init__(self, text):
+        masked = _mask(text)
+        alias = _ALIAS.match(masked)
+        if alias is None and not _COLUMN.match(text.strip()):
+            alias = _IMPLICIT_ALIAS.match(masked)
+            if alias and (re.search(r"[-+*/%=<>|&^~,]$|\b(AND|OR|NOT|IS|LIKE|IN|BETWEEN|DISTINCT|CASE|WHEN|THEN|ELSE)$",
+                                    alias.group(1), re.IGNORECASE) or alias.group(2).upper() in ('END', 'NULL')):
+                alias = None
+        self.expression = text[:alias.end(1)].strip() if alias else text.strip()
+        self.alias = _unquote(text[alias.start(2):alias.end(2)]) if alias else None
+        column = _COLUMN.match(self.expression)
+        # MySQL names an unaliased column after the column itself, without its table
+        self.name = self.alias or (_unquote(column.group(1)) if column else self.expression)
+        self.star = self.expression == '*' or self.expression.endswith('.*')
+
+        self.aggregate = None
+        plain = _PLAIN_AGGREGATE.match(self.expression)
+        if plain and _mask(self.expression).rstrip().endswith(')') and \
+                _mask(self.expression).count('(') == 1:
+            self.aggregate = plain.group(1).upper()
+            self.argument = plain.group(2).strip()
+            if self.argument.upper().startswith('DISTINCT'):
+                raise QueryError(f"{self.expression}: DISTINCT aggregates cannot be combined across shards")
+        elif _AGGREGATE_CALL.search(self.expression):
+            raise QueryError(f"{self.expression}: only plain COUNT / SUM / MIN / MAX / AVG columns can be combined "
+                             "across shards")
+
+
+class QueryPlan:
+    """
+    How one SELECT is split between the shards and the coordinator.
+
+    Plain queries keep their ORDER BY on the shards, which only return the first offset + limit
+    rows (at most max_rows + 1); the coordinator merges the shards' ordered streams. Aggregate
+    queries send the shards the GROUP BY with partial aggregates (AVG as SUM and COUNT) and the
+    coordinator combines the groups, then sorts and limits them.
+    """
+    def __init__(self, sql, max_rows):
+        sql = sql.strip().rstrip(';').strip()
+        masked = _mask(sql)
+        if ';' in masked:
+            raise QueryError("only one statement can be run at a time")
+        if not masked.upper().startswith('SELECT'):
+            raise QueryError("read-only mode runs SELECT statements only")
+
+        clauses = {}
+        matches = list(_CLAUSE.finditer(masked))
+        for index, match in enumerate(matches):
+            keyword = ' '.join(match.group(1).upper().split())
+            if keyword not in _CLAUSE_ORDER:
+                raise QueryError(f"{keyword} is not supported by the query console")
+            if keyword in clauses or (clauses and _CLAUSE_ORDER.index(keyword) < _CLAUSE_ORDER.index(list(clauses)[-1])):
+                raise QueryError(f"unexpected {keyword}")
+            end = matches[index + 1].start() if index + 1 < len(matches) else len(sql)
+            clauses[keyword] = sql[match.end():end].strip()
+        select = clauses['SELECT']
+        self.distinct = bool(re.match(r"DISTINCT\b", select, re.IGNORECASE))
+        if self.distinct:
+            select = select[len('DISTINCT'):].strip()
+        self.items = [SelectItem(text) for text in _split_top_level(select, _mask(select))]
+        self.source = ''.join(f" {keyword} {clauses[keyword]}" for keyword in ('FROM', 'WHERE') if keyword in clauses)
+
+        self.offset, self.limit = 0, None
+        if 'LIMIT' in clauses:
+            limit = _LIMIT.match(clauses['LIMIT'])
+            if limit is None:
+                raise QueryError("LIMIT must be a number of rows, optionally with an offset")
+            if limit.group(2) is not None:
+                self.offset, self.limit = int(limit.group(1)), int(limit.group(2))
+            else:
+                self.offset, self.limit = int(limit.group(3) or 0), int(limit.group(1))
+        self.max_rows = max_rows
+
+        group_by = clauses.get('GROUP BY')
+        self.aggregated = group_by is not None or any(item.aggregate for item in self.items)
+        if self.aggregated:
+            if 'HAVING' in clauses:
+                raise QueryError("HAVING cannot be applied across shards; filter the grouped rows instead")
+            if self.distinct or any(item.star for item in self.items):
+                raise QueryError("SELECT DISTINCT and * cannot be combined with aggregates")
+            self.group_items = [self._resolve(term) for term in _split_top_level(group_by, _mask(group_by))] \
+                if group_by else []
+            for index, item in enumerate(self.items):
+                if not item.aggregate and index not in self.group_items:
+                    raise QueryError(f"{item.expression} must be aggregated or listed in GROUP BY")
+        self.order = []  # (output column, descending)
+        if 'ORDER BY' in clauses:
+            self.order_text = clauses['ORDER BY']
+            for term in _split_top_level(self.order_text, _mask(self.order_text)):
+                expression, direction = _ORDER_TERM.match(term).groups()
+                self.order.append((self._order_column(expression.strip()), (direction or '').upper() == 'DESC'))
+
+    def _resolve(self, term):
+        """Index of the select item a GROUP BY / ORDER BY term refers to: ordinal, alias or same expression"""
+        if term.isdigit() and 1 <= int(term) <= len(self.items):
+            return int(term) - 1
+        for index, item in enumerate(self.items):
+            if item.alias and _unquote(term).casefold() == item.alias.casefold():
+                return index
+        for index, item in enumerate(self.items):
+            if _normalize(term) == _normalize(item.expression):
+                return index
+        for index, item in enumerate(self.items):
+            column = _COLUMN.match(term)
+            if column and not item.star and _unquote(column.group(1)).casefold() == item.name.casefold():
+                return index
+        raise QueryError(f"{term} must also be selected to be grouped or sorted across shards")
+
+    def _order_column(self, term):
+        try:
+            return self.items[self._resolve(term)].name
+        except QueryError:
+            # With SELECT * the columns are only known from the rows
+            column = _COLUMN.match(term)
+            if column and any(item.star for item in self.items) and not self.aggregated:
+                return _unquote(column.group(1))
+            raise
+
+    def shard_sql(self):
+        if not self.aggregated:
+            select = 'SELECT ' + ('DISTINCT ' if self.distinct else '') + \
+                ', '.join(f"{item.expression} AS `{item.alias}`" if item.alias else item.expression for item in self.items)
+            sql = select + self.source
+            if self.order:
+                sql += ' ORDER BY ' + self.order_text
+            # One row past the cap tells the coordinator the result was cut
+            rows = self.max_rows + 1 + self.offset
+            if self.limit is not None:
+                rows = min(rows, self.offset + self.limit)
+            return sql + f' LIMIT {rows}'
+        columns = []
+        for index, item in enumerate(self.items):
+            if item.aggregate == 'AVG':
+                columns.append(f"SUM({item.argument}) AS `_c{index}_sum`")
+                columns.append(f"COUNT({item.argument}) AS `_c{index}_count`")
+            else:
+                columns.append(f"{item.expression} AS `_c{index}`")
+        sql = 'SELECT ' + ', '.join(columns) + self.source
+        if self.group_items:
+            sql += ' GROUP BY ' + ', '.join(self.items[index].expression for index in self.group_items)
+        return sql
+
+
+class _SortKey:
+    # Mixed ascending / descending order; NULL sorts first ascending like MySQL, strings case-insensitively
+    __slots__ = ('values', 'descending')
+
+    def __init__(self, values, descending):
+        self.values = values
+        self.descending = descending
+
+    def __lt__(self, other):
+        for mine, theirs, descending in zip(self.values, other.values, self.descending):
+            if mine == theirs:
+                continue
+            if mine is None:
+                return not descending
+            if theirs is None:
+                return descending
+            return mine > theirs if descending else mine < theirs
+        return False
+
+
+def _comparable(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+def _sort_key(order):
+    columns = [column for column, _ in order]
+    descending = [descending for _, descending in order]
+    return lambda row: _SortKey([_comparable(row[column]) for column in columns], descending)
+
+
+# Stream one shard's rows into output in batches; executed on a worker thread
+def _stream_shard(connect, db_name, sql, timeout, fetch_size, output, stop):
+    def put(item):
+        while not stop.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    try:
+        # The socket gives up with the server, so a stalled shard cannot hold the worker either
+        with deadline(timeout), connect(db_name) as connection:
+            with connection.cursor() as cursor:
+                # The server stops the SELECT itself once the deadline has passed
+                cursor.execute("SET SESSION MAX_EXECUTION_TIME = %s", (int(timeout * 1000),))
+                cursor.execute("START TRANSACTION READ ONLY")
+            try:
+                with connection.cursor(InstrumentedSSDictCursor) as cursor:
+                    cursor.execute(sql)
+                    while not stop.is_set():
+                        rows = cursor.fetchmany(fetch_size)
+                        if not rows:
+                            break
+                        put(('rows', rows))
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute("SET SESSION MAX_EXECUTION_TIME = DEFAULT")
+        put(('done', None))
+    except Exception as e:
+        put(('error', str(e)))
+
+
+class QueryStream:
+    """
+    Rows of a read-only query across every shard, yielded as they arrive. After iterating,
+    errors maps shards that failed or timed out to their message (the rows of the other shards
+    are still returned), and truncated tells whether max_rows cut the result.
+    """
+    def __init__(self, connect, db_names, sql, timeout=30.0, max_rows=10000, fetch_size=500, shard_column=None):
+        self.plan = QueryPlan(sql, max_rows)
+        self.connect = connect
+        self.db_names = list(db_names)
+        self.timeout = timeout
+        self.fetch_size = fetch_size
+        self.shard_column = shard_column
+        self.errors = {}
+        self.truncated = False
+        self.started = None
+
+    @property
+    def partial(self):
+        return bool(self.errors)
+
+    def _shard_rows(self, db_name, output, deadline):
+        while True:
+            try:
+                kind, payload = output.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                self.errors[db_name] = f"Timed out after {self.timeout:.1f}s"
+                return
+            if kind == 'error':
+                self.errors[db_name] = payload
+                return
+            if kind == 'done':
+                return
+            for row in payload:
+                if self.shard_column and not self.plan.aggregated:
+                    row[self.shard_column] = db_name
+                yield row
+
+    def __iter__(self):
+        self.started = time.monotonic()
+        deadline = self.started + self.timeout
+        stop = threading.Event()
+        outputs = {db_name: queue.Queue(maxsize=8) for db_name in self.db_names}
+        sql = self.plan.shard_sql()
+        for db_name, output in outputs.items():
+            _executor.submit(contextvars.copy_context().run, _stream_shard, self.connect, db_name, sql, self.timeout,
+                             self.fetch_size, output, stop)
+        try:
+            streams = [self._shard_rows(db_name, output, deadline) for db_name, output in outputs.items()]
+            rows = self._combine(streams) if self.plan.aggregated else self._merge(streams)
+            yield from self._cut(rows)
+        finally:
+            # Workers still streaming stop at their next batch and give their connections back
+            stop.set()
+
+    def _merge(self, streams):
+        if self.plan.order:
+            rows = heapq.merge(*streams, key=_sort_key(self.plan.order))
+        else:
+            rows = (row for stream in streams for row in stream)
+        if self.plan.distinct:
+            rows = self._drop_duplicates(rows)
+        return rows
+
+    def _drop_duplicates(self, rows):
+        seen = set()
+        for row in rows:
+            key = tuple(_comparable(value) for name, value in row.items() if name != self.shard_column)
+            if key not in seen:
+                seen.add(key)
+                yield row
+
+    def _combine(self, streams):
+        plan = self.plan
+        groups = {}
+        for stream in streams:
+            for row in stream:
+                key = tuple(_comparable(row[f'_c{index}']) for index in plan.group_items)
+                group = groups.get(key)
+                if group is None:
+                    if len(groups) >= MAX_GROUPS:
+                        raise QueryError(f"more than {MAX_GROUPS} groups; narrow the query")
+                    groups[key] = dict(row)
+                    continue
+                for index, item in enumerate(plan.items):
+                    if item.aggregate in ('COUNT', 'SUM'):
+                        group[f'_c{index}'] = _add(group[f'_c{index}'], row[f'_c{index}'])
+                    elif item.aggregate in ('MIN', 'MAX'):
+                        values = [value for value in (group[f'_c{index}'], row[f'_c{index}']) if value is not None]
+                        group[f'_c{index}'] = (min if item.aggregate == 'MIN' else max)(values) if values else None
+                    elif item.aggregate == 'AVG':
+                        group[f'_c{index}_sum'] = _add(group[f'_c{index}_sum'], row[f'_c{index}_sum'])
+                        group[f'_c{index}_count'] += row[f'_c{index}_count']
+        rows = []
+        for group in groups.values():
+            row = {}
+            for index, item in enumerate(plan.items):
+                if item.aggregate == 'AVG':
+                    count = group.get(f'_c{index}_count') or 0
+                    row[item.name] = group[f'_c{index}_sum'] / count if count else None
+                else:
+                    row[item.name] = group[f'_c{index}']
+            rows.append(row)
+        if plan.order:
+            rows.sort(key=_sort_key(plan.order))
+        return rows
+
+    def _cut(self, rows):
+        count = 0
+        for position, row in enumerate(rows):
+            if position < self.plan.offset:
+                continue
+            if self.plan.limit is not None and count >= self.plan.limit:
+                return
+            if count >= self.plan.max_rows:
+                self.truncated = True
+                return
+            count += 1
+            yield row
+
+
+def _add(total, value):
+    if value is None:
+        return total
+    return value if total is None else total + value
+
+
+def run_query(connect, db_names, sql, timeout=30.0, max_rows=10000, shard_column=None):
+    """Runs a read-only query across every shard and returns its stream with all rows read into .rows"""
+    stream = QueryStream(connect, db_names, sql, timeout=timeout, max_rows=max_rows, shard_column=shard_column)
+    stream.rows = list(stream)
+    stream.seconds = time.monotonic() - stream.started
+    return stream
+
+
+def _xa_write(connection, xid, db_name, sql, lock_timeout):
+    with connection.cursor() as cursor:
+        cursor.execute("SET SESSION innodb_lock_wait_timeout = %s", (max(1, int(lock_timeout)),))
+        cursor.execute("XA START %s, %s", (xid, db_name))
+        cursor.execute(sql)
+        rows = cursor.rowcount
+        cursor.execute("XA END %s, %s", (xid, db_name))
+        cursor.execute("XA PREPARE %s, %s", (xid, db_name))
+    return rows
+
+
+def _xa_finish(connection, xid, db_name, commit):
+    with connection.cursor() as cursor:
+        cursor.execute(f"XA {'COMMIT' if commit else 'ROLLBACK'} %s, %s", (xid, db_name))
+        cursor.execute("SET SESSION innodb_lock_wait_timeout = DEFAULT")
+
+
+def run_write(connect, db_names, sql, lock_timeout=10.0):
+    """
+    Runs one write statement on every shard as a single distributed transaction: each shard
+    runs it in an XA transaction and prepares it; only when every shard has prepared are they
+    all committed, otherwise the prepared ones are rolled back. Returns (committed, rows, errors)
+    where rows maps shards to affected rows and errors maps shards to messages. A shard that
+    fails after every shard prepared is left prepared and reported with the XA id, to be
+    finished by hand (XA RECOVER, then XA COMMIT or XA ROLLBACK).
+    """
+    masked = _mask(sql.strip().rstrip(';'))
+    if ';' in masked:
+        raise QueryError("only one statement can be run at a time")
+    xid = f"eventmanager-{uuid.uuid4().hex[:16]}"
+    db_names = list(db_names)
+    rows = {}
+    errors = {}
+    contexts = {db_name: connect(db_name) for db_name in db_names}
+    connections = {}
+    try:
+        for db_name, context in contexts.items():
+            try:
+                connections[db_name] = context.__enter__()
+            except Exception as e:
+                errors[db_name] = str(e)
+
+        # Phase one: run and prepare on every shard at once
+        futures = {_executor.submit(contextvars.copy_context().run, _xa_write, connection, xid, db_name, sql.strip().rstrip(';'),
+                                    lock_timeout): db_name for db_name, connection in connections.items()}
+        wait(futures)
+        prepared = []
+        for future, db_name in futures.items():
+            if future.exception() is None:
+                rows[db_name] = future.result()
+                prepared.append(db_name)
+            else:
+                errors[db_name] = str(future.exception())
+        committed = not errors and len(prepared) == len(db_names)
+
+        # Phase two: commit everywhere, or roll back whatever was prepared
+        for db_name in prepared:
+            try:
+                _xa_finish(connections[db_name], xid, db_name, committed)
+            except Exception as e:
+                action = 'commit' if committed else 'roll back'
+                errors[db_name] = f"prepared but failed to {action} XA transaction '{xid}', '{db_name}': {e}"
+        return committed, rows, errors
+    finally:
+        for db_name, connection in connections.items():
+            # A shard that failed mid-transaction is still in XA state; the pool discards such connections
+            contexts[db_name].__exit__(None, None, None)
+
+
+if __name__ == "__main__":
+    from shard_config import router, connect_to_shard, read_from_shard
+
+    parser = argparse.ArgumentParser(description="Run one SQL statement across every shard.")
+    parser.add_argument('sql')
+    parser.add_argument('--write', action='store_true', help="allow a write, committed on every shard with two-phase commit")
+    parser.add_argument('--timeout', type=float, default=30.0, help="seconds a read may take")
+    parser.add_argument('--max-rows', type=int, default=10000, help="rows returned at most")
+    args = parser.parse_args(sys.argv[1:])
+
+    try:
+        if is_select(args.sql):
+            stream = QueryStream(read_from_shard, router.shards, args.sql, args.timeout, args.max_rows,
+                                 shard_column='Shard')
+            columns = []
+            for count, row in enumerate(stream):
+                if count == 0:
+                    columns = list(row)
+                    print('\t'.join(columns))
+                print('\t'.join('' if row.get(column) is None else str(row.get(column)) for column in columns))
+            for db_name, error in stream.errors.items():
+                print(f"{db_name} is missing from the results: {error}", file=sys.stderr)
+            if stream.truncated:
+                print(f"stopped after {args.max_rows} rows", file=sys.stderr)
+            sys.exit(1 if stream.partial else 0)
+        if not args.write:
+            parser.error("only SELECT statements run without --write")
+        committed, rows, errors = run_write(connect_to_shard, router.shards, args.sql)
+        for db_name, count in rows.items():
+            print(f"{db_name}: {count} rows")
+        for db_name, error in errors.items():
+            print(f"{db_name}: {error}", file=sys.stderr)
+        print("committed on every shard" if committed else "rolled back on every shard")
+        sys.exit(0 if committed and not errors else 1)
+    except QueryError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(2)
@@ -0,0 +1,147 @@
+# IMPORT LIBRARIES
+import bisect
+import hashlib
+from global_ids import shard_numbers, shard_number_of
+
+
+def _hash(value):
+    # First 8 bytes of the sha256 digest, spread evenly over a 64-bit ring
+    return int.from_bytes(hashlib.sha256(value.encode()).digest()[:8], 'big')
+
+
+# Consistent-hash ring: every shard owns virtual_nodes points, a key belongs to the next point clockwise.
+# Adding or removing a shard only moves the keys between its points and their neighbours.
+class HashRing:
+    def __init__(self, shards, virtual_nodes=64):
+        if not shards:
+            raise ValueError("A hash ring needs at least one shard")
+        self.shards = list(shards)
+        self.virtual_nodes = virtual_nodes
+        points = sorted((_hash(f"{shard}#{i}"), shard) for shard in self.shards for i in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def shard_for(self, key):
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+# The original placement: int(sha256) modulo the number of shards
+class ModuloPlacement:
+    def __init__(self, shards):
+        if not shards:
+            raise ValueError("Modulo placement needs at least one shard")
+        self.shards = list(shards)
+
+    def shard_for(self, key):
+        return self.shards[int(hashlib.sha256(key.encode()).hexdigest(), 16) % len(self.shards)]
+
+
+def _placement(spec, default_virtual_nodes=64):
+    if spec.get('scheme', 'ring') == 'modulo':
+        return ModuloPlacement(spec['shards'])
+    return HashRing(spec['shards'], int(spec.get('virtual_nodes', default_virtual_nodes)))
+
+
+class ShardRouter:
+    """
+    Routes a venue name to the shard that owns it, and a venue or booking ID to the shard
+    that created it (numbers maps shard names to the numbers embedded in their IDs).
+
+    While a resharding is in progress the previous placement is kept as well: a venue is
+    looked up on its new owner first and on its previous owner second, until reshard.py
+    has moved it.
+    """
+    def __init__(self, placement, previous=None, numbers=None):
+        self.placement = placement
+        self.previous = previous
+        self.shards = list(placement.shards)
+        for shard in (previous.shards if previous else []):
+            if shard not in self.shards:
+                self.shards.append(shard)
+        self.numbers = numbers or {shard: number for number, shard in enumerate(self.shards, 1)}
+        self._by_number = {number: shard for shard, number in self.numbers.items()}
+
+    def shard_for(self, key):
+        return self.placement.shard_for(key)
+
+    def shard_for_id(self, global_id):
+        """The shard holding the row with this ID, None for an ID from before global IDs"""
+        number = shard_number_of(global_id)
+        if number is None:
+            return None
+        if number not in self._by_number:
+            raise ValueError(f"ID {global_id} belongs to shard number {number}, which is not in the shard map")
+        return self._by_number[number]
+
+    def candidates(self, key):
+        owner = self.placement.shard_for(key)
+        if self.previous is None:
+            return [owner]
+        previous_owner = self.previous.shard_for(key)
+        return [owner] if previous_owner == owner else [owner, previous_owner]
+
+
+def load_router(shard_map):
+    """
+    Builds a router from a shard map such as
+
+        {'shards': ['EventManager1', 'EventManager2', 'EventManager3'], 'virtual_nodes': 64,
+         'previous': {'scheme': 'modulo', 'shards': ['EventManager1', 'EventManager2']}}
+
+    'scheme' is 'ring' (default) or 'modulo' for the original two-shard sha256 % 2 layout.
+    'numbers' ({'EventManager1': 1, ...}) numbers the shards for their IDs; without it they are
+    numbered in the order listed, so new shards must be added at the end.
+    """
+    shard_map = dict(shard_map)
+    previous = shard_map.get('previous')
+    return ShardRouter(_placement(shard_map), _placement(dict(previous)) if previous else None,
+                       shard_numbers(shard_map))
+
+
+# Find the shard currently holding a venue: the shard in its ID when one is given, otherwise its owner,
+# or during a resharding its previous owner. Only probes the database when more than one shard can hold the venue.
+def locate_venue(router, connect, venue_name, venue_id=None):
+    if venue_id is not None and router.shard_for_id(venue_id) is not None:
+        return router.shard_for_id(venue_id)
+    candidates = router.candidates(venue_name)
+    if len(candidates) == 1:
+        return candidates[0]
+    for db_name in candidates:
+        with connect(db_name) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT ID FROM Venues WHERE Name = %s", (venue_name,))
+                if cursor.fetchone():
+                    return db_name
+    return candidates[0]
+
+
+def _present(connect, db_name, names):
+    with connect(db_name) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT Name FROM Venues WHERE Name IN ({', '.join(['%s'] * len(names))})", names)
+            return {row['Name'] for row in cursor.fetchall()}
+
+
+def locate_venues(router, connect, venue_names, batch_size=1000):
+    """
+    locate_venue for many venues at once: {venue_name: shard}. During a resharding the venues
+    that may still live on their previous owner are looked up with one IN query per shard and
+    batch, on the new owner first and on the previous owner for the ones not found there.
+    """
+    located = {}
+    unsure = {}  # (owner, previous owner) -> names
+    for name in dict.fromkeys(venue_names):
+        candidates = router.candidates(name)
+        located[name] = candidates[0]
+        if len(candidates) > 1:
+            unsure.setdefault(tuple(candidates), []).append(name)
+    for (owner, previous_owner), names in unsure.items():
+        for start in range(0, len(names), batch_size):
+            batch = names[start:start + batch_size]
+            on_owner = _present(connect, owner, batch)
+            missing = [name for name in batch if name not in on_owner]
+            if missing:
+                for name in _present(connect, previous_owner, missing):
+                    located[name] = previous_owner
+    return located
@@ -0,0 +1,116 @@
+# IMPORT LIBRARIES
+import time
+import threading
+from collections import OrderedDict
+
+
+def _sorted(values):
+    return sorted(values, key=lambda value: (value or '').casefold())
+
+
+class VenueCatalogCache:
+    """
+    In-process cache of the venue catalog.
+
+    Entries are keyed by venue name and hold the venue's City, Capacity, Price_per_hour and
+    the Shard it lives on. They expire after ttl seconds and the least recently used ones are
+    evicted beyond max_entries. The sorted city and venue name lists shown in the dropdowns
+    are derived from a full catalog load and expire with the same ttl.
+    """
+    def __init__(self, ttl=300, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # name -> (expires_at, venue), least recently used first
+        self._lists = None  # (expires_at, cities, names)
+        self._lock = threading.RLock()
+        self.stats = {'hits': 0, 'misses': 0, 'list_hits': 0, 'list_misses': 0,
+                      'loads': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _store(self, venue, now):
+        name = venue['Name']
+        self._entries[name] = (now + self.ttl, dict(venue))
+        self._entries.move_to_end(name)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[name]
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(name)
+            self.stats['hits'] += 1
+            return dict(entry[1])
+
+    # Write-through: a venue that was just written is cached and added to the derived lists
+    def put(self, venue):
+        with self._lock:
+            now = time.monotonic()
+            self._store(venue, now)
+            if self._lists is not None:
+                expires_at, cities, names = self._lists
+                if venue['City'] not in cities:
+                    cities = _sorted(cities + [venue['City']])
+                if venue['Name'] not in names:
+                    names = _sorted(names + [venue['Name']])
+                self._lists = (expires_at, cities, names)
+
+    # Replace the whole catalog from a full scan of every shard
+    def load(self, venues):
+        with self._lock:
+            now = time.monotonic()
+            self._entries.clear()
+            cities = set()
+            names = []
+            for venue in venues:
+                self._store(venue, now)
+                cities.add(venue['City'])
+                names.append(venue['Name'])
+            self._lists = (now + self.ttl, _sorted(cities), _sorted(set(names)))
+            self.stats['loads'] += 1
+
+    def _fresh_lists(self):
+        if self._lists is None or self._lists[0] < time.monotonic():
+            self.stats['list_misses'] += 1
+            return None
+        self.stats['list_hits'] += 1
+        return self._lists
+
+    def cities(self):
+        with self._lock:
+            lists = self._fresh_lists()
+            return list(lists[1]) if lists else None
+
+    def names(self):
+        with self._lock:
+            lists = self._fresh_lists()
+            return list(lists[2]) if lists else None
+
+    # Drop the given venues (or everything) together with the derived lists
+    def invalidate(self, names=None):
+        with self._lock:
+            if names is None:
+                self._entries.clear()
+            else:
+                for name in names:
+                    self._entries.pop(name, None)
+            self._lists = None
+            self.stats['invalidations'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+            list_lookups = stats['list_hits'] + stats['list_misses']
+            stats['list_hit_rate'] = stats['list_hits'] / list_lookups if list_lookups else 0.0
+        return stats
+
+
+# One catalog per process, shared by every Streamlit session and rerun
+venue_cache = VenueCatalogCache()
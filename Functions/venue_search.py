@@ -0,0 +1,259 @@
+# IMPORT LIBRARIES
+import time
+import heapq
+import bisect
+import threading
+from array import array
+from collections import Counter
+
+# Match kinds, best first; a venue is ranked by its best kind and then by name
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING, FUZZY = range(5)
+MATCH_NAMES = ['exact', 'prefix', 'word prefix', 'substring', 'fuzzy']
+
+
+def fold(text):
+    return (text or '').casefold()
+
+
+def name_trigrams(folded):
+    """Trigrams of every word, padded so that word starts get their own trigrams ('  h', ' ha')"""
+    grams = set()
+    for word in folded.split():
+        padded = '  ' + word + ' '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def keyword_trigrams(folded):
+    """
+    Trigrams a name must contain to contain the keyword. The keyword may start and end in the
+    middle of a word, so only the inner word boundaries are padded; a keyword shorter than three
+    characters falls back to its word-start trigram, which only finds it at word starts.
+    """
+    grams = set()
+    words = folded.split()
+    for position, word in enumerate(words):
+        padded = ('  ' if position > 0 else '') + word + (' ' if position < len(words) - 1 else '')
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    if not grams and words:
+        grams.add(('  ' + words[0])[-3:])
+    return grams
+
+
+class VenueSearchIndex:
+    """
+    In-process trigram index over the venue catalog of every shard.
+
+    Venues get an integer slot; postings are compact arrays of slots per trigram, in slot order.
+    Updates give the venue a new slot and leave a tombstone in the old one, so postings only ever
+    grow until the next load. A sorted list of folded names answers prefix searches and lists the
+    catalog by name when there is no keyword.
+    """
+    def __init__(self, ttl=600, max_fuzzy_posting=5000):
+        self.ttl = ttl  # seconds before the index should be rebuilt to pick up other processes' writes
+        self.max_fuzzy_posting = max_fuzzy_posting  # trigrams more common than this are ignored by fuzzy matching
+        self._lock = threading.RLock()
+        self._clear()
+        self.loaded_at = None
+        self._reload_claimed_at = None
+
+    def _clear(self):
+        self._venues = []  # slot -> venue dict, None once removed
+        self._folded = []  # slot -> folded name
+        self._slots = {}  # folded name -> live slot
+        self._postings = {}  # trigram -> array of slots
+        self._sorted = []  # (folded name, slot) of live venues
+        self._cities = {}  # folded city -> set of live slots
+
+    # Give a venue the next slot and post it under each of its trigrams
+    def _index(self, venue, folded):
+        slot = len(self._venues)
+        grams = name_trigrams(folded)
+        self._venues.append(dict(venue))
+        self._folded.append(folded)
+        self._slots[folded] = slot
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is None:
+                posting = self._postings[gram] = array('i')
+            posting.append(slot)
+        self._cities.setdefault(fold(venue.get('City')), set()).add(slot)
+        return slot
+
+    def _add(self, venue):
+        folded = fold(venue['Name'])
+        self._remove(folded)
+        bisect.insort(self._sorted, (folded, self._index(venue, folded)))
+
+    def _remove(self, folded):
+        slot = self._slots.pop(folded, None)
+        if slot is None:
+            return False
+        venue = self._venues[slot]
+        self._venues[slot] = None
+        del self._sorted[bisect.bisect_left(self._sorted, (folded, slot))]
+        self._cities.get(fold(venue.get('City')), set()).discard(slot)
+        return True
+
+    # Rebuild from a full catalog scan (rows with Name, City, Capacity, Price_per_hour and Shard)
+    def load(self, venues):
+        with self._lock:
+            self._clear()
+            for venue in venues:
+                folded = fold(venue['Name'])
+                if folded not in self._slots:
+                    self._index(venue, folded)
+            self._sorted = sorted((folded, slot) for folded, slot in self._slots.items())
+            self.loaded_at = time.monotonic()
+
+    # Incremental updates from the write paths: add or replace one venue, or drop it
+    def put(self, venue):
+        with self._lock:
+            if self.loaded_at is not None:
+                self._add(venue)
+
+    def remove(self, name):
+        with self._lock:
+            return self._remove(fold(name))
+
+    def is_fresh(self):
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    def claim_reload(self, retry_after):
+        """
+        True for one caller per retry_after seconds: that caller loads the catalog, while the others
+        search the shards directly, so a stale index with a shard down is not rescanned on every search.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._reload_claimed_at is not None and now - self._reload_claimed_at < retry_after:
+                return False
+            self._reload_claimed_at = now
+            return True
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+            self.loaded_at = None
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _matches(self, slot, city, min_capacity, max_capacity, min_price, max_price):
+        venue = self._venues[slot]
+        if venue is None:
+            return False
+        if city is not None and fold(venue.get('City')) != city:
+            return False
+        if min_capacity is not None and venue['Capacity'] < min_capacity:
+            return False
+        if max_capacity is not None and venue['Capacity'] > max_capacity:
+            return False
+        if min_price is not None and venue['Price_per_hour'] < min_price:
+            return False
+        if max_price is not None and venue['Price_per_hour'] > max_price:
+            return False
+        return True
+
+    def _kind(self, folded, keyword):
+        if folded == keyword:
+            return EXACT
+        if folded.startswith(keyword):
+            return PREFIX
+        if (' ' + folded).find(' ' + keyword) >= 0:
+            return WORD_PREFIX
+        if keyword in folded:
+            return SUBSTRING
+        return None
+
+    def search(self, keyword='', city=None, min_capacity=None, max_capacity=None, min_price=None, max_price=None,
+               limit=50, fuzzy=True, min_similarity=0.5):
+        """
+        Returns up to `limit` venues whose name contains the keyword, best matches first:
+        exact name, name prefix, word prefix, substring. When no name contains the keyword and
+        fuzzy is on, names sharing enough trigrams with it to be a likely typo are returned
+        instead, closest first. Each venue gets a 'Match' column.
+        City is compared case-insensitively; capacity and price bounds are inclusive.
+        """
+        keyword = ' '.join(fold(keyword).split())
+        city = fold(city) if city else None
+        filters = (city, min_capacity, max_capacity, min_price, max_price)
+        with self._lock:
+            if not keyword:
+                return self._browse(filters, limit)
+
+            ranked = {}  # slot -> (kind, similarity)
+            # Exact and prefix matches rank first and come straight off the sorted names
+            position = bisect.bisect_left(self._sorted, (keyword,))
+            while position < len(self._sorted) and len(ranked) < limit:
+                folded, slot = self._sorted[position]
+                if not folded.startswith(keyword):
+                    break
+                if self._matches(slot, *filters):
+                    ranked[slot] = (EXACT if folded == keyword else PREFIX, 1.0)
+                position += 1
+            if len(ranked) >= limit:
+                return [dict(self._venues[slot], Match=MATCH_NAMES[kind]) for slot, (kind, _) in ranked.items()]
+
+            # Every name containing the keyword contains its rarest trigram, so only that posting is checked
+            grams = keyword_trigrams(keyword)
+            rarest = min((self._postings.get(gram, ()) for gram in grams), key=len)
+            for slot in rarest:
+                if slot in ranked:
+                    continue
+                kind = self._kind(self._folded[slot], keyword)
+                if kind is not None and self._matches(slot, *filters):
+                    ranked[slot] = (kind, 1.0)
+            if len(keyword) < 3:
+                # Inside a word such a keyword has no trigram to look up, so the names are scanned in order
+                # for it, as LIKE '%keyword%' would; the first `limit` of them are all that can rank
+                found = 0
+                for folded, slot in self._sorted:
+                    if found >= limit:
+                        break
+                    if slot not in ranked and keyword in folded and self._matches(slot, *filters):
+                        ranked[slot] = (self._kind(folded, keyword), 1.0)
+                        found += 1
+
+            if fuzzy and not ranked and len(keyword) >= 3:
+                # Nothing contains the keyword, so look for typos: names containing at least min_similarity of the keyword's trigrams
+                # (out of the trigrams rare enough to count; a typo usually creates trigrams no name has)
+                fuzzy_grams = [gram for gram in name_trigrams(keyword)
+                               if len(self._postings.get(gram, ())) <= self.max_fuzzy_posting]
+                shared = Counter()
+                for gram in fuzzy_grams:
+                    shared.update(self._postings.get(gram, ()))
+                for slot, common in shared.items():
+                    if slot in ranked:
+                        continue
+                    similarity = common / len(fuzzy_grams)
+                    if similarity >= min_similarity and self._matches(slot, *filters):
+                        ranked[slot] = (FUZZY, similarity)
+
+            best = heapq.nsmallest(limit, ranked.items(),
+                                   key=lambda item: (item[1][0], -item[1][1], self._folded[item[0]]))
+            return [dict(self._venues[slot], Match=MATCH_NAMES[kind]) for slot, (kind, _) in best]
+
+    # No keyword: the first venues by name that pass the filters
+    def _browse(self, filters, limit):
+        city = filters[0]
+        if city is not None:
+            matching = (slot for slot in self._cities.get(city, ()) if self._matches(slot, *filters))
+            slots = heapq.nsmallest(limit, matching, key=lambda slot: self._folded[slot])
+        else:
+            slots = []
+            for _, slot in self._sorted:
+                if self._matches(slot, *filters):
+                    slots.append(slot)
+                    if len(slots) >= limit:
+                        break
+        return [dict(self._venues[slot], Match='') for slot in slots]
+
+    def snapshot(self):
+        with self._lock:
+            return {'venues': len(self._slots), 'slots': len(self._venues), 'trigrams': len(self._postings),
+                    'age_seconds': round(time.monotonic() - self.loaded_at, 1) if self.loaded_at else None}
+
+
+# One index per process, shared by every Streamlit session and rerun
+venue_search = VenueSearchIndex()
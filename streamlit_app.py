@@ -1,176 +1,334 @@
+import os
+import sys
+import time
+import uuid
+import functools
 import streamlit as st
-import pymysql
 import pandas as pd
-import hashlib
+import plotly.express as px
 from datetime import datetime, timedelta
 
-# Updated connect_to_db function to use Streamlit secrets for database credentials
-def connect_to_db(db_name=None):
-    # Define the list of database keys
-    db_keys = ['EventManager1', 'EventManager2']
-    connections = {}
-    try:
-        for key in db_keys:
-            params = st.secrets[key]  # Fetching connection parameters from secrets
-            connection = pymysql.connect(
-                host=params['host'],
-                user=params['user'],
-                password=params['password'],
-                database=params['database'],
-                charset='utf8mb4',
-                cursorclass=pymysql.cursors.DictCursor
-            )
-            connections[key] = connection
-        if db_name:
-            return connections[db_name]
-        return connections
-    except Exception as e:
-        st.error(f"Failed to connect to database: {str(e)}")
+# Shared modules live next to the command line scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Functions'))
+from shard_pool import pool_stats
+from replicas import get_replica_router
+from shard_router import load_router
+from shard_config import SHARD_MAP as DEFAULT_SHARD_MAP
+from venue_cache import venue_cache
+from venue_search import venue_search
+from pagination import KeysetPager, Page
+from analytics import load_booking_frame, utilization_heatmap, peak_slots
+from booking import BOOKED, CONFLICT
+from import_venues import parse_venue
+from db_metrics import metrics, begin_scope, end_scope, start_metrics_server
+from async_data import AsyncData, SyncData
+from shard_query import QueryStream, QueryError, is_select, run_write
+from resilience import breaker_stats
+
+# Shards are listed in the [shard_map] secrets table; every shard name must also have its own secrets entry
+router = load_router(st.secrets.get('shard_map', DEFAULT_SHARD_MAP))
+DB_KEYS = router.shards
+SHARD_TIMEOUT = 5.0  # deadline of each read; cross-shard reads return partial results when a shard misses it
+WRITE_TIMEOUT = 30.0  # deadline of each write to a venue's primary
+MASS_ADD_CHUNK_SIZE = 1000  # venues per multi-row upsert in mass_add_venues
+PAGE_SIZE = 50  # rows per page in search results, listings and venue dropdowns
+LIST_TTL = 60.0  # seconds a session reuses the cities and dropdown names it loaded
+CATALOG_RETRY = 30.0  # seconds between attempts to reload a stale search index; searches use the shards meanwhile
+RENDER_BUDGET_MS = float(st.secrets.get('render_budget_ms', 500))  # reruns and sections slower than this are logged
+
+# Count the DB round trips of this rerun; the summary is logged at the end of the script
+rerun_scope = begin_scope('rerun', nested=False)
+if 'metrics_port' in st.secrets:
+    start_metrics_server(int(st.secrets['metrics_port']))
+
+# Borrow a pooled connection to one shard, configured from the Streamlit secrets entry of the same name.
+# The pools live in an imported module, so they survive reruns and connections are reused between them.
+# A shard's entry may list read replicas ([[EventManager1.replicas]] tables with host / port overrides):
+# reads then go to them, except for a few seconds after this session has written. A scan slower than usual
+# on one replica is also sent to the next one (or the primary) and the first answer is used.
+replica_router = get_replica_router('app', {db_name: st.secrets[db_name] for db_name in DB_KEYS},
+                                    policy=st.secrets.get('replica_policy', 'round_robin'),
+                                    max_lag=float(st.secrets.get('replica_max_lag', 5.0)),
+                                    hedge_after=float(st.secrets.get('replica_hedge_ms', 100)) / 1000)
+session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+
+def connect_to_db(db_name):
+    return replica_router.primary(db_name)
+
+def read_from_db(db_name):
+    return replica_router.read(db_name, session_id)
+
+def hedged_read(db_name, work):
+    return replica_router.hedged_read(db_name, work, session_id)
+
+# Database work runs as coroutines on a background event loop; `data` blocks until they finish, and
+# data.gather(...) runs several of `aio`'s coroutines at once so independent reads overlap.
+aio = AsyncData(connect_to_db, DB_KEYS, router, timeout=SHARD_TIMEOUT, read_connect=read_from_db,
+                on_write=lambda: replica_router.note_write(session_id), hedge=hedged_read, write_timeout=WRITE_TIMEOUT)
+data = SyncData(aio)
+
+def log_scope(summary):
+    print(f"{summary['scope']}: {summary['round_trips']} round trips, {summary['db_ms']} ms in the database, "
+          f"{summary['acquire_ms']} ms acquiring connections, {summary['wall_ms']} ms total")
+    if summary['wall_ms'] > RENDER_BUDGET_MS:
+        print(f"{summary['scope']}: over the {RENDER_BUDGET_MS:.0f} ms render budget")
+
+# Every section of the page is a fragment: interacting with its widgets reruns only that section, not the
+# script, so the other sections issue no queries. Each run of a section is logged like a rerun.
+def section(name):
+    def decorate(render):
+        @st.fragment
+        @functools.wraps(render)
+        def run(*args, **kwargs):
+            scope = begin_scope(name)
+            try:
+                render(*args, **kwargs)
+            finally:
+                log_scope(end_scope(scope))
+        return run
+    return decorate
+
+# Cities and dropdown names are kept in the session for LIST_TTL seconds, so the reruns of a section reuse
+# them. signature identifies what was loaded (such as the typed filter); this session's venue writes clear them.
+def cached_list(key, signature=None):
+    saved = st.session_state.get(f'{key}_list')
+    if saved is not None and saved[0] == signature and time.monotonic() - saved[1] < LIST_TTL:
+        return saved[2]
+    return None
+
+def cache_list(key, signature, values):
+    st.session_state[f'{key}_list'] = (signature, time.monotonic(), values)
 
-# Function to choose the database based on hash of the input string
-def choose_database(input_string):
-    hash_object = hashlib.sha256(input_string.encode())
-    hash_digest = hash_object.hexdigest()
-    return 'EventManager1' if int(hash_digest, 16) % 2 == 0 else 'EventManager2'
+def forget_lists():
+    for key in [key for key in st.session_state if key.endswith('_list')]:
+        del st.session_state[key]
 
 def add_venue(venue_name, city, capacity, price_per_hour):
-    db_name = choose_database(venue_name)
-    connection = connect_to_db(db_name)
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT ID FROM Venues WHERE Name = %s", (venue_name,))
-            if cursor.fetchone() is None:
-                cursor.execute(
-                    "INSERT INTO Venues (Name, City, Capacity, Price_per_hour) VALUES (%s, %s, %s, %s)",
-                    (venue_name, city, capacity, price_per_hour)
-                )
-                connection.commit()
-                st.success(f"Venue '{venue_name}' added successfully.")
-            else:
-                st.warning(f"Venue '{venue_name}' already exists.")
+        venue = data.add_venue(venue_name, city, capacity, price_per_hour)
+        if venue:
+            venue_cache.put(venue)
+            venue_search.put(venue)
+            st.success(f"Venue '{venue_name}' added successfully.")
+        else:
+            st.warning(f"Venue '{venue_name}' already exists.")
     except Exception as e:
         st.error(f"An error occurred while adding the venue: {str(e)}")
-    finally:
-        if connection:
-            connection.close()
 
-def create_booking(client_name, date, start_time, end_time, venue_name):
-    db_name = choose_database(venue_name)
-    connection = connect_to_db(db_name)
+# Overlap check and insert run in one locked transaction, so a stale "available" result cannot double-book
+def create_booking(client_name, date, start_time, end_time, venue_name, venue_id=None):
     try:
-        with connection.cursor() as cursor:
-            # Ensure we are fetching the venue ID correctly
-            cursor.execute("SELECT ID FROM Venues WHERE LOWER(Name) = LOWER(%s)", (venue_name,))
-            venue_result = cursor.fetchone()
-            if venue_result:
-                venue_id = venue_result['ID']
-                cursor.execute(
-                    "INSERT INTO Bookings (Client_name, Date, Start_time, End_time) VALUES (%s, %s, %s, %s)",
-                    (client_name, date, start_time, end_time)
-                )
-                booking_id = cursor.lastrowid
-                cursor.execute(
-                    "INSERT INTO VenueUsed (VenueID, BookingID) VALUES (%s, %s)",
-                    (venue_id, booking_id)
-                )
-                connection.commit()
-                st.success(f"Booking for '{client_name}' at '{venue_name}' has been successfully created for {date} from {start_time} to {end_time}.")
-            else:
-                st.error(f"Venue '{venue_name}' does not exist.")
+        status, booking_id = data.create_booking(client_name, date, start_time, end_time, venue_name, venue_id)
+        if status == BOOKED:
+            st.success(f"Booking for '{client_name}' at '{venue_name}' has been successfully created for {date} from {start_time} to {end_time}.")
+        elif status == CONFLICT:
+            st.error(f"Venue '{venue_name}' was booked by someone else for the requested time. Please choose another time.")
+        else:
+            st.error(f"Venue '{venue_name}' does not exist.")
+        return status == BOOKED
     except Exception as e:
         st.error(f"An error occurred during booking: {str(e)}")
-    finally:
-        if connection:
-            connection.close()
+        return False
 
-def find_venue(search_keyword, city):
-    connections = connect_to_db()  # Gets connections for both databases
-    results = []
+# Surface shards that failed or timed out while still showing the rows from the others
+def report_shard_errors(result, action):
+    for db_name, error in result.errors.items():
+        st.warning(f"{db_name} did not answer while {action}, results may be incomplete: {error}")
+
+# Search the in-process trigram index built from the venue catalog, one page at a time. While the catalog
+# cannot be loaded from every shard, fall back to a keyset-paginated LIKE query on the shards; a stale index
+# is reloaded by one search per CATALOG_RETRY seconds, not by every search.
+def find_venue(search_keyword, city, min_capacity=None, max_price=None, page_number=0):
+    if city == 'All':
+        city = None
+    if not venue_search.is_fresh() and venue_search.claim_reload(CATALOG_RETRY):
+        load_venue_catalog()
+    if venue_search.is_fresh():
+        end = (page_number + 1) * PAGE_SIZE
+        rows = venue_search.search(search_keyword, city=city, min_capacity=min_capacity, max_price=max_price,
+                                   limit=end + 1)
+        return Page(page_number, rows[page_number * PAGE_SIZE:end], len(rows) > end, {})
+
+    conditions = ["Name LIKE %s"]
+    params = ['%' + search_keyword + '%']
+    if city:
+        conditions.append("City = %s")
+        params.append(city)
+    if min_capacity:
+        conditions.append("Capacity >= %s")
+        params.append(min_capacity)
+    if max_price:
+        conditions.append("Price_per_hour <= %s")
+        params.append(max_price)
+    page = data.find_venue(" AND ".join(conditions), params, page_number, PAGE_SIZE)
+    report_shard_errors(page, "searching for venues")
+    return page
+
+# One keyset pager per listing and filter, kept in the session so its page bookmarks survive reruns
+def get_pager(key, select, where=None, params=(), shard_column=None):
+    signature = (select, where, tuple(params))
+    saved = st.session_state.get(f'{key}_pager')
+    if saved is None or saved[0] != signature:
+        saved = (signature, KeysetPager(read_from_db, DB_KEYS, select, 'Name', where, params, page_size=PAGE_SIZE,
+                                        timeout=SHARD_TIMEOUT, shard_column=shard_column, hedge=hedged_read))
+        st.session_state[f'{key}_pager'] = saved
+    return saved[1]
+
+def reset_page(key):
+    st.session_state[f'{key}_page'] = 0
+
+# Show one page of a listing with Previous / Next buttons; fetch_page(number) returns a Page
+def paged_table(key, fetch_page, empty_message):
     try:
-        for db_name, connection in connections.items():
-            if connection:
-                with connection.cursor() as cursor:
-                    query = "SELECT Name, City, Capacity, Price_per_hour FROM Venues WHERE Name LIKE %s"
-                    params = ['%' + search_keyword + '%']
-
-                    if city and city != 'All':
-                        query += " AND City = %s"
-                        params.append(city)
-
-                    cursor.execute(query, params)
-                    results.extend(cursor.fetchall())
-                connection.close()
+        page = fetch_page(st.session_state.get(f'{key}_page', 0))
     except Exception as e:
-        st.error(f"An error occurred while searching for venues: {str(e)}")
-    
-    if results:
-        return pd.DataFrame(results)
-    else:
-        st.info("No venues found matching the search criteria.")
-        return pd.DataFrame()
-
-def get_cities():
-    connections = connect_to_db()  # This will get connections to both databases
-    cities = set()  # Use a set to avoid duplicate city entries
+        st.error(f"An error occurred while loading the results: {str(e)}")
+        return
+    if not page.rows:
+        st.info(empty_message)
+        return
+    st.dataframe(pd.DataFrame(page.rows))
+    previous_column, label_column, next_column = st.columns(3)
+    if previous_column.button('Previous', key=f'{key}_previous', disabled=page.number == 0):
+        st.session_state[f'{key}_page'] = page.number - 1
+        st.rerun(scope='fragment')
+    label_column.write(f"Page {page.number + 1}")
+    if next_column.button('Next', key=f'{key}_next', disabled=not page.has_next):
+        st.session_state[f'{key}_page'] = page.number + 1
+        st.rerun(scope='fragment')
+
+# Searchable venue dropdown: only the first matches for the typed text are loaded, never the whole catalog,
+# and they are loaded again only when the text changes. Returns the chosen (ID, Name), or (None, None).
+def venue_picker(label, key):
+    typed = st.text_input(f'{label} (type to search)', key=f'{key}_filter')
+    names = []
     try:
-        for db_name, connection in connections.items():
-            if connection:
-                with connection.cursor() as cursor:
-                    cursor.execute("SELECT DISTINCT City FROM Venues ORDER BY City")
-                    cities.update(row['City'] for row in cursor.fetchall())
-                connection.close()
+        if venue_search.is_fresh():
+            names = [(venue.get('ID'), venue['Name']) for venue in venue_search.search(typed, limit=PAGE_SIZE, fuzzy=False)]
+        elif cached_list(key, typed) is not None:
+            names = cached_list(key, typed)
+        else:
+            page = data.venue_names(typed, PAGE_SIZE)
+            report_shard_errors(page, "listing venues")
+            names = page.rows
+            if not page.partial:
+                cache_list(key, typed, names)
     except Exception as e:
-        st.error(f"Failed to fetch cities: {str(e)}")
-    return list(sorted(cities))
+        st.error(f"Failed to fetch venues: {str(e)}")
+    return st.selectbox(label, names, key=key, format_func=lambda option: option[1]) or (None, None)
+
+# Load the whole venue catalog from every shard in one parallel scan and cache it.
+# A load with missing shards is returned to the caller but not cached.
+def load_venue_catalog():
+    return use_catalog(data.get_all_venues())
+
+# Report and cache a catalog scan, returning its rows
+def use_catalog(result):
+    report_shard_errors(result, "loading the venue catalog")
+    if not result.partial:
+        venue_cache.load(result.rows)
+        venue_search.load(result.rows)
+    return result.rows
+
+def get_cities():
+    cities = venue_cache.cities()  # Served from the catalog cache while it is warm
+    if cities is None:
+        cities = cached_list('cities')
+    if cities is None:
+        cities = []
+        try:
+            # Only the distinct cities are read, which the City index answers without touching the venues
+            result = data.get_cities()
+            report_shard_errors(result, "loading cities")
+            cities = [row['City'] for row in result.rows]
+            if not result.partial:
+                cache_list('cities', None, cities)
+        except Exception as e:
+            st.error(f"Failed to fetch cities: {str(e)}")
+    return cities
 
 def get_all_venues():
-    connections = connect_to_db()  # Make sure this returns a proper connection object
-    venues = set()
+    venues = venue_cache.names()  # Served from the catalog cache while it is warm
+    if venues is None:
+        venues = []
+        try:
+            venues = [venue['Name'] for venue in load_venue_catalog()]
+        except Exception as e:
+            st.error(f"Failed to fetch venues: {str(e)}")
+    return venues
+
+def check_availability(venue_name, date, start_time, end_time, venue_id=None):
     try:
-        for db_name, connection in connections.items():
-            if connection:
-                with connection.cursor() as cursor:
-                    cursor.execute("SELECT DISTINCT Name FROM Venues ORDER BY Name")
-                    venues.update(row['Name'] for row in cursor.fetchall())
-                    connection.close()  # Close the connection properly
+        return data.check_availability(venue_name, date, start_time, end_time, venue_id)
     except Exception as e:
-        st.error(f"Failed to fetch venues: {str(e)}")
-    return list(sorted(venues))
-
-def check_availability(venue_name, date, start_time, end_time):
-    db_name = choose_database(venue_name)
-    connection = connect_to_db(db_name)
-    if connection is None:
-        st.error("Failed to connect to the database.")
+        st.error(f"An error occurred while checking availability: {str(e)}")
         return False
 
+# Look up one venue from the catalog cache, or with a single query on its shard (by primary key given its ID)
+def get_venue_details(venue_name, venue_id=None):
+    venue = venue_cache.get(venue_name)
+    if venue is None:
+        venue = data.get_venue(venue_name, venue_id)
+        if venue:
+            venue_cache.put(venue)
+    return venue
+
+def get_venue_hourly_rate(venue_name, venue_id=None):
     try:
-        with connection.cursor() as cursor:
-            query = """
-            SELECT COUNT(*) FROM Bookings
-            JOIN VenueUsed ON Bookings.ID = VenueUsed.BookingID
-            JOIN Venues ON VenueUsed.VenueID = Venues.ID
-            WHERE Venues.Name = %s AND Bookings.Date = %s AND 
-            NOT (%s >= Bookings.End_time OR %s <= Bookings.Start_time)
-            """
-            cursor.execute(query, (venue_name, date, start_time, end_time))
-            overlapping_count = cursor.fetchone()['COUNT(*)']
-            return overlapping_count == 0
+        venue = get_venue_details(venue_name, venue_id)
+        if venue:
+            return venue['Price_per_hour']
     except Exception as e:
-        st.error(f"An error occurred while checking availability: {str(e)}")
-        return False
-    finally:
-        if connection:
-            connection.close()
-
-def get_venue_hourly_rate(venue_name):
-    # Fetch all venues that match the venue_name (assuming exact match isn't necessary)
-    venue_details = find_venue(venue_name, "")
-    if not venue_details.empty:
-        # Assuming the venue name is unique and we take the first match
-        return venue_details.iloc[0]['Price_per_hour']
+        st.error(f"Failed to fetch the hourly rate: {str(e)}")
     return 0
 
+# Bookings for a date range loaded once into an in-memory interval index, queried only on the shards involved
+def get_availability_index(start_date, end_date, venue_names=None):
+    index, result = data.availability(start_date, end_date, venue_names)
+    report_shard_errors(result, "loading bookings")
+    return index
+
+def availability_grid(venue_name, date, start_time, end_time, time_options):
+    # Hourly slots between consecutive time options, e.g. 1 PM - 2 PM
+    slots = list(zip(time_options[:-1], time_options[1:]))
+    with st.expander('Availability Grid'):
+        grid_days = st.slider('Days to show', min_value=1, max_value=60, value=14, key='grid_days')
+        if st.button('Show Free Slots', key='grid_show'):
+            try:
+                last_day = date + timedelta(days=grid_days - 1)
+                index = get_availability_index(date, last_day, [venue_name])
+                free = set(index.free_slots(venue_name, date, last_day, slots))
+                days = [date + timedelta(days=offset) for offset in range(grid_days)]
+                grid = pd.DataFrame(
+                    [['Free' if (day, start, end) in free else 'Booked' for start, end in slots] for day in days],
+                    index=[day.strftime('%a %Y-%m-%d') for day in days],
+                    columns=[start.strftime('%I %p') for start, _ in slots])
+                st.write(f"Free slots for '{venue_name}'")
+                st.dataframe(grid)
+            except Exception as e:
+                st.error(f"An error occurred while loading availability: {str(e)}")
+        if st.button('Venues Free at Selected Time', key='grid_free_venues'):
+            try:
+                # The day's bookings and (on a cold cache) the catalog are read at the same time
+                reads = {'bookings': aio.availability(date, date)}
+                if venue_cache.names() is None:
+                    reads['catalog'] = aio.get_all_venues()
+                reads = data.gather(**reads)
+                for result in reads.values():
+                    if isinstance(result, Exception):
+                        raise result
+                index, result = reads['bookings']
+                report_shard_errors(result, "loading bookings")
+                venues = [venue['Name'] for venue in use_catalog(reads['catalog'])] if 'catalog' in reads else get_all_venues()
+                free_venues = index.free_venues(venues, date, start_time, end_time)
+                st.write(f"{len(free_venues)} venues are free on {date} from {start_time.strftime('%I:%M %p')} to {end_time.strftime('%I:%M %p')}")
+                st.dataframe(pd.DataFrame({'Venue': free_venues}))
+            except Exception as e:
+                st.error(f"An error occurred while loading availability: {str(e)}")
+
+# Changing the date, times or filter text reruns only this section; while the dropdown's names are cached
+# that issues no queries at all
+@section('booking')
 def create_booking_tab():
     st.header('Create a Booking')
 
@@ -193,21 +351,23 @@ def create_booking_tab():
         st.error('End time must be later than start time.')
         return  # Early return to prevent further processing
 
-    # Venue selection from a dropdown list of available venues
-    all_venues = get_all_venues()  # Fetch the list of venues from your function
-    venue_name = st.selectbox('Select a Venue', all_venues, key='venue_select_book')
+    # Venue selection from a searchable dropdown
+    venue_id, venue_name = venue_picker('Select a Venue', 'venue_select_book')
+
+    if venue_name:
+        availability_grid(venue_name, date, start_time, end_time, time_options)
 
     # Check venue availability
     if st.button('Check Availability'):
         formatted_start_time = start_time.strftime('%H:%M:%S')
         formatted_end_time = end_time.strftime('%H:%M:%S')
-        available = check_availability(venue_name, date, formatted_start_time, formatted_end_time)
+        available = check_availability(venue_name, date, formatted_start_time, formatted_end_time, venue_id)
         if available:
             st.success('The venue is available for booking.')
-            hourly_rate = get_venue_hourly_rate(venue_name)  # Fetch the hourly rate
+            hourly_rate = get_venue_hourly_rate(venue_name, venue_id)  # Fetch the hourly rate
             hours_diff = (end_time.hour - start_time.hour) + ((end_time.minute - start_time.minute) / 60)
             total_cost = float(hourly_rate) * hours_diff
-            st.session_state['booking_details'] = (venue_name, date, formatted_start_time, formatted_end_time, total_cost)
+            st.session_state['booking_details'] = (venue_id, venue_name, date, formatted_start_time, formatted_end_time, total_cost)
             st.session_state['create_enabled'] = True
             st.write(f"Estimated total cost: ${total_cost:.2f}")
         else:
@@ -218,134 +378,189 @@ def create_booking_tab():
     if st.session_state.get('create_enabled', False):
         client_name = st.text_input('Client Name', key='client_name_book')
         if st.button('Confirm Booking'):
-            venue_name, date, formatted_start_time, formatted_end_time, total_cost = st.session_state['booking_details']
+            venue_id, venue_name, date, formatted_start_time, formatted_end_time, total_cost = st.session_state['booking_details']
             # st.write(f"Debug: Venue Name - '{venue_name}'")  # Debug print to check the actual venue name being used
-            create_booking(client_name, date, formatted_start_time, formatted_end_time, venue_name)
-            st.write(f"The total cost of the booking was: ${total_cost:.2f}")
+            if create_booking(client_name, date, formatted_start_time, formatted_end_time, venue_name, venue_id):
+                st.write(f"The total cost of the booking was: ${total_cost:.2f}")
             del st.session_state['create_enabled']
             del st.session_state['booking_details']
 
-def update_venue(venue_name, new_city=None, new_capacity=None, new_price_per_hour=None):
+# Revenue and busiest venues come from the daily rollups of every shard. The hourly heatmap and peak slots
+# need the bookings themselves, so they are only computed on request.
+@section('analytics')
+def analytics_tab():
+    st.header('Revenue and Utilization')
+    today = datetime.today().date()
+    date_range = st.date_input('Date Range', value=(today - timedelta(days=30), today), key='analytics_range')
+    if len(date_range) != 2:
+        st.info('Choose a start and an end date.')
+        return
+    first, last = date_range
+
+    # The rollup totals are kept in the session until the range changes or they are refreshed
+    saved = st.session_state.get('rollup_dashboard')
+    if st.button('Refresh Dashboard') or saved is None or saved[0] != (first, last):
+        try:
+            by_city, by_day, busiest = data.dashboard(first, last, limit=PAGE_SIZE)
+            for result in (by_city, by_day, busiest):
+                report_shard_errors(result, "loading the booking rollups")
+            saved = ((first, last), by_city.rows, by_day.rows, busiest.rows)
+            st.session_state['rollup_dashboard'] = saved
+        except Exception as e:
+            st.error(f"An error occurred while loading the dashboard: {str(e)}")
+            return
+    _, city_rows, day_rows, busiest_rows = saved
+
+    if not day_rows:
+        st.info("No bookings in this date range.")
+    else:
+        st.write(f"{sum(row['Bookings'] for row in day_rows)} bookings, "
+                 f"${sum(row['Revenue'] for row in day_rows):,.2f} revenue")
+        st.plotly_chart(px.bar(pd.DataFrame(city_rows), x='City', y='Revenue', title='Revenue per City'))
+        st.plotly_chart(px.line(pd.DataFrame(day_rows), x='Date', y='Revenue', title='Revenue per Day'))
+        st.subheader('Busiest Venues')
+        busiest = pd.DataFrame(busiest_rows)
+        busiest['Hours'] = busiest['Booked_minutes'].astype(float) / 60
+        st.dataframe(busiest[['Name', 'City', 'Bookings', 'Hours', 'Revenue', 'Shard']])
+
+    with st.expander('Hourly Breakdown'):
+        if st.button('Compute Hourly Breakdown'):
+            try:
+                frame = load_booking_frame(read_from_db, DB_KEYS, first, last)
+                report_shard_errors(frame, "loading bookings for analytics")
+                # Only the aggregates are kept in the session, not the bookings themselves
+                st.session_state['hourly_analytics'] = (len(frame.bookings), frame.seconds,
+                                                        utilization_heatmap(frame), peak_slots(frame))
+            except Exception as e:
+                st.error(f"An error occurred while computing analytics: {str(e)}")
+        if 'hourly_analytics' in st.session_state:
+            booking_count, seconds, heatmap, peaks = st.session_state['hourly_analytics']
+            st.write(f"{booking_count} bookings loaded in {seconds:.1f}s")
+            st.plotly_chart(px.imshow(heatmap, color_continuous_scale='Blues', aspect='auto', zmin=0,
+                                      labels={'color': 'Utilization'}, title='Share of Venue Hours Booked'))
+            st.subheader('Peak Slots')
+            st.dataframe(peaks)
+
+def update_venue(venue_name, new_city=None, new_capacity=None, new_price_per_hour=None, venue_id=None):
     try:
-        # Determine which DB the venue belongs to
-        db_name = choose_database(venue_name)
-        connection = connect_to_db(db_name)  # Connect to the appropriate DB
-        with connection.cursor() as cursor:
-            # Fetch the venue first to make sure it exists
-            cursor.execute("SELECT ID FROM Venues WHERE Name = %s", (venue_name,))
-            venue = cursor.fetchone()
-            if venue:
-                updates = []
-                parameters = []
-                if new_city:
-                    updates.append("City = %s")
-                    parameters.append(new_city)
-                if new_capacity:
-                    updates.append("Capacity = %s")
-                    parameters.append(new_capacity)
-                if new_price_per_hour:
-                    updates.append("Price_per_hour = %s")
-                    parameters.append(new_price_per_hour)
-
-                if updates:
-                    sql = "UPDATE Venues SET " + ", ".join(updates) + " WHERE Name = %s"
-                    parameters.append(venue_name)
-                    cursor.execute(sql, parameters)
-                    connection.commit()
-                    st.success(f"Venue '{venue_name}' updated successfully.")
-                else:
-                    st.error("No updates provided.")
-            else:
-                st.error("Venue not found.")
+        venue = data.update_venue(venue_name, new_city, new_capacity, new_price_per_hour, venue_id)
+        if venue:
+            venue_cache.invalidate([venue_name])
+            venue_search.put(venue)
+            forget_lists()
+            st.success(f"Venue '{venue_name}' updated successfully.")
+        else:
+            st.error("Venue not found.")
+    except ValueError as e:
+        st.error(str(e))
     except Exception as e:
         st.error(f"An error occurred while updating the venue: {str(e)}")
-    finally:
-        if connection:
-            connection.close()
 
-def delete_venue(venue_name):
+def delete_venue(venue_name, venue_id=None):
     try:
-        db_name = choose_database(venue_name)
-        connection = connect_to_db(db_name)
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT ID FROM Venues WHERE Name = %s", (venue_name,))
-            venue = cursor.fetchone()
-            if venue:
-                # First delete referencing records in VenueUsed
-                cursor.execute("DELETE FROM VenueUsed WHERE VenueID = %s", (venue['ID'],))
-                # Now delete the venue
-                cursor.execute("DELETE FROM Venues WHERE Name = %s", (venue_name,))
-                connection.commit()
-                st.success(f"Venue '{venue_name}' and all associated records deleted successfully.")
-            else:
-                st.error("Venue not found.")
+        deleted = data.delete_venue(venue_name, venue_id=venue_id)
+        if deleted is not None:
+            venue_cache.invalidate([venue_name])
+            venue_search.remove(venue_name)
+            forget_lists()
+            st.success(f"Venue '{venue_name}' and its {deleted} bookings deleted successfully.")
+        else:
+            st.error("Venue not found.")
     except Exception as e:
         st.error(f"An error occurred while deleting the venue: {str(e)}")
-    finally:
-        if connection:
-            connection.close()
 
 def mass_add_venues(venues):
     """
     Accepts a list of dictionaries, each representing a venue with keys:
     'venue_name', 'city', 'capacity', 'price_per_hour'
+    Existing venues with the same name are updated instead of duplicated.
+    Returns a message per database.
     """
-    # Group venues by target database based on the hash of the venue_name
-    db_venues = {'EventManager1': [], 'EventManager2': []}
-    for venue in venues:
-        db_name = choose_database(venue['venue_name'])
-        db_venues[db_name].append(venue)
+    # Group venues by the shard holding each venue_name: its ring owner, or its previous owner during a
+    # resharding if the venue has not been moved yet, so an existing venue is updated instead of copied
+    names = [(venue.get('venue_name') or '').strip() for venue in venues]
+    try:
+        shard_of = data.locate_many(names)
+    except Exception as e:
+        return {db_name: f"Failed to add venues to {db_name}: {str(e)}" for db_name in DB_KEYS}
+    db_venues = {db_name: [] for db_name in DB_KEYS}
+    for name, venue in zip(names, venues):
+        db_venues[shard_of[name]].append(venue)
 
-    # Connect to each database and perform the inserts
+    # Every database upserts its venues in chunks, all databases at the same time
     results = {}
+    rows_by_shard = {}
     for db_name, venues_list in db_venues.items():
-        if venues_list:  # Only connect if there are venues to add
-            connection = connect_to_db(db_name)
-            try:
-                with connection.cursor() as cursor:
-                    # Prepare batch insert query
-                    insert_query = "INSERT INTO Venues (Name, City, Capacity, Price_per_hour) VALUES (%s, %s, %s, %s)"
-                    # Prepare values to be inserted
-                    insert_values = [(v['venue_name'], v['city'], v['capacity'], v['price_per_hour']) for v in venues_list]
-                    # Execute the batch insertion
-                    cursor.executemany(insert_query, insert_values)
-                    connection.commit()
-                    results[db_name] = f"{len(venues_list)} venues added successfully to {db_name}."
-            except Exception as e:
-                results[db_name] = f"Failed to add venues to {db_name}: {str(e)}"
-            finally:
-                if connection:
-                    connection.close()
-
-
-def execute_custom_query(sql_query):
-    db_keys = ['EventManager1', 'EventManager2']  # The keys for both databases
-    results = {}
-
-    for db_name in db_keys:
-        connection = connect_to_db(db_name)
         try:
-            with connection.cursor() as cursor:
-                cursor.execute(sql_query)
-                connection.commit()
-                results[db_name] = f"Query executed successfully on {db_name}."
+            rows_by_shard[db_name] = [parse_venue(v) for v in venues_list]
         except Exception as e:
-            results[db_name] = f"An error occurred on {db_name}: {str(e)}"
-        finally:
-            if connection:
-                connection.close()
-
+            results[db_name] = f"Failed to add venues to {db_name}: {str(e)}"
+    for db_name, outcome in data.mass_add_venues(rows_by_shard, MASS_ADD_CHUNK_SIZE).items():
+        if isinstance(outcome, Exception):
+            results[db_name] = f"Failed to add venues to {db_name}: {str(outcome)}"
+            continue
+        inserted, updated = outcome
+        for name, city, capacity, price_per_hour in rows_by_shard[db_name]:
+            venue_search.put({'Name': name, 'City': city, 'Capacity': capacity,
+                              'Price_per_hour': price_per_hour, 'Shard': db_name})
+        results[db_name] = f"{inserted} venues added and {updated} updated in {db_name}."
+    venue_cache.invalidate(names)
+    forget_lists()
     return results
 
+# Start the User page's cold reads together: the cities and the booking dropdown's names. The results go into
+# the session's lists, where the sections find them; a failed read is left for its section to retry and report.
+def prefetch_reads():
+    reads = {}
+    if venue_cache.cities() is None and cached_list('cities') is None:
+        reads['cities'] = aio.get_cities()
+    typed = st.session_state.get('venue_select_book_filter', '')
+    if not venue_search.is_fresh() and cached_list('venue_select_book', typed) is None:
+        reads['venue_select_book'] = aio.venue_names(typed, PAGE_SIZE)
+    results = data.gather(**reads) if reads else {}
+    cities = results.get('cities')
+    if cities is not None and not isinstance(cities, Exception) and not cities.partial:
+        cache_list('cities', None, [row['City'] for row in cities.rows])
+    names = results.get('venue_select_book')
+    if names is not None and not isinstance(names, Exception) and not names.partial:
+        cache_list('venue_select_book', typed, names.rows)
+
+
+# SELECTs run on every shard at once and their rows are shown as they stream in. Any other statement
+# needs write mode and is committed on every shard or none of them (two-phase commit).
+def execute_custom_query(sql_query, write_mode=False, max_rows=1000):
+    try:
+        if is_select(sql_query):
+            stream = QueryStream(read_from_db, DB_KEYS, sql_query, timeout=30.0, max_rows=max_rows, shard_column='Shard')
+            table = st.empty()
+            rows = []
+            for row in stream:
+                rows.append(row)
+                if len(rows) % 1000 == 0:
+                    table.dataframe(pd.DataFrame(rows))
+            table.dataframe(pd.DataFrame(rows))
+            report_shard_errors(stream, "running the query")
+            st.write(f"{len(rows)} rows" + (f", stopped at the {max_rows} row limit" if stream.truncated else ""))
+        elif not write_mode:
+            st.error("Only SELECT statements run in read-only mode. Switch on write mode to change data.")
+        else:
+            committed, rows, errors = run_write(connect_to_db, DB_KEYS, sql_query)
+            replica_router.note_write(session_id)
+            for db_name, error in errors.items():
+                st.error(f"{db_name}: {error}")
+            if committed:
+                st.success("Committed on every shard: " + ", ".join(f"{count} rows in {db_name}" for db_name, count in rows.items()))
+            else:
+                st.error("The statement was rolled back on every shard.")
+    except QueryError as e:
+        st.error(str(e))
+    except Exception as e:
+        st.error(f"An error occurred while running the query: {str(e)}")
 
-# Streamlit user interface for the application
-st.title('EventManager - Venue Booking Management System')
-
-# Using tabs for better organization
-tab1, tab2 = st.tabs(["User", "Admin"])
 
-# find venue
-with tab1:
+# Find-a-venue form and its paged results
+@section('find_venue')
+def find_venue_section():
     st.header('Find a Venue')
     
     cities = get_cities()  # Fetch list of cities from the databases
@@ -353,22 +568,22 @@ with tab1:
     with st.form("form_find_venue"):
         search_keyword = st.text_input('Keyword', key='keyword_find')
         location = st.selectbox('City', ['All'] + cities, key='location_find')
+        min_capacity = st.number_input('Minimum Capacity (optional)', min_value=1, format='%d', value=None, key='capacity_find')
+        max_price = st.number_input('Maximum Price Per Hour (optional)', min_value=0.0, format='%f', value=None, key='price_find')
         search_button = st.form_submit_button('Search Venues')
 
         if search_button:
-            results = find_venue(search_keyword, location)
-            if not results.empty:
-                st.dataframe(results)
-    
-    create_booking_tab()
+            st.session_state['find_criteria'] = (search_keyword, location, min_capacity, max_price)
+            reset_page('find_venue')
 
-    
-# Admin tab in Streamlit
-with tab2:
-    # Admin tab in Streamlit
-    st.header('Admin Dashboard')
-    admin_action = st.selectbox('Choose Action', ['Add Venue', 'Update Venue', 'Delete Venue'])
-    
+    # Results are paged, so a broad search never loads more than a page per shard
+    if 'find_criteria' in st.session_state:
+        paged_table('find_venue', lambda number: find_venue(*st.session_state['find_criteria'], page_number=number),
+                    "No venues found matching the search criteria.")
+
+# One admin action at a time; its forms and buttons rerun only this section
+@section('admin')
+def admin_section(admin_action):
     if admin_action == 'Add Venue':
         st.subheader('Add a Venue')
         with st.form("form_add_venue"):
@@ -382,20 +597,100 @@ with tab2:
     
     elif admin_action == 'Update Venue':
         st.subheader('Update a Venue')
-        venues = get_all_venues()
-        selected_venue = st.selectbox('Select a Venue to Update', venues)
+        venue_id, selected_venue = venue_picker('Select a Venue to Update', 'venue_update')
         with st.form("form_update_venue"):
             new_city = st.text_input('New City (optional)')
             new_capacity = st.number_input('New Capacity (optional)', min_value=1, format='%d', value=None)
             new_price_per_hour = st.number_input('New Price Per Hour (optional)', min_value=0.0, format='%f', value=None)
             update_button = st.form_submit_button('Update Venue')
             if update_button:
-                result = update_venue(selected_venue, new_city, new_capacity, new_price_per_hour)
+                result = update_venue(selected_venue, new_city, new_capacity, new_price_per_hour, venue_id)
     
     elif admin_action == 'Delete Venue':
         st.subheader('Delete a Venue')
-        venues = get_all_venues()
-        selected_venue = st.selectbox('Select a Venue to Delete', venues)
+        venue_id, selected_venue = venue_picker('Select a Venue to Delete', 'venue_delete')
         delete_button = st.button('Delete Venue')
         if delete_button:
-            result = delete_venue(selected_venue)
+            result = delete_venue(selected_venue, venue_id)
+
+    elif admin_action == 'Browse Venues':
+        st.subheader('Browse Venues')
+        browse_city = st.text_input('City (optional)', key='city_browse', on_change=reset_page, args=('browse_venues',))
+        where, params = ("City = %s", [browse_city]) if browse_city else (None, [])
+        pager = get_pager('browse_venues', "SELECT Name, City, Capacity, Price_per_hour FROM Venues", where, params,
+                          shard_column='Shard')
+        paged_table('browse_venues', pager.page, "No venues found.")
+
+    elif admin_action == 'Query Console':
+        st.subheader('Query Console')
+        sql_query = st.text_area('SQL', key='console_sql')
+        max_rows = st.number_input('Row limit', min_value=1, max_value=100000, value=1000, key='console_max_rows')
+        write_mode = st.checkbox('Write mode: run other statements on every shard with two-phase commit', key='console_write')
+        if st.button('Run Query', key='console_run'):
+            execute_custom_query(sql_query, write_mode, max_rows)
+
+    elif admin_action == 'Connection Pool Stats':
+        st.subheader('Connection Pool Stats')
+        stats = pool_stats()
+        if stats:
+            st.dataframe(pd.DataFrame.from_dict(stats, orient='index'))
+        else:
+            st.info("No connection pools have been opened yet.")
+        replica_stats = replica_router.snapshot()
+        if replica_stats:
+            st.subheader('Read Replicas')
+            st.dataframe(pd.DataFrame.from_dict(replica_stats, orient='index'))
+            st.subheader('Hedged Reads')
+            st.dataframe(pd.DataFrame.from_dict(replica_router.hedge_snapshot(), orient='index'))
+        breakers = breaker_stats()
+        if breakers:
+            st.subheader('Circuit Breakers')
+            st.dataframe(pd.DataFrame.from_dict(breakers, orient='index'))
+
+    elif admin_action == 'Venue Cache Stats':
+        st.subheader('Venue Cache Stats')
+        st.dataframe(pd.DataFrame([venue_cache.snapshot()]))
+        st.dataframe(pd.DataFrame([venue_search.snapshot()]))
+        if st.button('Clear Venue Cache'):
+            venue_cache.invalidate()
+            venue_search.invalidate()
+            forget_lists()
+
+
+# Streamlit user interface for the application
+st.title('EventManager - Venue Booking Management System')
+
+# Only the chosen page runs, so the others load nothing. Unlike tabs, whose contents all run on every rerun.
+page = st.radio('Page', ["User", "Admin", "Analytics"], horizontal=True, key='page', label_visibility='collapsed')
+
+if page == "User":
+    # Cold reads the User page needs, issued together so the rerun waits for the slowest instead of their sum
+    prefetch_reads()
+    find_venue_section()
+    create_booking_tab()
+
+elif page == "Admin":
+    st.header('Admin Dashboard')
+    admin_action = st.selectbox('Choose Action', ['Add Venue', 'Update Venue', 'Delete Venue', 'Browse Venues', 'Query Console', 'Connection Pool Stats', 'Venue Cache Stats'])
+    admin_section(admin_action)
+
+else:
+    analytics_tab()
+
+# Per-rerun DB summary, and a hidden metrics panel opened with ?admin=metrics
+log_scope(end_scope(rerun_scope))
+if st.query_params.get('admin') == 'metrics':
+    st.header('Database Metrics')
+    st.subheader('Statements')
+    statements = metrics.statement_table()
+    if statements:
+        st.dataframe(pd.DataFrame(statements).sort_values('total_ms', ascending=False))
+    st.subheader('Recent Reruns and Sections')
+    st.dataframe(pd.DataFrame(list(metrics.scopes)))
+    st.subheader(f'Slow Queries (over {metrics.slow_query_seconds * 1000:.0f} ms)')
+    if metrics.slow_queries:
+        st.dataframe(pd.DataFrame(list(metrics.slow_queries)))
+    with st.expander('Prometheus text'):
+        st.code(metrics.render_prometheus())
+    if st.button('Reset Metrics'):
+        metrics.reset()
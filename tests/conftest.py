@@ -0,0 +1,21 @@
+# IMPORT LIBRARIES
+import os
+import sys
+import pytest
+
+# The shared modules are imported by name, as the command line scripts and the Streamlit app do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Functions'))
+
+import shard_pool
+import resilience
+import global_ids
+
+
+# Pools, breakers and counter checks are process-wide; each test starts with none
+@pytest.fixture(autouse=True)
+def fresh_registries():
+    yield
+    shard_pool.close_all_pools()
+    with resilience._breakers_lock:
+        resilience._breakers.clear()
+    global_ids._checked.clear()
@@ -0,0 +1,122 @@
+# Stand-ins for pymysql connections and the pooled connect(db_name) callables, for tests without a server.
+# IMPORT LIBRARIES
+import threading
+from contextlib import contextmanager
+from pymysql.constants import SERVER_STATUS
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.rowcount = 0
+        self.lastrowid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.rows = list(self.connection.run(self, query, params))
+        self.rowcount = len(self.rows)
+        return self.rowcount
+
+    def executemany(self, query, rows):
+        for params in rows:
+            self.execute(query, params)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size=1):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def nextset(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """
+    A connection that answers each statement from responses: {substring of the query: rows}, where
+    rows is a list of dicts or a callable (cursor, query, params) -> rows that may raise. The first
+    substring found in the query answers it, other statements return no rows. Every statement is
+    kept in executed. Like a server with autocommit off, a statement opens a transaction that
+    commit() and rollback() end.
+    """
+    def __init__(self, name='fake', responses=None):
+        self.name = name
+        self.responses = dict(responses or {})
+        self.executed = []
+        self.server_status = 0
+        self.commits = 0
+        self.rollbacks = 0
+        self.pings = 0
+        self.closed = False
+        self.autocommit_mode = False
+        self.ping_error = None
+        self._read_timeout = None
+        self._write_timeout = None
+        self.lock = threading.Lock()
+
+    def run(self, cursor, query, params):
+        with self.lock:
+            self.executed.append((query, params))
+            self.server_status |= SERVER_STATUS.SERVER_STATUS_IN_TRANS
+        for fragment, rows in self.responses.items():
+            if fragment in query:
+                return rows(cursor, query, params) if callable(rows) else \
+                    [dict(row) if isinstance(row, dict) else row for row in rows]
+        return []
+
+    def queries(self, fragment=''):
+        return [query for query, _ in self.executed if fragment in query]
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+        self.server_status &= ~SERVER_STATUS.SERVER_STATUS_IN_TRANS
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.server_status &= ~SERVER_STATUS.SERVER_STATUS_IN_TRANS
+
+    def autocommit(self, value):
+        self.autocommit_mode = value
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if self.ping_error is not None:
+            raise self.ping_error
+
+    def close(self):
+        self.closed = True
+
+
+class FakeShards:
+    """connect(db_name) over one FakeConnection per shard, counting the checkouts of each shard"""
+    def __init__(self, connections):
+        self.connections = dict(connections)
+        self.checkouts = {name: 0 for name in self.connections}
+
+    @contextmanager
+    def connect(self, db_name):
+        self.checkouts[db_name] += 1
+        yield self.connections[db_name]
+
+    def __call__(self, db_name):
+        return self.connect(db_name)
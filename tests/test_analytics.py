@@ -0,0 +1,129 @@
+# IMPORT LIBRARIES
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+import pytest
+from analytics import BookingFrame, load_booking_frame, revenue, utilization_heatmap, peak_slots, booking_costs
+from retention import archive_table
+from global_ids import make_id, EPOCH_MS
+from fakes import FakeConnection, FakeShards
+
+MONDAY = date(2024, 5, 6)
+SUNDAY = date(2024, 5, 12)
+
+
+def hand_frame():
+    # Venues 0 and 1 in Paris, 2 in Rome; bookings as (venue, day after MONDAY, start minute, end minute)
+    venues = pd.DataFrame({'Name': ['A', 'B', 'C'], 'City': ['Paris', 'Paris', 'Rome'],
+                           'Price_per_hour': [100.0, 50.0, 80.0], 'Shard': 'S1'})
+    rows = np.array([(0, 0, 13 * 60, 15 * 60), (0, 0, 16 * 60, 17 * 60 + 30), (1, 5, 13 * 60, 14 * 60),
+                     (2, 0, 13 * 60 + 30, 14 * 60)], dtype=np.int32)
+    bookings = pd.DataFrame({'venue': rows[:, 0], 'day': rows[:, 1], 'start': rows[:, 2], 'end': rows[:, 3]})
+    return BookingFrame(bookings, venues, MONDAY, SUNDAY, {}, 0.0)
+
+
+def test_booking_costs():
+    assert booking_costs(hand_frame()).tolist() == [200.0, 150.0, 50.0, 40.0]
+
+
+def test_revenue_per_venue_city_and_day():
+    by_venue, by_city, by_day = revenue(hand_frame())
+    assert by_venue['Name'].tolist() == ['A', 'B', 'C']
+    assert by_venue['Bookings'].tolist() == [2, 1, 1]
+    assert by_venue['Hours'].tolist() == [3.5, 1.0, 0.5]
+    assert by_venue['Revenue'].tolist() == [350.0, 50.0, 40.0]
+    # 7 days of 10 open hours
+    assert by_venue['Occupancy'].tolist() == pytest.approx([3.5 / 70, 1.0 / 70, 0.5 / 70])
+
+    assert by_city.index.tolist() == ['Paris', 'Rome']
+    assert by_city['Venues'].tolist() == [2, 1]
+    assert by_city['Revenue'].tolist() == [400.0, 40.0]
+    assert by_city['Occupancy'].tolist() == pytest.approx([4.5 / 140, 0.5 / 70])
+
+    assert by_day['Date'].tolist() == list(pd.date_range(MONDAY, SUNDAY))
+    assert by_day['Bookings'].tolist() == [3, 0, 0, 0, 0, 1, 0]
+    assert by_day['Revenue'].tolist() == [390.0, 0, 0, 0, 0, 50.0, 0]
+
+
+def test_utilization_heatmap():
+    heatmap = utilization_heatmap(hand_frame())
+    assert heatmap.shape == (7, 10)
+    assert heatmap.columns[0] == '1 PM' and heatmap.columns[-1] == '10 PM'
+    # One Monday with three venues: 180 venue-minutes per hour
+    assert heatmap.loc['Mon', '1 PM'] == pytest.approx(90 / 180)
+    assert heatmap.loc['Mon', '2 PM'] == pytest.approx(60 / 180)
+    assert heatmap.loc['Mon', '4 PM'] == pytest.approx(60 / 180)
+    assert heatmap.loc['Mon', '5 PM'] == pytest.approx(30 / 180)
+    assert heatmap.loc['Sat', '1 PM'] == pytest.approx(60 / 180)
+    assert heatmap.to_numpy().sum() == pytest.approx((90 + 60 + 60 + 30 + 60) / 180)
+
+
+def test_peak_slots():
+    peaks = peak_slots(hand_frame())
+    assert peaks.iloc[0].tolist() == ['Mon', '13:00', 2, 2.0, 240.0]
+    assert sorted(map(tuple, peaks.iloc[1:].to_numpy().tolist())) == [('Mon', '16:00', 1, 1.0, 150.0),
+                                                                       ('Sat', '13:00', 1, 1.0, 50.0)]
+    assert len(peak_slots(hand_frame(), top=1)) == 1
+
+
+def analytics_shard(name, venues, bookings, archived=()):
+    """
+    A shard with venues (ID, Name, City, Price_per_hour), live bookings and archived bookings
+    given as (VenueID, date, start minute, end minute), answering analytics' queries by date
+    """
+    def in_range(rows):
+        def select(cursor, query, params):
+            start_date, first, last = params
+            return [(venue_id, (day - start_date).days, start, end) for venue_id, day, start, end in rows
+                    if first <= day <= last]
+        return select
+    months = sorted({archive_table(day) for _, day, _, _ in archived})
+    responses = {'information_schema.TABLES': [{'TABLE_NAME': table} for table in months],
+                 'FROM Venues': list(venues),
+                 'FROM Bookings b': in_range(bookings)}
+    for table in months:
+        responses[f"FROM {table}"] = in_range([row for row in archived if archive_table(row[1]) == table])
+    return FakeConnection(name, responses)
+
+
+def test_load_booking_frame_merges_shards_chunks_and_archives():
+    day = lambda offset: MONDAY + timedelta(days=offset)
+    shards = FakeShards({
+        'S1': analytics_shard('S1', [(1, 'A', 'Paris', 100), (2, 'B', 'Paris', 50)],
+                              [(1, day(0), 780, 900), (2, day(6), 780, 840), (7, day(1), 780, 840)],
+                              archived=[(1, day(2), 600, 660)]),
+        # Venue IDs were per shard before global IDs, so the same ID is a different venue here
+        'S2': analytics_shard('S2', [(1, 'C', 'Rome', 80)], [(1, day(3), 810, 840)]),
+    })
+    frame = load_booking_frame(shards, ['S1', 'S2'], MONDAY, SUNDAY, parts=3)
+    assert frame.errors == {}
+    assert frame.venues['Name'].tolist() == ['A', 'B', 'C']
+    assert frame.venues['Shard'].tolist() == ['S1', 'S1', 'S2']
+    # Venue 7 was added after the venues were read, so its booking is left out
+    got = sorted(map(tuple, frame.bookings[['venue', 'day', 'start', 'end']].to_numpy().tolist()))
+    assert got == [(0, 0, 780, 900), (0, 2, 600, 660), (1, 6, 780, 840), (2, 3, 810, 840)]
+    assert revenue(frame)[0]['Revenue'].tolist() == [300.0, 50.0, 40.0]
+
+
+def test_load_booking_frame_reports_a_failing_shard():
+    def fail(cursor, query, params):
+        raise RuntimeError("shard down")
+    shards = FakeShards({'S1': analytics_shard('S1', [(1, 'A', 'Paris', 100)], [(1, MONDAY, 780, 840)]),
+                         'S2': FakeConnection('S2', {'FROM': fail})})
+    frame = load_booking_frame(shards, ['S1', 'S2'], MONDAY, SUNDAY, include_archive=False)
+    assert frame.partial and 'shard down' in frame.errors['S2']
+    assert len(frame.bookings) == 1 and frame.venues['Name'].tolist() == ['A']
+
+
+def test_load_booking_frame_with_global_ids():
+    # Snowflake IDs are far beyond int32 and sparse: about 2^55 two years after the epoch
+    hall, barn, late = (make_id(EPOCH_MS + 2 * 365 * 86400000 + offset, 1, 7) for offset in (0, 5, 9))
+    assert hall > 2 ** 54
+    shards = FakeShards({'S1': analytics_shard('S1', [(hall, 'Hall', 'Paris', 100), (barn, 'Barn', 'Rome', 50)],
+                                               [(barn, MONDAY, 780, 840), (hall, SUNDAY, 600, 720),
+                                                (late, MONDAY, 600, 660)])})
+    frame = load_booking_frame(shards, ['S1'], MONDAY, SUNDAY, include_archive=False)
+    assert frame.bookings['venue'].dtype == np.int32
+    got = sorted(map(tuple, frame.bookings.to_numpy().tolist()))
+    assert got == [(0, 6, 600, 720), (1, 0, 780, 840)]
+    assert revenue(frame)[0].set_index('Name')['Revenue'].to_dict() == {'Hall': 200.0, 'Barn': 50.0}
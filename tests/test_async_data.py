@@ -0,0 +1,141 @@
+# IMPORT LIBRARIES
+import time
+import pytest
+import procedures
+from async_data import AsyncData, SyncData
+from shard_router import load_router
+from booking import BOOKED
+from procedures import DELETED
+from resilience import remaining
+from fakes import FakeConnection, FakeShards
+
+QUERY_SECONDS = 0.2
+
+
+def slow(rows):
+    def answer(cursor, query, params):
+        time.sleep(QUERY_SECONDS)
+        return [dict(row) for row in rows]
+    return answer
+
+
+def venues_shard(name, venues):
+    """A shard whose Venues are venues (dicts), paged by name like MySQL would"""
+    def page(cursor, query, params):
+        time.sleep(QUERY_SECONDS)
+        rows = sorted((venue for venue in venues if 'Name > %s' not in query or venue['Name'] > params[-2]),
+                      key=lambda venue: venue['Name'])
+        return [dict(venue) for venue in rows[:params[-1]]]
+    return FakeConnection(name, {
+        'Overlapping': [{'Overlapping': 0}],
+        'CALL sp_book_venue': [{'Status': BOOKED, 'BookingID': 11}],
+        'DISTINCT City': slow(sorted(({'City': venue['City']} for venue in venues), key=lambda row: row['City'])),
+        'FROM Venues WHERE Name = %s': lambda cursor, query, params: [dict(venue) for venue in venues
+                                                                      if venue['Name'] == params[0]],
+        'FROM Venues ORDER BY Name': slow(sorted(venues, key=lambda venue: venue['Name'])),
+        'FROM Venues': page,
+    })
+
+
+@pytest.fixture
+def shards():
+    router = load_router({'shards': ['A', 'B']})
+    names = [f"Venue {i:02d}" for i in range(12)]
+    venues = {'A': [], 'B': []}
+    for number, name in enumerate(names):
+        venues[router.shard_for(name)].append({'ID': number + 1, 'Name': name, 'City': ['Paris', 'Rome'][number % 2],
+                                               'Capacity': 10, 'Price_per_hour': 5})
+    return router, FakeShards({shard: venues_shard(shard, rows) for shard, rows in venues.items()})
+
+
+def test_independent_reads_run_at_the_same_time(shards):
+    router, fake = shards
+    writes = []
+    aio = AsyncData(fake, ['A', 'B'], router, on_write=lambda: writes.append(1))
+    data = SyncData(aio)
+    started = time.monotonic()
+    results = data.gather(cities=aio.get_cities(), venues=aio.get_all_venues(), page=aio.find_venue("City = %s", ['Rome'],
+                                                                                                    page_size=3))
+    elapsed = time.monotonic() - started
+    # Six shard queries of QUERY_SECONDS each take about as long as one
+    assert elapsed < 2.5 * QUERY_SECONDS
+    assert [row['City'] for row in results['cities'].rows] == ['Paris', 'Rome']
+    assert [row['Name'] for row in results['venues'].rows] == [f"Venue {i:02d}" for i in range(12)]
+    assert {row['Shard'] for row in results['venues'].rows} == {'A', 'B'}
+    assert len(results['page'].rows) == 3 and results['page'].has_next
+    assert writes == []
+
+
+def test_venue_reads_and_writes_go_to_the_venue_shard(shards, monkeypatch):
+    router, fake = shards
+    monkeypatch.setattr(procedures, '_missing', {})
+    writes = []
+    reads = FakeShards(fake.connections)
+    data = SyncData(AsyncData(fake, ['A', 'B'], router, read_connect=reads, on_write=lambda: writes.append(1)))
+    venue = data.get_venue('Venue 03')
+    assert venue['ID'] == 4 and venue['Shard'] == router.shard_for('Venue 03')
+    assert data.check_availability('Venue 03', '2024-05-01', '10:00', '11:00') is True
+    assert data.get_venue('Nowhere') is None
+    assert sum(reads.checkouts.values()) == 3 and sum(fake.checkouts.values()) == 0
+
+    assert data.create_booking('Ann', '2024-05-01', '10:00', '11:00', 'Venue 03') == (BOOKED, 11)
+    assert fake.checkouts[router.shard_for('Venue 03')] == 1
+    assert writes == [1]
+
+
+def test_sync_facade_returns_errors_from_gather(shards):
+    router, fake = shards
+    aio = AsyncData(fake, ['A', 'B'], router)
+    data = SyncData(aio)
+    with pytest.raises(ValueError):
+        data.update_venue('Venue 01')
+    results = data.gather(bad=aio.update_venue('Venue 01'), cities=aio.get_cities())
+    assert isinstance(results['bad'], ValueError) and not results['cities'].partial
+    assert data.timeout == aio.timeout
+
+
+def test_writes_to_the_primary_run_under_the_write_deadline(shards, monkeypatch):
+    router, fake = shards
+    monkeypatch.setattr(procedures, '_missing', {})
+    left = []
+    venue_shard = fake.connections[router.shard_for('Venue 03')]
+    venue_shard.responses.update({
+        'CALL sp_book_venue': lambda cursor, query, params: left.append(remaining()) or [{'Status': BOOKED, 'BookingID': 11}],
+        'CALL sp_delete_venue': lambda cursor, query, params: left.append(remaining()) or [{'Status': DELETED, 'Bookings': 4}],
+    })
+    data = SyncData(AsyncData(fake, ['A', 'B'], router, write_timeout=2.0))
+    assert data.create_booking('Ann', '2024-05-01', '10:00', '11:00', 'Venue 03') == (BOOKED, 11)
+    # A venue with many bookings to delete may be given longer
+    assert data.delete_venue('Venue 03', timeout=60.0) == 4
+    assert 1.0 < left[0] <= 2.0 and 59.0 < left[1] <= 60.0
+    assert remaining() is None
+
+
+def test_mass_adds_run_under_the_write_deadline_and_notify_only_after_a_write(shards, monkeypatch):
+    router, fake = shards
+    left = []
+
+    def upsert_venues(connection, rows):
+        left.append(remaining())
+        if connection.name == 'B':
+            raise ConnectionError("B is down")
+        return len(rows), 0
+    monkeypatch.setattr('async_data.upsert_venues', upsert_venues)
+    writes = []
+    data = SyncData(AsyncData(fake, ['A', 'B'], router, write_timeout=2.0, on_write=lambda: writes.append(1)))
+    results = data.mass_add_venues({'A': [('Hall',)] * 3, 'B': [('Barn',)]}, chunk_size=2)
+    assert results['A'] == (3, 0) and isinstance(results['B'], ConnectionError)
+    assert len(left) == 3 and all(1.0 < seconds <= 2.0 for seconds in left)
+    assert writes == [1]
+
+    assert isinstance(data.mass_add_venues({'B': [('Barn',)]})['B'], ConnectionError)
+    assert writes == [1]
+
+
+def test_venue_name_prefixes_match_wildcards_literally(shards):
+    router, fake = shards
+    data = SyncData(AsyncData(fake, ['A', 'B'], router))
+    data.venue_names('50%_off\\')
+    patterns = {params[0] for connection in fake.connections.values() for query, params in connection.executed
+                if "Name LIKE" in query}
+    assert patterns == {'50\\%\\_off\\\\%'}
@@ -0,0 +1,59 @@
+# IMPORT LIBRARIES
+from datetime import date, time, timedelta
+from availability import AvailabilityIndex, to_minutes, to_date, load_availability
+from fakes import FakeConnection, FakeShards
+
+
+def test_time_and_date_values():
+    assert to_minutes(timedelta(hours=9, minutes=30)) == 570
+    assert to_minutes(time(9, 30)) == 570
+    assert to_minutes('09:30:00') == 570
+    assert to_date('2024-05-01') == date(2024, 5, 1)
+
+
+def test_slots_overlap_unless_they_only_touch():
+    index = AvailabilityIndex()
+    index.add('Hall', '2024-05-01', '10:00', '12:00')
+    assert not index.is_free('Hall', '2024-05-01', '11:00', '13:00')
+    assert not index.is_free('Hall', '2024-05-01', '09:00', '10:30')
+    assert not index.is_free('Hall', '2024-05-01', '10:30', '11:00')
+    assert not index.is_free('Hall', '2024-05-01', '08:00', '14:00')
+    assert index.is_free('Hall', '2024-05-01', '12:00', '13:00')
+    assert index.is_free('Hall', '2024-05-01', '08:00', '10:00')
+    assert index.is_free('Hall', '2024-05-02', '10:00', '12:00')
+    assert index.is_free('Barn', '2024-05-01', '10:00', '12:00')
+
+
+def test_a_long_booking_hides_behind_later_short_ones():
+    # Old data can hold overlapping bookings: the running maximum of the ends still sees the long one
+    index = AvailabilityIndex()
+    index.add('Hall', date(2024, 5, 1), time(8), time(18))
+    index.add('Hall', date(2024, 5, 1), time(9), time(10))
+    index.add('Hall', date(2024, 5, 1), time(11), time(12))
+    assert not index.is_free('Hall', '2024-05-01', '14:00', '15:00')
+    assert index.is_free('Hall', '2024-05-01', '18:00', '19:00')
+    assert index.bookings('Hall', '2024-05-01') == [(480, 1080), (540, 600), (660, 720)]
+
+
+def test_free_slots_and_free_venues():
+    index = AvailabilityIndex()
+    index.add('Hall', '2024-05-01', '10:00', '12:00')
+    index.add('Barn', '2024-05-02', '09:00', '17:00')
+    slots = [('09:00', '11:00'), ('13:00', '15:00')]
+    assert index.free_slots('Hall', '2024-05-01', '2024-05-02', slots) == [
+        (date(2024, 5, 1), '13:00', '15:00'), (date(2024, 5, 2), '09:00', '11:00'), (date(2024, 5, 2), '13:00', '15:00')]
+    assert index.free_venues(['Hall', 'Barn', 'Loft'], '2024-05-02', '10:00', '11:00') == ['Hall', 'Loft']
+
+
+def test_load_availability_reads_every_shard():
+    bookings = {'A': [{'Name': 'Hall', 'Date': date(2024, 5, 1), 'Start_time': timedelta(hours=10),
+                       'End_time': timedelta(hours=12)}],
+                'B': [{'Name': 'Barn', 'Date': date(2024, 5, 1), 'Start_time': timedelta(hours=9),
+                       'End_time': timedelta(hours=10)}]}
+    connections = {name: FakeConnection(name, {'FROM Bookings': rows}) for name, rows in bookings.items()}
+    index, result = load_availability(FakeShards(connections), ['A', 'B'], '2024-05-01', '2024-05-31', ['Hall', 'Barn'])
+    assert not result.partial
+    assert index.free_venues(['Hall', 'Barn'], '2024-05-01', '09:30', '10:30') == []
+    assert index.free_venues(['Hall', 'Barn'], '2024-05-01', '12:00', '13:00') == ['Hall', 'Barn']
+    query, params = connections['A'].executed[0]
+    assert "v.Name IN (%s, %s)" in query and params == ['2024-05-01', '2024-05-31', 'Hall', 'Barn']
@@ -0,0 +1,162 @@
+# IMPORT LIBRARIES
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import pymysql
+import procedures
+from booking import book_venue, BOOKED, CONFLICT, NO_VENUE
+from booking_stress import percentile
+from availability import to_minutes
+from fakes import FakeConnection
+
+
+class BookingShard:
+    """
+    A shard without the stored procedures for book_venue's statements: Venues rows locked by
+    SELECT ... FOR UPDATE until commit or rollback, bookings kept in a list. deadlocks is the
+    share of venue locks that fail with a deadlock, as InnoDB would pick a victim.
+    """
+    def __init__(self, venues, deadlocks=0.0):
+        self.venues = {name: {'ID': venue_id, 'Price_per_hour': 100} for venue_id, name in enumerate(venues, 1)}
+        self.locks = {venue['ID']: threading.Lock() for venue in self.venues.values()}
+        self.bookings = []  # (booking_id, venue_id, date, start, end)
+        self.sequence = 0
+        self.deadlocks = deadlocks
+        self.lock = threading.Lock()
+
+    def connection(self):
+        return BookingConnection(self)
+
+
+class BookingConnection(FakeConnection):
+    def __init__(self, shard):
+        super().__init__('booking-shard')
+        self.shard = shard
+        self.held = []
+        self.pending = []
+
+    def run(self, cursor, query, params):
+        super().run(cursor, query, params)
+        shard = self.shard
+        if query.startswith("CALL"):
+            raise pymysql.err.OperationalError(procedures.ER_SP_DOES_NOT_EXIST, "PROCEDURE does not exist")
+        if "FROM Venues" in query and "FOR UPDATE" in query:
+            venue = shard.venues.get(params[0]) if "Name = %s" in query else \
+                next((row for row in shard.venues.values() if row['ID'] == params[0]), None)
+            if venue is None:
+                return []
+            if random.random() < shard.deadlocks:
+                raise pymysql.err.OperationalError(1213, "Deadlock found when trying to get lock")
+            shard.locks[venue['ID']].acquire()
+            self.held.append(shard.locks[venue['ID']])
+            return [venue]
+        if "b.VenueID = %s AND b.Date = %s" in query:
+            venue_id, day, start, end = params
+            with shard.lock:
+                return [{'ID': booking[0]} for booking in shard.bookings
+                        if booking[1] == venue_id and booking[2] == day
+                        and not (to_minutes(start) >= to_minutes(booking[4]) or to_minutes(end) <= to_minutes(booking[3]))][:1]
+        if query.startswith("INSERT INTO IdSequence"):
+            with shard.lock:
+                shard.sequence += 1
+                cursor.lastrowid = shard.sequence
+            return []
+        if "FROM ShardInfo" in query:
+            return [{'Shard_number': 1}]
+        if query.startswith("INSERT INTO Bookings"):
+            self.pending.append(params[:2] + params[3:])
+        return []
+
+    def _end(self):
+        while self.held:
+            self.held.pop().release()
+        self.pending = []
+
+    def commit(self):
+        with self.shard.lock:
+            self.shard.bookings.extend(self.pending)
+        super().commit()
+        self._end()
+
+    def rollback(self):
+        super().rollback()
+        self._end()
+
+
+@pytest.fixture(autouse=True)
+def without_procedures(monkeypatch):
+    monkeypatch.setattr(procedures, '_missing', {})
+
+
+def overlapping_pairs(bookings):
+    pairs = 0
+    for i, first in enumerate(bookings):
+        for second in bookings[i + 1:]:
+            if first[1:3] == second[1:3] and not (to_minutes(first[3]) >= to_minutes(second[4])
+                                                   or to_minutes(first[4]) <= to_minutes(second[3])):
+                pairs += 1
+    return pairs
+
+
+def test_concurrent_bookings_never_overlap():
+    shard = BookingShard(['Hall'], deadlocks=0.05)
+
+    def attempt(number):
+        start_hour = random.randint(8, 20)
+        started = time.monotonic()
+        status, booking_id = book_venue(shard.connection(), 'Hall', f"stress-{number}", '2024-05-01',
+                                        f"{start_hour}:00:00", f"{start_hour + random.randint(1, 2)}:00:00",
+                                        backoff=0.001)
+        return status, booking_id, time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=50) as executor:
+        outcomes = list(executor.map(attempt, range(300)))
+
+    booked = [booking_id for status, booking_id, _ in outcomes if status == BOOKED]
+    assert overlapping_pairs(shard.bookings) == 0
+    assert len(booked) == len(shard.bookings) == len(set(booked))
+    assert {status for status, _, _ in outcomes} == {BOOKED, CONFLICT}
+    assert percentile([latency for _, _, latency in outcomes], 0.99) < 2.0
+
+
+def test_booking_by_id_and_unknown_venues():
+    shard = BookingShard(['Hall', 'Barn'])
+    status, booking_id = book_venue(shard.connection(), 'ignored', 'Ann', '2024-05-01', '10:00:00', '12:00:00',
+                                    venue_id=2)
+    assert status == BOOKED and shard.bookings[0][:2] == (booking_id, 2)
+    # Touching intervals do not overlap
+    assert book_venue(shard.connection(), 'Barn', 'Bob', '2024-05-01', '12:00:00', '13:00:00')[0] == BOOKED
+    assert book_venue(shard.connection(), 'Barn', 'Cy', '2024-05-01', '11:30:00', '12:30:00') == (CONFLICT, None)
+    assert book_venue(shard.connection(), 'Nowhere', 'Dee', '2024-05-01', '10:00:00', '11:00:00') == (NO_VENUE, None)
+    assert not any(lock.locked() for lock in shard.locks.values())
+
+
+def test_deadlocks_are_retried_then_raised():
+    shard = BookingShard(['Hall'], deadlocks=1.0)
+    connection = shard.connection()
+    with pytest.raises(pymysql.err.OperationalError) as raised:
+        book_venue(connection, 'Hall', 'Ann', '2024-05-01', '10:00:00', '11:00:00', max_retries=3, backoff=0.001)
+    assert raised.value.args[0] == 1213
+    assert len(connection.queries("FOR UPDATE")) == 4
+    assert connection.rollbacks == 4
+
+
+def test_the_procedure_answers_in_one_call():
+    connection = FakeConnection(responses={'CALL sp_book_venue': [{'Status': BOOKED, 'BookingID': 99}]})
+    assert book_venue(connection, 'Hall', 'Ann', '2024-05-01', '10:00:00', '11:00:00') == (BOOKED, 99)
+    assert len(connection.executed) == 1
+
+
+def test_a_failed_rollback_does_not_hide_why_the_booking_failed():
+    def timed_out(cursor, query, params):
+        raise pymysql.err.OperationalError(2013, "Lost connection to MySQL server during query (timed out)")
+    connection = FakeConnection(responses={'CALL sp_book_venue': timed_out})
+
+    def dead():
+        raise pymysql.err.InterfaceError(0, "")
+    connection.rollback = dead
+    with pytest.raises(pymysql.err.OperationalError) as raised:
+        book_venue(connection, 'Hall', 'Ann', '2024-05-01', '10:00:00', '11:00:00')
+    assert raised.value.args[0] == 2013
@@ -0,0 +1,133 @@
+# IMPORT LIBRARIES
+from contextlib import contextmanager
+from global_ids import next_ids, prune_id_sequence, shard_number_of, EPOCH_MS, SEQUENCE_BITS, SHARD_BITS, LEGACY_ID_LIMIT
+from migrations import advance_id_sequence
+from fakes import FakeConnection
+
+NOW_MS = EPOCH_MS + 10**9
+
+
+class IdShard(FakeConnection):
+    """
+    A shard's IdSequence AUTO_INCREMENT and ShardInfo row, on a clock that only moves when told. With
+    increment above 1 the counter steps by it; with lock_mode 2 another session draws a value between
+    each two rows of a multi-row insert, as interleaved AUTO_INCREMENT locking allows.
+    """
+    def __init__(self, shard_number=5, counter=None, now_ms=NOW_MS, lock_mode=1, increment=1):
+        super().__init__(responses={
+            'INSERT INTO IdSequence ()': self.draw,
+            'INSERT IGNORE INTO IdSequence': self.move,
+            'FROM ShardInfo': [{'Shard_number': shard_number}],
+            'AS Clock_slot': self.clock,
+            '@@innodb_autoinc_lock_mode': [{'lock_mode': lock_mode, 'increment': increment}],
+        })
+        self.shard_number = shard_number
+        self.counter = (now_ms - EPOCH_MS) << SEQUENCE_BITS if counter is None else counter  # the next value handed out
+        self.now_ms = now_ms
+        self.lock_mode = lock_mode
+        self.increment = increment
+        self.drawn = []  # every value handed out, to this session or the interleaved one
+
+    def draw(self, cursor, query, params):
+        cursor.lastrowid = self.counter
+        for row in range(query.count("()") - 1):
+            if row and self.lock_mode == 2:
+                self.drawn.append(self.counter)
+                self.counter += self.increment
+            self.drawn.append(self.counter)
+            self.counter += self.increment
+        return []
+
+    def move(self, cursor, query, params):
+        self.counter = max(self.counter, params[0] + 1)
+        return []
+
+    def clock(self, cursor, query, params):
+        return [{'Clock_slot': (self.now_ms - EPOCH_MS) << SEQUENCE_BITS}]
+
+
+class PooledIdShard(IdShard):
+    """The same shard as reached through a pool: its draws go to the counter of side, its autocommit side connection"""
+    def __init__(self, side):
+        super().__init__(side.shard_number)
+        self.responses['INSERT INTO IdSequence ()'] = side.draw
+        self.shard_name = 'pooled'
+        self.side = side
+
+    @contextmanager
+    def side_connection(self):
+        yield self.side
+
+
+def millisecond_of(global_id):
+    return (global_id >> (SHARD_BITS + SEQUENCE_BITS)) + EPOCH_MS
+
+
+def test_batches_over_4096_ids_in_one_millisecond_never_repeat_an_id():
+    shard = IdShard()
+    cursor = shard.cursor()
+    first, second = next_ids(cursor, 5000), next_ids(cursor, 5000)
+    ids = first + second + next_ids(cursor)
+    assert len(set(ids)) == len(ids) == 10001
+    assert ids == sorted(ids)
+    assert {shard_number_of(global_id) for global_id in ids} == {5}
+    # The batches run on into the next milliseconds, and the following draw continues after them
+    assert millisecond_of(first[0]) == NOW_MS
+    assert millisecond_of(ids[-1]) == NOW_MS + 10000 // 4096
+
+
+def test_a_counter_behind_the_clock_is_moved_up_on_the_side_connection(monkeypatch):
+    side = IdShard(counter=10)
+    shard = PooledIdShard(side)
+    ids = next_ids(shard.cursor(), 3)
+    assert [millisecond_of(global_id) for global_id in ids] == [NOW_MS] * 3
+    assert side.queries("INSERT IGNORE INTO IdSequence")
+    # The caller's transaction only draws: nothing in it can wait on another transaction's rows
+    assert shard.queries("INSERT IGNORE") == [] and shard.queries("DELETE") == []
+
+    # The counter is checked again only after KEEP_UP_EVERY
+    side.now_ms += 500
+    later = next_ids(shard.cursor())
+    assert millisecond_of(later[0]) == NOW_MS and later[0] > ids[-1]
+    assert len(side.queries("AS Clock_slot")) == 1
+    monkeypatch.setattr('global_ids.time.monotonic', lambda: 10**9)
+    assert millisecond_of(next_ids(shard.cursor())[0]) == NOW_MS + 500
+    assert len(side.queries("INSERT IGNORE INTO IdSequence")) == 2
+
+
+def test_a_connection_outside_a_pool_just_draws():
+    shard = IdShard(counter=10)
+    ids = next_ids(shard.cursor(), 2)
+    assert [global_id & 4095 for global_id in ids] == [10, 11]
+    assert shard.queries("INSERT IGNORE") == [] and shard.queries("AS Clock_slot") == []
+
+
+def test_prune_deletes_every_drawn_row_below_its_own_in_batches():
+    batches = [1000, 1000, 3]
+    shard = IdShard(counter=5000)
+    shard.responses['DELETE FROM IdSequence'] = lambda cursor, query, params: [{}] * batches.pop(0)
+    assert prune_id_sequence(shard, batch_size=1000) == 2003
+    assert [params for _, params in shard.executed if params] == [(5000, 1000)] * 3
+    assert shard.commits == 4
+
+
+def test_without_consecutive_draws_each_id_gets_its_own_insert():
+    for shard in (IdShard(lock_mode=2), IdShard(increment=7)):
+        cursor = shard.cursor()
+        ids = next_ids(cursor, 4) + next_ids(cursor, 3)
+        assert len(set(ids)) == len(ids) == 7
+        # Every ID comes from a value the counter handed to this session, so no other session has it
+        assert [global_id & 4095 for global_id in ids] == [value & 4095 for value in shard.drawn]
+        assert len(shard.queries("INSERT INTO IdSequence () VALUES ()")) == 7
+        assert len(shard.queries("@@innodb_autoinc_lock_mode")) == 1
+
+
+def test_migration_moves_the_counter_past_every_existing_id():
+    newest = (((NOW_MS + 3 - EPOCH_MS) << SHARD_BITS | 5) << SEQUENCE_BITS) | 4095
+    shard = IdShard(counter=10)
+    shard.responses = dict({'AS Slot': [{'Slot': ((millisecond_of(newest) + 1 - EPOCH_MS) << SEQUENCE_BITS)}]},
+                           **shard.responses)
+    advance_id_sequence(shard.cursor())
+    ids = next_ids(shard.cursor(), 2)
+    assert min(ids) > newest > LEGACY_ID_LIMIT
+    assert millisecond_of(ids[0]) == NOW_MS + 4
@@ -0,0 +1,100 @@
+# IMPORT LIBRARIES
+import csv
+from datetime import date, time
+import pytest
+from import_bookings import import_bookings, parse_booking, write_chunk, write_rejections, ImportIncomplete, NOT_WRITTEN
+from import_venues import read_records
+from resilience import CircuitOpen
+from fakes import FakeConnection, FakeShards
+
+
+def bookings_shard(name, venues, existing=()):
+    """A shard with venues {name: ID} and existing (VenueID, date, start, end) bookings; inserts land in .inserted"""
+    connection = FakeConnection(name)
+    connection.inserted = []
+
+    def allocate(cursor, query, params):
+        cursor.lastrowid = 1
+        return []
+
+    def insert(cursor, query, params):
+        connection.inserted.extend(tuple(params[i:i + 6]) for i in range(0, len(params), 6))
+        return []
+    connection.responses.update({
+        'FROM Venues WHERE Name IN': lambda cursor, query, params: [
+            {'ID': venues[venue], 'Name': venue, 'Price_per_hour': 10} for venue in params if venue in venues],
+        'FROM Bookings b': [{'VenueID': venue_id, 'Date': day, 'Start_time': start, 'End_time': end}
+                            for venue_id, day, start, end in existing],
+        'INSERT INTO IdSequence': allocate,
+        'FROM ShardInfo': [{'Shard_number': 1}],
+        'INSERT INTO Bookings': insert,
+    })
+    return connection
+
+
+def record(venue, client, start, end, day='2024-05-01'):
+    return {'venue_name': venue, 'client_name': client, 'date': day, 'start_time': start, 'end_time': end}
+
+
+def test_parse_booking():
+    assert parse_booking(record(' Hall ', 'Ann', '10:00:00', '11:30')) == \
+        ('Hall', 'Ann', date(2024, 5, 1), time(10), time(11, 30))
+    for bad in (record('Hall', '', '10:00', '11:00'), record('Hall', 'Ann', '11:00', '10:00'),
+                record('Hall', 'Ann', 'noon', '13:00')):
+        with pytest.raises(ValueError):
+            parse_booking(bad)
+
+
+def test_a_chunk_rejects_overlaps_with_the_shard_and_within_itself():
+    connection = bookings_shard('A', {'Hall': 1}, existing=[(1, date(2024, 5, 1), time(9), time(10))])
+    chunk = [(line, parse_booking(item)) for line, item in enumerate([
+        record('Hall', 'Ann', '09:30', '10:30'),  # overlaps the existing booking
+        record('Hall', 'Bob', '12:00', '14:00'),
+        record('hall', 'Cy', '13:00', '15:00'),  # overlaps Bob, names match case-insensitively
+        record('Hall', 'Dee', '14:00', '15:00'),
+        record('Barn', 'Eve', '10:00', '11:00'),
+    ], start=1)]
+    accepted, rejections = write_chunk(connection, chunk)
+    assert accepted == 2
+    assert [(line, reason) for line, _, reason in sorted(rejections)] == [
+        (1, "overlaps another booking"), (3, "overlaps another booking"), (5, "venue does not exist")]
+    assert [booking[2] for booking in connection.inserted] == ['Bob', 'Dee']
+    assert connection.commits == 1
+
+
+def test_a_failing_chunk_is_reported_and_raised_at_the_end(tmp_path):
+    def down(cursor, query, params):
+        raise CircuitOpen("B is unavailable after repeated failures")
+    shards = FakeShards({'A': bookings_shard('A', {'Hall': 1}), 'B': FakeConnection('B', {'': down})})
+    records = [(line, record('Hall' if line % 2 else 'Barn', f"client {line}", f"{10 + line}:00", f"{11 + line}:00"))
+               for line in range(1, 7)] + [(7, None)]
+
+    with pytest.raises(ImportIncomplete) as raised:
+        import_bookings(records, shards, lambda venue: 'A' if venue == 'Hall' else 'B', chunk_size=2,
+                        log=lambda message: None)
+    booked, rejections = raised.value.booked, raised.value.rejections
+    assert booked == {'A': 3}
+    assert isinstance(raised.value.__cause__, CircuitOpen)
+    assert sorted(line for line, _, reason in rejections if reason.startswith(NOT_WRITTEN)) == [2, 4, 6]
+    assert [line for line, _, reason in rejections if not reason.startswith(NOT_WRITTEN)] == [7]
+
+    # The report has the input's columns, so the lines not written can be imported again from it
+    report = tmp_path / 'rejected.csv'
+    write_rejections(str(report), rejections)
+    with open(report, newline='') as saved:
+        rows = list(csv.DictReader(saved))
+    assert [row['line'] for row in rows] == ['2', '4', '6', '7']
+    retry = [(line, item) for line, item in read_records(str(report)) if item['reason'].startswith(NOT_WRITTEN)]
+    shards.connections['B'] = bookings_shard('B', {'Barn': 2})
+    booked, rejections = import_bookings(retry, shards, lambda venue: 'A' if venue == 'Hall' else 'B',
+                                         log=lambda message: None)
+    assert booked == {'B': 3} and rejections == []
+
+
+def test_a_venue_that_cannot_be_located_is_not_written():
+    def locate(venue):
+        raise CircuitOpen("no shard answers")
+    with pytest.raises(ImportIncomplete) as raised:
+        import_bookings([(1, record('Hall', 'Ann', '10:00', '11:00'))], FakeShards({}), locate, log=lambda message: None)
+    assert raised.value.booked == {}
+    assert raised.value.rejections[0][2].startswith(NOT_WRITTEN)
@@ -0,0 +1,70 @@
+# IMPORT LIBRARIES
+import json
+import pytest
+from import_venues import import_venues, parse_venue, upsert_venues
+from shard_router import load_router, locate_venues
+from fakes import FakeConnection, FakeShards
+
+
+def venue_shard(name, venues):
+    """A shard whose Venues table is the dict venues (name -> row), enough for upsert_venues"""
+    sequence = [0]
+
+    def present(cursor, query, params):
+        return [{'Name': venue} for venue in params if venue in venues]
+
+    def allocate(cursor, query, params):
+        cursor.lastrowid = sequence[0] + 1
+        sequence[0] += query.count("()")
+        return []
+
+    def upsert(cursor, query, params):
+        venues[params[1]] = params
+        return []
+    return FakeConnection(name, {'SELECT Name FROM Venues WHERE Name IN': present,
+                                 'INSERT INTO IdSequence': allocate,
+                                 'FROM ShardInfo': [{'Shard_number': 1}],
+                                 'INSERT INTO Venues': upsert})
+
+
+def test_parse_venue_rejects_bad_rows():
+    assert parse_venue({'venue_name': ' Hall ', 'city': 'Paris', 'capacity': '10', 'price_per_hour': '5'}) == \
+        ('Hall', 'Paris', 10, 5.0)
+    for record in ({'venue_name': '', 'city': 'Paris', 'capacity': 1, 'price_per_hour': 1},
+                   {'venue_name': 'Hall', 'city': 'Paris', 'capacity': 0, 'price_per_hour': 1},
+                   {'venue_name': 'Hall', 'city': 'Paris', 'capacity': 'many', 'price_per_hour': 1}):
+        with pytest.raises(ValueError):
+            parse_venue(record)
+
+
+def test_upsert_collapses_repeated_names_and_counts_updates():
+    venues = {'Hall': ('old',)}
+    connection = venue_shard('A', venues)
+    inserted, updated = upsert_venues(connection, [('Hall', 'Paris', 10, 5.0), ('Barn', 'Rome', 20, 6.0),
+                                                   ('Barn', 'Rome', 30, 7.0)])
+    assert (inserted, updated) == (1, 1)
+    assert venues['Barn'][2:] == ('Rome', 30, 7.0)
+    assert connection.commits == 1
+
+
+def test_import_updates_venues_on_their_previous_shard_during_a_resharding(tmp_path):
+    router = load_router({'shards': ['A', 'B', 'C'], 'previous': {'scheme': 'modulo', 'shards': ['A', 'B']}})
+    names = [f"Venue {i}" for i in range(200)]
+    not_moved = [name for name in names if len(router.candidates(name)) == 2][:5]
+    tables = {shard: {} for shard in 'ABC'}
+    for name in not_moved:
+        tables[router.candidates(name)[1]][name] = ('old',)
+    shards = FakeShards({shard: venue_shard(shard, tables[shard]) for shard in 'ABC'})
+    path = tmp_path / 'venues.jsonl'
+    path.write_text('\n'.join(json.dumps({'venue_name': name, 'city': 'Paris', 'capacity': 10, 'price_per_hour': 5})
+                              for name in names) + '\nnot json\n')
+
+    result = import_venues(str(path), shards, lambda batch: locate_venues(router, shards, batch), router.shards,
+                           chunk_size=50, log=lambda message: None)
+
+    # Every venue is stored exactly once, the ones not moved yet where they already were
+    assert sorted(name for table in tables.values() for name in table) == sorted(names)
+    for name in not_moved:
+        assert name in tables[router.candidates(name)[1]] and name not in tables[router.shard_for(name)]
+    assert sum(stats['updated'] for stats in result['shards'].values()) == len(not_moved)
+    assert result['rejected'] == [(201, "not valid JSON")]
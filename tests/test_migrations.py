@@ -0,0 +1,90 @@
+# IMPORT LIBRARIES
+import pytest
+import migrations
+from migrations import add_index, add_column, migrate, explain_check, require_unique_venue_names
+from fakes import FakeConnection
+
+# Plans MySQL gives the hot queries once migrations 2 and 7 are applied
+GOOD_PLANS = {
+    'Name = %s': [{'table': 'Venues', 'type': 'const', 'key': 'idx_venues_name', 'partitions': None}],
+    'City = %s': [{'table': 'Venues', 'type': 'ref', 'key': 'idx_venues_city', 'partitions': None}],
+    'Bookings': [{'table': 'Bookings', 'type': 'range', 'key': 'idx_bookings_venue_date', 'partitions': 'p202405'}],
+}
+SAMPLES = {
+    "SELECT Name FROM Venues LIMIT 1": [{'Name': 'Hall'}],
+    "SELECT City FROM Venues LIMIT 1": [{'City': 'Paris'}],
+    "FROM Bookings WHERE VenueID IS NOT NULL LIMIT 1": [{'VenueID': 7, 'Date': '2024-05-01', 'Start_time': '10:00',
+                                                         'End_time': '11:00'}],
+}
+
+
+def shard_with_plans(plans, samples=SAMPLES):
+    def explain(cursor, query, params):
+        return [dict(row) for fragment, rows in plans.items() if fragment in query for row in rows][:1]
+    return FakeConnection(responses=dict({'EXPLAIN': explain}, **samples))
+
+
+def test_explain_check_passes_indexed_single_partition_plans():
+    connection = shard_with_plans(GOOD_PLANS)
+    assert explain_check(connection) == []
+    # Each hot query is explained with parameters taken from the shard's own rows
+    explained = [(query, params) for query, params in connection.executed if query.startswith("EXPLAIN")]
+    assert [params for _, params in explained] == [('Hall',), ('Paris',), (7, '2024-05-01', '10:00', '11:00')]
+
+
+def test_explain_check_reports_scans_wrong_indexes_and_partition_fanout():
+    plans = dict(GOOD_PLANS,
+                 **{'Name = %s': [{'table': 'Venues', 'type': 'ALL', 'key': None, 'partitions': None}],
+                    'City = %s': [{'table': 'Venues', 'type': 'ref', 'key': 'PRIMARY', 'partitions': None}],
+                    'Bookings': [{'table': 'Bookings', 'type': 'range', 'key': 'idx_bookings_venue_date',
+                                  'partitions': 'p202404,p202405'}]})
+    failures = explain_check(shard_with_plans(plans))
+    assert [(table, allowed, used) for _, table, allowed, used in failures] == [
+        ('Venues', ['idx_venues_name'], None),
+        ('Venues', ['idx_venues_city'], 'PRIMARY'),
+        ('Bookings', ['idx_bookings_venue_date'], 'idx_bookings_venue_date over partitions p202404,p202405'),
+    ]
+
+
+def test_explain_check_skips_queries_without_sample_rows():
+    connection = shard_with_plans(GOOD_PLANS, samples={})
+    assert explain_check(connection) == []
+    assert connection.queries("EXPLAIN") == []
+
+
+def test_add_index_and_add_column_run_again_safely():
+    step = add_index('Venues', 'idx_venues_city', 'City')
+    missing = FakeConnection()
+    step(missing.cursor())
+    assert missing.queries("CREATE INDEX idx_venues_city ON Venues (City)")
+    present = FakeConnection(responses={'information_schema.STATISTICS': [{'1': 1}]})
+    step(present.cursor())
+    assert present.queries("CREATE") == []
+
+    column = add_column('Bookings', 'VenueID', 'BIGINT NULL')
+    present = FakeConnection(responses={'information_schema.COLUMNS': [{'1': 1}]})
+    column(present.cursor())
+    assert present.queries("ALTER TABLE") == []
+
+
+def test_unique_name_index_waits_for_duplicates_to_be_merged():
+    connection = FakeConnection(responses={'HAVING COUNT(*) > 1': [{'Name': 'Hall', 'Copies': 2}]})
+    with pytest.raises(RuntimeError, match="'Hall' \\(2\\)"):
+        require_unique_venue_names(connection.cursor())
+
+
+def test_migrate_applies_pending_versions_in_order(monkeypatch):
+    ran = []
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [
+        (1, "one", ["CREATE TABLE One (ID INT)"]),
+        (2, "two", [lambda cursor: ran.append(2)]),
+        (3, "three", [lambda cursor: ran.append(3)]),
+    ])
+    connection = FakeConnection(responses={'SELECT Version FROM SchemaVersion': [{'Version': 1}]})
+    assert migrate(connection, target_version=2, log=lambda message: None) == [2]
+    assert ran == [2]
+    assert [params for query, params in connection.executed if 'INSERT INTO SchemaVersion' in query] == [(2, "two")]
+    assert connection.commits == 1
+    up_to_date = FakeConnection(responses={'SELECT Version FROM SchemaVersion': [{'Version': 1}, {'Version': 2}]})
+    assert migrate(up_to_date, log=lambda message: None) == [3]
+    assert ran == [2, 3]
@@ -0,0 +1,71 @@
+# IMPORT LIBRARIES
+import pymysql
+import pytest
+import procedures
+from procedures import update_venue, delete_venue, UPDATED, DELETED, NO_VENUE, ER_SP_DOES_NOT_EXIST
+from fakes import FakeConnection
+
+HALL = {'ID': 7 << 32, 'Name': 'Hall', 'City': 'Paris', 'Capacity': 10, 'Price_per_hour': 20}
+
+
+@pytest.fixture(autouse=True)
+def missing(monkeypatch):
+    monkeypatch.setattr(procedures, '_missing', {})
+
+
+def without_procedures(responses):
+    def no_procedure(cursor, query, params):
+        raise pymysql.err.OperationalError(ER_SP_DOES_NOT_EXIST, "PROCEDURE does not exist")
+    return FakeConnection(responses=dict({'CALL': no_procedure}, **responses))
+
+
+def test_procedures_are_given_the_venue_id_before_the_name():
+    connection = FakeConnection(responses={'CALL sp_update_venue': [dict(HALL, Status=UPDATED)],
+                                           'CALL sp_delete_venue': [{'Status': DELETED, 'Bookings': 3}]})
+    assert update_venue(connection, 'Hall', capacity=12, venue_id=HALL['ID']) == (UPDATED, HALL)
+    assert delete_venue(connection, 'Hall', 500, venue_id=HALL['ID']) == (DELETED, 3)
+    assert [params for _, params in connection.executed] == [(HALL['ID'], 'Hall', None, 12, None),
+                                                             (HALL['ID'], 'Hall', 500)]
+
+
+def test_update_without_procedures_finds_the_venue_by_id():
+    connection = without_procedures({'SELECT ID, Name': [HALL]})
+    assert update_venue(connection, 'Hall', price_per_hour=25, venue_id=HALL['ID']) == (UPDATED, HALL)
+    update, reprice, select = connection.executed[1:]
+    assert "WHERE ID = %s" in update[0] and update[1][-1] == HALL['ID']
+    assert "v.ID IN" in reprice[0] and reprice[1] == [HALL['ID']]
+    assert "WHERE ID = %s" in select[0]
+    assert connection.commits == 1
+
+    # Without an ID the venue is still found by name
+    connection = without_procedures({})
+    assert update_venue(connection, 'Gone', city='Rome') == (NO_VENUE, None)
+    assert "WHERE Name = %s" in connection.executed[1][0]
+
+
+def test_delete_without_procedures_finds_the_venue_by_id():
+    connection = without_procedures({'SELECT ID FROM Venues WHERE ID': [{'ID': HALL['ID']}]})
+    assert delete_venue(connection, 'Hall', venue_id=HALL['ID']) == (DELETED, 0)
+    assert connection.queries("DELETE FROM Venues WHERE ID")
+    assert connection.queries("WHERE Name") == []
+
+
+def test_delete_without_procedures_removes_archived_bookings_in_batches():
+    archived = {'BookingsArchive_202301': 3, 'BookingsArchive_202302': 1}
+
+    def delete_archived(cursor, query, params):
+        table = query.split()[2]
+        limit = params[1] if len(params) > 1 else archived[table]
+        rows, archived[table] = min(limit, archived[table]), archived[table] - min(limit, archived[table])
+        return [{}] * rows
+    connection = without_procedures({'information_schema.TABLES': [{'TABLE_NAME': table} for table in archived],
+                                     'SELECT ID FROM Venues WHERE ID': [{'ID': HALL['ID']}],
+                                     'DELETE FROM BookingsArchive_': delete_archived})
+    assert delete_venue(connection, 'Hall', batch_size=2, venue_id=HALL['ID']) == (DELETED, 4)
+    assert archived == {'BookingsArchive_202301': 0, 'BookingsArchive_202302': 0}
+    # Two archived bookings per transaction, then the venue itself; each table is swept once more at the end
+    deletes = [(query.split()[2], params) for query, params in connection.executed if "DELETE FROM BookingsArchive_" in query]
+    assert deletes == [('BookingsArchive_202301', (HALL['ID'], 2)), ('BookingsArchive_202301', (HALL['ID'], 2)),
+                       ('BookingsArchive_202302', (HALL['ID'], 1)), ('BookingsArchive_202302', (HALL['ID'], 2)),
+                       ('BookingsArchive_202301', (HALL['ID'],)), ('BookingsArchive_202302', (HALL['ID'],))]
+    assert connection.commits == 3 and connection.queries("DELETE FROM Venues WHERE ID")
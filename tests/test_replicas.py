@@ -0,0 +1,126 @@
+# IMPORT LIBRARIES
+import time
+import pytest
+import pymysql
+import shard_pool
+from replicas import ReplicaRouter, LEAST_LATENCY
+from fakes import FakeConnection
+
+PRIMARY = {'host': 'primary', 'user': 'u', 'password': 'p', 'database': 'd',
+           'replicas': [{'host': 'replica1'}, {'host': 'replica2'}]}
+
+
+@pytest.fixture
+def servers(monkeypatch):
+    """host -> replication lag in seconds (None: replication stopped, 'down': unreachable); the primary has none"""
+    lags = {'replica1': 0, 'replica2': 0}
+
+    def replica_status(cursor, query, params):
+        lag = lags.get(cursor.connection.name)
+        if cursor.connection.name == 'primary':
+            return []
+        return [{'Seconds_Behind_Source': lag}]
+
+    def connect(**kwargs):
+        if lags.get(kwargs['host']) == 'down':
+            raise pymysql.err.OperationalError(2003, f"Can't connect to MySQL server on '{kwargs['host']}'")
+        return FakeConnection(kwargs['host'], {'SHOW REPLICA STATUS': replica_status})
+    monkeypatch.setattr(shard_pool.pymysql, 'connect', connect)
+    return lags
+
+
+def host_of(router, shard='s', session=None):
+    with router.read(shard, session) as connection:
+        return connection.name
+
+
+def test_reads_rotate_over_the_replicas_and_writes_stay_on_the_primary(servers):
+    router = ReplicaRouter({'s': PRIMARY})
+    assert [host_of(router) for _ in range(4)] == ['replica1', 'replica2', 'replica1', 'replica2']
+    with router.primary('s') as connection:
+        assert connection.name == 'primary'
+    assert router.snapshot()['s/replica1']['reads'] == 2
+
+
+def test_a_shard_without_replicas_reads_from_its_primary(servers):
+    router = ReplicaRouter({'s': dict(PRIMARY, replicas=[])})
+    assert host_of(router) == 'primary'
+
+
+def test_lagging_or_stopped_replicas_are_skipped(servers):
+    servers['replica1'] = 30
+    router = ReplicaRouter({'s': PRIMARY}, max_lag=5.0, check_interval=0.05)
+    assert {host_of(router) for _ in range(4)} == {'replica2'}
+    assert router.snapshot()['s/replica1']['error'] == "30s behind"
+    servers['replica2'] = None
+    time.sleep(0.06)
+    assert host_of(router) == 'primary'
+    assert router.snapshot()['s/replica2']['error'] == "replication stopped"
+    # Caught up: back in rotation once the short wait is over
+    servers['replica1'] = servers['replica2'] = 0
+    time.sleep(0.06)
+    assert {host_of(router) for _ in range(4)} == {'replica1', 'replica2'}
+
+
+def test_unreachable_replicas_wait_retry_after(servers):
+    servers['replica1'] = 'down'
+    router = ReplicaRouter({'s': PRIMARY}, retry_after=0.1)
+    assert {host_of(router) for _ in range(3)} == {'replica2'}
+    assert not router.snapshot()['s/replica1']['available']
+    servers['replica1'] = 0
+    time.sleep(0.11)
+    assert {host_of(router) for _ in range(2)} == {'replica1', 'replica2'}
+
+
+def test_a_session_reads_its_own_writes(servers):
+    router = ReplicaRouter({'s': PRIMARY}, sticky_seconds=0.1)
+    router.note_write('alice')
+    assert host_of(router, session='alice') == 'primary'
+    assert host_of(router, session='bob') != 'primary'
+    assert host_of(router) != 'primary'
+    time.sleep(0.11)
+    assert host_of(router, session='alice') != 'primary'
+
+
+def test_least_latency_prefers_the_fastest_replica(servers):
+    router = ReplicaRouter({'s': PRIMARY}, policy=LEAST_LATENCY, check_interval=3600)
+    # Each replica is measured once, unmeasured ones first
+    assert {host_of(router), host_of(router)} == {'replica1', 'replica2'}
+    router.replicas['s'][0].latency = 0.05
+    router.replicas['s'][1].latency = 0.01
+    assert [host_of(router) for _ in range(3)] == ['replica2'] * 3
+    with pytest.raises(ValueError):
+        ReplicaRouter({'s': PRIMARY}, policy='random')
+
+
+def test_hedged_read_falls_back_to_the_primary(servers):
+    servers['replica1'] = servers['replica2'] = 'down'
+    router = ReplicaRouter({'s': PRIMARY})
+    assert router.hedged_read('s', lambda connection: connection.name) == 'primary'
+    assert router.hedge_snapshot()['s']['reads'] == 1
+
+
+def test_hedged_read_beats_a_slow_replica(servers):
+    router = ReplicaRouter({'s': dict(PRIMARY, replicas=[{'host': 'replica1'}])}, hedge_after=0.05)
+
+    def work(connection):
+        if connection.name == 'replica1':
+            time.sleep(0.5)
+        return connection.name
+    started = time.monotonic()
+    assert router.hedged_read('s', work) == 'primary'
+    assert time.monotonic() - started < 0.3
+    assert router.hedge_snapshot()['s'] == {'reads': 1, 'hedged': 1, 'hedge_won': 1, 'hedge_after_ms': 50.0}
+    # A read-your-writes session goes straight to the primary
+    router.note_write('alice')
+    assert router.hedged_read('s', lambda connection: connection.name, 'alice') == 'primary'
+    assert router.hedge_snapshot()['s']['hedged'] == 1
+
+
+def test_hedged_read_raises_when_every_target_fails(servers):
+    router = ReplicaRouter({'s': PRIMARY})
+
+    def work(connection):
+        raise pymysql.err.ProgrammingError(1064, f"syntax error on {connection.name}")
+    with pytest.raises(pymysql.err.ProgrammingError, match="on primary"):
+        router.hedged_read('s', work)
@@ -0,0 +1,72 @@
+# IMPORT LIBRARIES
+from datetime import date, timedelta
+import reshard
+from global_ids import SEQUENCE_BITS, shard_number_of
+from fakes import FakeConnection, FakeShards
+
+ARCHIVE = 'BookingsArchive_202301'
+OLD_HALL = 1 << 40
+LIVE = {'VenueID': OLD_HALL, 'ID': 11, 'Client_name': 'Ann', 'Date': date(2024, 5, 1),
+        'Start_time': timedelta(hours=10), 'End_time': timedelta(hours=11)}
+ARCHIVED = {'BookingID': 3, 'VenueID': OLD_HALL, 'Client_name': 'Bob', 'Date': date(2023, 1, 9),
+            'Start_time': timedelta(hours=9), 'End_time': timedelta(hours=12)}
+
+
+def source_shard():
+    return FakeConnection('A', {
+        'FROM Venues WHERE ID IN': [{'ID': OLD_HALL, 'Name': 'Hall', 'City': 'Paris', 'Capacity': 10,
+                                     'Price_per_hour': 20}],
+        'FROM VenueUsed vu JOIN Bookings b': [LIVE],
+        'information_schema.TABLES': [{'TABLE_NAME': ARCHIVE}],
+        f'FROM {ARCHIVE}': [ARCHIVED],
+    })
+
+
+def target_shard(copied=()):
+    counter = [(10**9 << SEQUENCE_BITS)]
+
+    def draw(cursor, query, params):
+        cursor.lastrowid = counter[0]
+        counter[0] += query.count("()") - 1
+        return []
+    return FakeConnection('B', {
+        'INSERT INTO IdSequence ()': draw,
+        'FROM ShardInfo': [{'Shard_number': 2}],
+        'SELECT ID FROM Venues WHERE Name': [{'ID': 77}] if copied else [],
+        f'FROM {ARCHIVE} WHERE VenueID': list(copied),
+        'SELECT ID, Price_per_hour': lambda cursor, query, params: [{'ID': params[0], 'Price_per_hour': 20}],
+    })
+
+
+def test_move_venues_takes_the_archived_bookings_along(monkeypatch):
+    source, target = source_shard(), target_shard()
+    monkeypatch.setattr(reshard, 'connect_to_shard', FakeShards({'A': source, 'B': target}))
+    assert reshard.move_venues('A', 'B', [OLD_HALL]) == (1, 2)
+
+    # The archive table is made before the target writes anything, as its DDL commits
+    statements = [query.strip() for query, _ in target.executed]
+    create = next(i for i, query in enumerate(statements) if query.startswith(f"CREATE TABLE IF NOT EXISTS {ARCHIVE}"))
+    assert not any(query.startswith("INSERT") for query in statements[:create])
+
+    new_hall = next(params[0] for query, params in target.executed if "INSERT INTO Venues" in query)
+    assert shard_number_of(new_hall) == 2
+    (_, params), = [(query, params) for query, params in target.executed if f"INSERT INTO {ARCHIVE}" in query]
+    assert params[1:] == [new_hall, 'Bob', ARCHIVED['Date'], ARCHIVED['Start_time'], ARCHIVED['End_time']]
+    assert shard_number_of(params[0]) == 2
+    # Both days' rollups follow the venue
+    (_, rollups), = [(query, params) for query, params in target.executed if "INTO VenueDailyStats" in query]
+    assert {(rollups[i], rollups[i + 1]) for i in range(0, len(rollups), 5)} == \
+        {(new_hall, LIVE['Date']), (new_hall, ARCHIVED['Date'])}
+
+    assert source.queries(f"DELETE FROM {ARCHIVE} WHERE VenueID IN")
+    assert target.commits == 1 and source.commits == 1
+
+
+def test_a_second_run_does_not_copy_archived_bookings_again(monkeypatch):
+    copied = [{'VenueID': 77, 'Client_name': 'Bob', 'Date': ARCHIVED['Date'], 'Start_time': ARCHIVED['Start_time'],
+               'End_time': ARCHIVED['End_time']}]
+    source, target = source_shard(), target_shard(copied)
+    monkeypatch.setattr(reshard, 'connect_to_shard', FakeShards({'A': source, 'B': target}))
+    assert reshard.move_venues('A', 'B', [OLD_HALL]) == (1, 1)
+    assert target.queries(f"INSERT INTO {ARCHIVE}") == []
+    assert source.queries(f"DELETE FROM {ARCHIVE}")
@@ -0,0 +1,226 @@
+# IMPORT LIBRARIES
+import time
+import socket
+import threading
+import pytest
+import pymysql
+import shard_pool
+from shard_pool import ShardPool, PoolTimeout
+from replicas import ReplicaRouter
+from scatter_gather import scatter_gather
+from resilience import deadline, remaining, check_deadline, get_breaker, DeadlineExceeded, CircuitOpen, \
+    OPEN, HALF_OPEN, CLOSED
+from fault_proxy import FaultProxy
+from fakes import FakeConnection, FakeShards
+
+# Deadlines, breakers and hedged reads against stand-in servers, and the fault proxy against a local echo server
+PARAMS = {'host': 'db', 'user': 'u', 'password': 'p', 'database': 'd'}
+QUERY = "SELECT 1 AS Answer"
+TIMEOUT = 0.3
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """A stand-in server: connections answer QUERY, and fail to open while server['down'] is set"""
+    server = {'down': False, 'connects': 0}
+
+    def connect(**kwargs):
+        server['connects'] += 1
+        if server['down']:
+            raise pymysql.err.OperationalError(2003, f"Can't connect to MySQL server on '{kwargs['host']}'")
+        return FakeConnection(kwargs['host'], {QUERY: [{'Answer': 1}]})
+    monkeypatch.setattr(shard_pool.pymysql, 'connect', connect)
+    return server
+
+
+def test_deadlines_nest_without_extending_and_expire():
+    assert remaining() is None and check_deadline() is None
+    with deadline(10):
+        with deadline(60):
+            assert 9 < remaining() <= 10
+        with deadline(0.01):
+            time.sleep(0.02)
+            with pytest.raises(DeadlineExceeded):
+                check_deadline()
+        assert 9 < remaining() <= 10
+    assert remaining() is None
+
+
+def test_the_deadline_bounds_the_checkout_and_the_socket_timeouts(server):
+    pool = ShardPool('s1', PARAMS, max_size=1, checkout_timeout=10)
+    with deadline(TIMEOUT):
+        with pool.connection() as connection:
+            assert 0 < connection._read_timeout <= TIMEOUT and connection._write_timeout == connection._read_timeout
+            started = time.monotonic()
+            with pytest.raises(PoolTimeout):
+                with pool.connection():
+                    pass
+            assert time.monotonic() - started < TIMEOUT + 0.1
+    with pool.connection() as connection:
+        assert connection._read_timeout is None
+    with deadline(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded):
+            with pool.connection():
+                pass
+
+
+def test_breaker_opens_fails_fast_then_a_probe_closes_it(server):
+    breaker = get_breaker('s1', failure_threshold=3, reset_after=0.1)
+    pool = ShardPool('s1', PARAMS)
+    server['down'] = True
+    for _ in range(3):
+        with pytest.raises(pymysql.err.OperationalError):
+            with pool.connection():
+                pass
+    assert breaker.state == OPEN and server['connects'] == 3
+
+    started = time.monotonic()
+    with pytest.raises(CircuitOpen):
+        with pool.connection():
+            pass
+    assert time.monotonic() - started < 0.05 and server['connects'] == 3
+
+    # After reset_after one probe goes through; failing, it opens the breaker again at once
+    time.sleep(0.1)
+    with pytest.raises(pymysql.err.OperationalError) as raised:
+        with pool.connection():
+            pass
+    assert not isinstance(raised.value, CircuitOpen) and breaker.state == OPEN
+
+    # Healed: the next probe closes it
+    time.sleep(0.1)
+    server['down'] = False
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(QUERY)
+    assert breaker.state == CLOSED and breaker.snapshot()['failures'] == 0
+    assert breaker.stats['opened'] == 2 and breaker.stats['probes'] == 2
+
+
+def test_a_half_open_breaker_lets_one_probe_through_at_a_time():
+    breaker = get_breaker('s1', failure_threshold=1, reset_after=0.05)
+    breaker.record_failure(pymysql.err.OperationalError(2003, "Can't connect"))
+    assert not breaker.allow()
+    time.sleep(0.05)
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_a_probe_that_times_out_on_a_full_pool_leaves_the_breaker_half_open(server):
+    breaker = get_breaker('s1', failure_threshold=1, reset_after=0.05)
+    pool = ShardPool('s1', PARAMS, max_size=1, checkout_timeout=0.01)
+    with pool.connection():
+        breaker.record_failure(pymysql.err.OperationalError(2003, "Can't connect"))
+        time.sleep(0.05)
+        with pytest.raises(PoolTimeout):
+            with pool.connection():
+                pass
+        # Still half-open, and free for the next caller's probe
+        assert breaker.state == HALF_OPEN and breaker.failures == 1
+        assert breaker.allow()
+
+
+def test_a_stalled_shard_gives_a_partial_result_on_time():
+    def stalled(cursor, query, params):
+        time.sleep(TIMEOUT * 3)
+        return [{'Answer': 1}]
+    shards = FakeShards({'A': FakeConnection('A', {QUERY: [{'Answer': 1}]}),
+                         'B': FakeConnection('B', {QUERY: stalled})})
+    started = time.monotonic()
+    result = scatter_gather(shards, ['A', 'B'], QUERY, timeout=TIMEOUT)
+    assert time.monotonic() - started < TIMEOUT + 0.2
+    assert result.partial and list(result.errors) == ['B'] and result.rows == [{'Answer': 1}]
+
+
+def test_a_scan_hedges_past_a_slow_replica_within_the_deadline(monkeypatch):
+    def connect(**kwargs):
+        return FakeConnection(kwargs['host'], {'SHOW REPLICA STATUS': [{'Seconds_Behind_Source': 0}],
+                                               QUERY: [{'Answer': 1}]})
+    monkeypatch.setattr(shard_pool.pymysql, 'connect', connect)
+    router = ReplicaRouter({'s': dict(PARAMS, host='primary', replicas=[{'host': 'replica1'}])}, hedge_after=0.05)
+
+    def stall_replica(db_name, work):
+        def slow(connection):
+            if connection.name == 'replica1':
+                time.sleep(TIMEOUT * 3)
+            return work(connection)
+        return router.hedged_read(db_name, slow)
+    started = time.monotonic()
+    result = scatter_gather(None, ['s'], QUERY, timeout=TIMEOUT, hedge=stall_replica, shard_column='Shard')
+    assert time.monotonic() - started < TIMEOUT
+    assert not result.partial and result.rows == [{'Answer': 1, 'Shard': 's'}]
+    assert router.hedge_snapshot()['s']['hedge_won'] == 1
+
+
+class EchoServer:
+    """Sends back whatever it receives, on a local port"""
+    def __init__(self):
+        self.sock = socket.create_server(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._echo, args=(client,), daemon=True).start()
+
+    def _echo(self, client):
+        with client:
+            while data := client.recv(65536):
+                client.sendall(data)
+
+
+@pytest.fixture
+def proxy():
+    echo = EchoServer()
+    proxy = FaultProxy('127.0.0.1', echo.port).start()
+    yield proxy
+    proxy.stop()
+    echo.sock.close()
+
+
+def round_trip(proxy, timeout=1.0):
+    with socket.create_connection(('127.0.0.1', proxy.port), timeout=timeout) as sock:
+        started = time.monotonic()
+        sock.sendall(b'ping')
+        return sock.recv(4), time.monotonic() - started
+
+
+def test_fault_proxy_forwards_adds_latency_and_stalls(proxy):
+    assert round_trip(proxy)[0] == b'ping'
+    # Latency is added in both directions
+    proxy.latency = 0.05
+    data, elapsed = round_trip(proxy)
+    assert data == b'ping' and elapsed >= 0.1
+    proxy.latency = 0.0
+
+    proxy.stall()
+    with pytest.raises(socket.timeout):
+        round_trip(proxy, timeout=0.2)
+    proxy.resume()
+    assert round_trip(proxy)[0] == b'ping'
+
+
+def test_fault_proxy_drops_connections(proxy):
+    proxy.drop_rate = 1.0
+    with socket.create_connection(('127.0.0.1', proxy.port), timeout=1.0) as sock:
+        try:
+            sock.sendall(b'ping')
+            assert sock.recv(4) == b''
+        except ConnectionError:
+            pass
+    assert proxy.stats['dropped'] == 1
+
+    proxy.drop_rate = 0.0
+    with socket.create_connection(('127.0.0.1', proxy.port), timeout=1.0) as sock:
+        sock.sendall(b'ping')
+        assert sock.recv(4) == b'ping'
+        proxy.drop_all()
+        assert sock.recv(4) == b''
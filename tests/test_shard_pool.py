@@ -0,0 +1,173 @@
+# IMPORT LIBRARIES
+import time
+import threading
+import pytest
+import pymysql
+import shard_pool
+from shard_pool import ShardPool, PoolTimeout, get_pool, pool_stats
+from fakes import FakeConnection
+
+PARAMS = {'host': 'db', 'user': 'u', 'password': 'p', 'database': 'd'}
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """Every connection the pools open, in order"""
+    connections = []
+
+    def connect(**kwargs):
+        connection = FakeConnection(kwargs['host'])
+        connection.connect_kwargs = kwargs
+        connections.append(connection)
+        return connection
+    monkeypatch.setattr(shard_pool.pymysql, 'connect', connect)
+    return connections
+
+
+def test_connections_are_reused(opened):
+    pool = ShardPool('s1', PARAMS)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second and len(opened) == 1
+    stats = pool.snapshot()
+    assert (stats['hits'], stats['misses'], stats['open'], stats['idle']) == (1, 1, 1, 1)
+
+
+def test_release_rolls_back_only_an_open_transaction(opened):
+    pool = ShardPool('s1', PARAMS)
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    assert connection.rollbacks == 1
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE Venues SET Capacity = 1")
+        connection.commit()
+    # Committed: nothing to roll back, no round trip
+    assert connection.rollbacks == 1
+
+
+def test_pool_is_bounded_and_checkout_times_out(opened):
+    pool = ShardPool('s1', PARAMS, max_size=2, checkout_timeout=0.05)
+    with pool.connection(), pool.connection():
+        started = time.monotonic()
+        with pytest.raises(PoolTimeout):
+            with pool.connection():
+                pass
+        assert time.monotonic() - started >= 0.05
+    assert len(opened) == 2
+    assert pool.snapshot()['timeouts'] == 1
+    # A full pool says nothing about the server
+    assert pool.breaker.failures == 0
+
+
+def test_waiter_gets_the_released_connection(opened):
+    pool = ShardPool('s1', PARAMS, max_size=1, checkout_timeout=2)
+    got = []
+    with pool.connection() as held:
+        waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+        waiter.start()
+        time.sleep(0.05)
+    waiter.join(1)
+    assert got == [held]
+    assert pool.snapshot()['waits'] == 1
+
+
+def test_idle_connections_are_evicted(opened):
+    pool = ShardPool('s1', PARAMS, idle_timeout=0.01)
+    with pool.connection() as first:
+        pass
+    time.sleep(0.02)
+    with pool.connection() as second:
+        pass
+    assert first.closed and second is not first
+    assert pool.snapshot()['evicted'] == 1
+
+
+def test_stale_connections_are_pinged_and_replaced_when_dead(opened):
+    pool = ShardPool('s1', PARAMS, ping_after=0.0)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as again:
+        pass
+    assert again is first and first.pings == 1
+    first.ping_error = pymysql.err.OperationalError(2006, 'MySQL server has gone away')
+    with pool.connection() as replacement:
+        pass
+    assert replacement is not first and first.closed
+    assert pool.snapshot()['discarded'] == 1
+
+
+def test_dead_idle_connections_are_replaced_within_one_checkout(opened, monkeypatch):
+    pool = ShardPool('s1', PARAMS, max_size=3, ping_after=0.0)
+    with pool.connection(), pool.connection(), pool.connection():
+        pass
+    for connection in opened:
+        connection.ping_error = pymysql.err.OperationalError(2006, 'MySQL server has gone away')
+    calls = []
+    acquire = pool.acquire
+    monkeypatch.setattr(pool, 'acquire', lambda: calls.append(1) or acquire())
+    with pool.connection() as connection:
+        assert connection is opened[3]
+    assert calls == [1] and all(dead.closed for dead in opened[:3])
+    stats = pool.snapshot()
+    assert (stats['discarded'], stats['open'], stats['checkouts']) == (3, 1, 4)
+
+
+def test_broken_connections_are_not_returned(opened):
+    pool = ShardPool('s1', PARAMS)
+    with pytest.raises(pymysql.err.OperationalError):
+        with pool.connection() as connection:
+            raise pymysql.err.OperationalError(2013, 'Lost connection to MySQL server during query')
+    assert connection.closed
+    assert pool.snapshot()['open'] == 0
+    # Errors of the statement itself leave the connection in the pool
+    with pytest.raises(pymysql.err.ProgrammingError):
+        with pool.connection() as connection:
+            raise pymysql.err.ProgrammingError(1064, 'syntax error')
+    assert not connection.closed and pool.snapshot()['idle'] == 1
+
+
+def test_read_timeouts_do_not_open_the_breaker_but_failed_connects_do(opened, monkeypatch):
+    pool = ShardPool('s1', PARAMS)
+    pool.breaker.failure_threshold = 2
+    for _ in range(5):
+        with pytest.raises(pymysql.err.OperationalError):
+            with pool.connection():
+                raise pymysql.err.OperationalError(2013, 'Lost connection to MySQL server during query (timed out)')
+    assert pool.breaker.snapshot()['state'] == 'closed'
+
+    def refused(**kwargs):
+        raise pymysql.err.OperationalError(2003, "Can't connect to MySQL server")
+    monkeypatch.setattr(shard_pool.pymysql, 'connect', refused)
+    for _ in range(2):
+        with pytest.raises(pymysql.err.OperationalError):
+            with pool.connection():
+                pass
+    assert pool.breaker.snapshot()['state'] == 'open'
+
+
+def test_the_side_connection_autocommits_apart_from_the_pool(opened):
+    pool = ShardPool('s1', PARAMS, max_size=1)
+    with pool.connection() as connection:
+        with connection.side_connection() as side:
+            assert side is not connection and side.autocommit_mode
+            assert side.queries("innodb_lock_wait_timeout")
+        with pytest.raises(pymysql.err.OperationalError):
+            with connection.side_connection() as side:
+                raise pymysql.err.OperationalError(2013, "Lost connection")
+        assert side.closed
+        with pool.side_connection() as replacement:
+            assert replacement is not side
+    assert pool.snapshot()['open'] == 1
+    pool.close()
+    assert replacement.closed
+
+
+def test_pools_are_shared_per_name(opened):
+    assert get_pool('s1', PARAMS) is get_pool('s1', PARAMS)
+    with get_pool('s1', PARAMS).connection():
+        pass
+    assert pool_stats()['s1']['checkouts'] == 1
@@ -0,0 +1,131 @@
+# IMPORT LIBRARIES
+import hashlib
+import pytest
+from shard_router import HashRing, ModuloPlacement, ShardRouter, load_router, locate_venue, locate_venues
+from global_ids import make_id, EPOCH_MS
+from fakes import FakeConnection, FakeShards
+
+LATER_MS = EPOCH_MS + 10 ** 9  # IDs made this long after the epoch are above the legacy AUTO_INCREMENT range
+NAMES = [f"Venue {i}" for i in range(2000)]
+
+
+def test_ring_places_every_key_on_a_shard_and_is_stable():
+    ring = HashRing(['A', 'B', 'C'])
+    owners = [ring.shard_for(name) for name in NAMES]
+    assert set(owners) == {'A', 'B', 'C'}
+    assert owners == [HashRing(['A', 'B', 'C']).shard_for(name) for name in NAMES]
+    # Virtual nodes keep the shares close to even
+    for shard in 'ABC':
+        assert 0.2 < owners.count(shard) / len(NAMES) < 0.47
+
+
+def test_adding_a_shard_only_moves_keys_to_it():
+    before = HashRing(['A', 'B', 'C'])
+    after = HashRing(['A', 'B', 'C', 'D'])
+    moved = [name for name in NAMES if before.shard_for(name) != after.shard_for(name)]
+    assert all(after.shard_for(name) == 'D' for name in moved)
+    assert 0.1 < len(moved) / len(NAMES) < 0.4
+
+
+def test_modulo_placement_is_the_original_layout():
+    placement = ModuloPlacement(['EventManager1', 'EventManager2'])
+    for name in NAMES[:50]:
+        expected = 'EventManager1' if int(hashlib.sha256(name.encode()).hexdigest(), 16) % 2 == 0 else 'EventManager2'
+        assert placement.shard_for(name) == expected
+
+
+def test_empty_placements_are_refused():
+    with pytest.raises(ValueError):
+        HashRing([])
+    with pytest.raises(ValueError):
+        ModuloPlacement([])
+
+
+def test_candidates_list_the_previous_owner_while_resharding():
+    router = load_router({'shards': ['A', 'B', 'C'], 'previous': {'scheme': 'modulo', 'shards': ['A', 'B']}})
+    assert router.shards == ['A', 'B', 'C']
+    for name in NAMES[:200]:
+        candidates = router.candidates(name)
+        assert candidates[0] == router.shard_for(name)
+        previous = router.previous.shard_for(name)
+        assert candidates == ([candidates[0]] if previous == candidates[0] else [candidates[0], previous])
+    assert ShardRouter(HashRing(['A', 'B'])).candidates('x') == [HashRing(['A', 'B']).shard_for('x')]
+
+
+def test_shard_numbers_route_ids():
+    router = load_router({'shards': ['A', 'B'], 'numbers': {'A': 3, 'B': 7}})
+    assert router.shard_for_id(make_id(LATER_MS, 7, 1)) == 'B'
+    assert router.shard_for_id(make_id(LATER_MS, 3, 4095)) == 'A'
+    assert router.shard_for_id(42) is None  # an AUTO_INCREMENT ID from before global IDs
+    with pytest.raises(ValueError):
+        router.shard_for_id(make_id(LATER_MS, 9, 1))
+    with pytest.raises(ValueError):
+        load_router({'shards': ['A', 'B'], 'numbers': {'A': 1, 'B': 1}})
+
+
+def moving_venue(router):
+    return next(name for name in NAMES if len(router.candidates(name)) == 2)
+
+
+def test_locate_venue_without_a_resharding_does_not_touch_the_database():
+    router = load_router({'shards': ['A', 'B']})
+    shards = FakeShards({'A': FakeConnection('A'), 'B': FakeConnection('B')})
+    assert locate_venue(router, shards, 'Hall') == router.shard_for('Hall')
+    assert shards.checkouts == {'A': 0, 'B': 0}
+
+
+def test_locate_venue_probes_the_previous_owner():
+    router = load_router({'shards': ['A', 'B', 'C'], 'previous': {'scheme': 'modulo', 'shards': ['A', 'B']}})
+    name = moving_venue(router)
+    owner, previous = router.candidates(name)
+    connections = {shard: FakeConnection(shard) for shard in 'ABC'}
+    connections[previous].responses["FROM Venues WHERE Name"] = [{'ID': 1}]
+    shards = FakeShards(connections)
+    # Not moved yet: found on the previous owner after a miss on the new one
+    assert locate_venue(router, shards, name) == previous
+    assert connections[owner].executed[0][1] == (name,)
+    # Moved: the new owner answers first
+    connections[owner].responses["FROM Venues WHERE Name"] = [{'ID': 2}]
+    assert locate_venue(router, shards, name) == owner
+    # Nowhere yet (a new venue): its new owner
+    connections[owner].responses.clear()
+    connections[previous].responses.clear()
+    assert locate_venue(router, shards, name) == owner
+
+
+def test_locate_venue_routes_by_id_without_probing():
+    router = load_router({'shards': ['A', 'B', 'C'], 'previous': {'scheme': 'modulo', 'shards': ['A', 'B']}})
+    shards = FakeShards({shard: FakeConnection(shard) for shard in 'ABC'})
+    name = moving_venue(router)
+    venue_id = make_id(LATER_MS, router.numbers['C'], 1)
+    assert locate_venue(router, shards, name, venue_id) == 'C'
+    assert sum(shards.checkouts.values()) == 0
+
+
+def venues_on(shard, names):
+    """A shard holding the venues in names (a set the test may change)"""
+    def present(cursor, query, params):
+        return [{'Name': name} for name in params if name in names]
+    return FakeConnection(shard, {'FROM Venues WHERE Name': present})
+
+
+def test_locate_venues_batches_the_probes():
+    router = load_router({'shards': ['A', 'B', 'C'], 'previous': {'scheme': 'modulo', 'shards': ['A', 'B']}})
+    moving = [name for name in NAMES if len(router.candidates(name)) == 2][:30]
+    staying = [name for name in NAMES if len(router.candidates(name)) == 1][:5]
+    not_moved = set(moving[:10])
+    moved = set(moving[10:20])  # the rest are new venues
+    holding = {shard: set() for shard in 'ABC'}
+    for name in not_moved:
+        holding[router.candidates(name)[1]].add(name)
+    for name in moved:
+        holding[router.candidates(name)[0]].add(name)
+    shards = FakeShards({shard: venues_on(shard, holding[shard]) for shard in 'ABC'})
+
+    located = locate_venues(router, shards, moving + staying)
+    assert located == {name: locate_venue(router, shards, name) for name in moving + staying}
+    assert all(located[name] == router.candidates(name)[1] for name in not_moved)
+    assert all(located[name] == router.shard_for(name) for name in moving[10:] + staying)
+    # At most one IN query on each of a venue's two candidates per batch, never one per venue
+    probes = sum(len(connection.queries("Name IN")) for connection in shards.connections.values())
+    assert probes <= 2 * len({tuple(router.candidates(name)) for name in moving})
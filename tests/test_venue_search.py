@@ -0,0 +1,38 @@
+# IMPORT LIBRARIES
+from venue_search import VenueSearchIndex
+
+NAMES = ['Abbey Hall', 'Oak Barn', 'Harbour View', 'The Loft', 'Bay Room']
+
+
+def index():
+    venues = VenueSearchIndex()
+    venues.load({'Name': name, 'City': 'Paris', 'Capacity': 10, 'Price_per_hour': 5, 'Shard': 'A'} for name in NAMES)
+    return venues
+
+
+def matches(results):
+    return [(venue['Name'], venue['Match']) for venue in results]
+
+
+def test_keywords_rank_exact_prefix_word_prefix_then_substring():
+    assert matches(index().search('oak barn')) == [('Oak Barn', 'exact')]
+    assert matches(index().search('bar')) == [('Oak Barn', 'word prefix')]
+    assert matches(index().search('bour')) == [('Harbour View', 'substring')]
+
+
+def test_short_keywords_match_inside_words_too():
+    venues = index()
+    assert matches(venues.search('b')) == [('Bay Room', 'prefix'), ('Oak Barn', 'word prefix'),
+                                           ('Abbey Hall', 'substring'), ('Harbour View', 'substring')]
+    assert matches(venues.search('ar')) == [('Harbour View', 'substring'), ('Oak Barn', 'substring')]
+    assert matches(venues.search('b', limit=2)) == [('Bay Room', 'prefix'), ('Oak Barn', 'word prefix')]
+
+
+def test_one_caller_per_interval_reloads_a_stale_index(monkeypatch):
+    venues = VenueSearchIndex()
+    clock = [100.0]
+    monkeypatch.setattr('venue_search.time.monotonic', lambda: clock[0])
+    assert venues.claim_reload(30.0)
+    assert not venues.claim_reload(30.0)
+    clock[0] += 30.0
+    assert venues.claim_reload(30.0)